@@ -6,16 +6,26 @@
 # Description:
 # - Script Header, Imports, Core Configuration Constants.
 # - NEW: Paths for admin config and interaction logs.
-# - NEW: Import aiofiles.
 #
 # Version: ROADMAP_INTEGRATION_P1
 # -----------------------------------------------------------------------------
 
 print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part1_Integrate: Script execution begins.")
-import sys, logging, time, re, asyncio, requests, json, os
+import sys, logging, time, re, asyncio, json, os
+import hashlib, heapq, math # NEW: Knowledge index (chunk hashing, BM25 ranking)
 import pathlib # NEW: For easier path manipulation
-import aiofiles # NEW: For asynchronous file I/O
-from collections import deque
+import aiohttp # NEW: Pooled asyncio HTTP client for Ollama
+import sqlite3 # NEW: Optional SQLite (WAL) interaction log backend
+import threading # NEW: Serializes log backend access between writer hops and admin queries
+import struct # NEW: Sidecar line-offset index for .jsonl logs
+import gzip, shutil # NEW: Compression of rotated log segments
+import csv, zlib # NEW: Analytics CSV export, log file fingerprints
+import concurrent.futures # NEW: Dedicated sendText worker thread
+from collections import deque, OrderedDict
+try:
+    import numpy as np # Optional: only needed for embedding-based knowledge retrieval
+except ImportError:
+    np = None
 try:
     from WPP_Whatsapp import Create
     print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part1_Integrate: WPP_Whatsapp.Create imported.")
@@ -45,6 +55,24 @@ DEFAULT_OLLAMA_API_BASE_URL: str = "http://localhost:11434"
 DEFAULT_OLLAMA_CHAT_ENDPOINT: str = f"{DEFAULT_OLLAMA_API_BASE_URL}/api/chat"
 DEFAULT_OLLAMA_MODEL_NAME: str = "gemma3:4b"
 DEFAULT_OLLAMA_REQUEST_TIMEOUT_SECONDS: int = 1200000
+DEFAULT_OLLAMA_HTTP_MAX_CONNECTIONS: int = 8 # Pooled keep-alive connections to the Ollama server
+DEFAULT_OLLAMA_HTTP_KEEPALIVE_SECONDS: float = 300.0 # Idle time before a pooled connection is closed
+DEFAULT_OLLAMA_STREAMING_SETTINGS: dict = {
+    "enabled": False,        # Stream tokens from Ollama and deliver the reply in pieces
+    "flush_on": "sentence",  # "sentence" or "paragraph"
+    "min_chunk_chars": 60    # Avoid sending very short WhatsApp messages
+}
+
+# --- LLM Work Scheduler (Defaults for admin_config.json "llm_scheduler") ---
+# Admin jobs are always served first (plus reserved admin-only workers); other lanes share workers by weight.
+# Background lanes (e.g. conversation summaries) only run when no foreground job is waiting.
+DEFAULT_LLM_SCHEDULER_SETTINGS: dict = {
+    "workers": 2,
+    "admin_reserved_workers": 1,
+    "lane_weights": {"outreach": 3, "reactive": 1, "campaign": 1},
+    "background_lanes": ["summary"],
+    "max_background_workers": 1
+}
 
 # --- AI Behavior Settings (Defaults for admin_config.json) ---
 DEFAULT_AI_TOGGLE_PASSPHRASE: str = "ddont sspeak"
@@ -64,6 +92,146 @@ DEFAULT_AI_SYSTEM_PROMPT_ARABIC: str = ("أنت مساعد آلي لوكالة 
 "إذا كان السؤال يتعلق بموضوعات خارج نطاق خدماتنا، أجب بأدب أنك لا تستطيع المساعدة في ذلك."
 )
 KNOWLEDGE_FILE_PATH: str = "./hosam_knowledge_arabic.txt" # This can also be moved to config if desired
+DEFAULT_KNOWLEDGE_SETTINGS: dict = {
+    "mode": "bm25",               # "bm25" (top-k relevant chunks), "embedding" (semantic top-k) or "whole_file" (legacy)
+    "top_k": 4,
+    "chunk_max_chars": 700,
+    "check_interval_seconds": 5.0, # How often the knowledge file's mtime is checked
+    "embedding_model": "nomic-embed-text",
+    "embedding_base_url": "",     # Empty = use ollama_api_base_url
+    "embedding_timeout_seconds": 60.0,
+    "embedding_concurrency": 4,
+    "embedding_index_dir": "./knowledge_index/"
+}
+DEFAULT_PROMPT_BUDGET_SETTINGS: dict = {
+    "enabled": True,
+    "tokenizer": "char_ratio",      # Name of an estimator in TOKEN_ESTIMATORS
+    "chars_per_token": 2.5,         # Starting ratio (Arabic text tokenizes densely)
+    "calibrate": True,              # Refine the ratio from Ollama's prompt_eval_count
+    "reserved_output_tokens": 512,  # Kept free for the model's reply
+    "safety_margin_tokens": 64
+}
+DEFAULT_PROMPT_CACHE_SETTINGS: dict = {
+    "prompt_layout": "prefix_stable", # "prefix_stable" (static system prompt first, per-request parts last) or "legacy"
+    "keep_alive": "30m",              # Sent as keep_alive on /api/chat; "" = Ollama default, -1 = keep loaded forever
+    "warmup_on_startup": True,        # Load the model and prime the KV cache with the static prompt at startup
+    "rewarm_idle_seconds": 0          # Re-warm after this much LLM idle time (0 = disabled)
+}
+DEFAULT_CONVERSATION_SUMMARY_SETTINGS: dict = {
+    "enabled": False,
+    "keep_recent_turns": 6,   # Raw user/assistant exchanges kept per chat; older ones are folded into the summary
+    "min_turns_to_fold": 4,   # Evicted messages to collect before calling the LLM
+    "max_summary_chars": 1200
+}
+DEFAULT_REPLY_CACHE_SETTINGS: dict = {
+    "enabled": True,
+    "ttl_seconds": 3600,
+    "max_entries": 500,
+    "first_turn_only": True,  # Replies are cached without history, so only serve them to chats without history
+    "semantic_enabled": False, # Also reuse replies for paraphrased prompts (embedding similarity, needs numpy)
+    "semantic_threshold": 0.92,
+    "semantic_max_entries_per_role": 200
+}
+DEFAULT_LOG_WRITER_SETTINGS: dict = {
+    "enabled": True,                # False = write every turn directly (one file open per turn)
+    "batch_max_entries": 100,
+    "batch_max_delay_seconds": 0.5,
+    "max_open_files": 64,           # LRU of open per-chat .jsonl handles
+    "fsync": "interval",            # "always" (every batch), "interval" or "never" (leave it to the OS)
+    "fsync_interval_seconds": 5.0
+}
+DEFAULT_LOG_STORAGE_SETTINGS: dict = {
+    "backend": "jsonl",             # "jsonl" (per-chat files) or "sqlite" (single WAL database, indexed queries)
+    "sqlite_path": "./interaction_logs/interaction_logs.sqlite3",
+    "sqlite_synchronous": "NORMAL"  # OFF | NORMAL | FULL
+}
+DEFAULT_LOG_ROTATION_SETTINGS: dict = {
+    "enabled": True,
+    "max_file_bytes": 5 * 1024 * 1024, # Rotate a chat's *_history.jsonl once it reaches this size...
+    "max_file_age_days": 30,           # ...or once its oldest line is this old (0 = no age-based rotation)
+    "compress": True,                  # gzip rotated segments
+    "retention_days": 365,             # Delete segments (SQLite: rows) older than this (0 = keep forever)
+    "max_segments_per_file": 50,
+    "check_interval_seconds": 600      # Background maintenance pass (age rotation, compression, retention)
+}
+DEFAULT_LOG_SEARCH_SETTINGS: dict = {
+    "enabled": True,
+    "index_path": "./interaction_logs/log_search_index.sqlite3"
+}
+DEFAULT_ANALYTICS_SETTINGS: dict = {
+    "enabled": True,
+    "checkpoint_path": "./interaction_logs/analytics_checkpoint.json", # Aggregates + per-file offsets (delete to recount)
+    "max_days": 400,                # Daily counters kept
+    "max_chats_per_campaign": 50000, # Chats tracked for campaign reply rates
+    "top_chats_capacity": 200       # Counters used to approximate the most active chats
+}
+DEFAULT_CONTACT_CACHE_SETTINGS: dict = {
+    "enabled": True,
+    "ttl_seconds": 86400,           # Resolved display names
+    "negative_ttl_seconds": 600,    # Chats without a name / failed lookups (retried after this)
+    "max_entries": 5000,
+    "lookup_wait_seconds": 2.0,     # Max wait for a pending lookup when the aggregation timer fires
+    "persist_path": "./contact_names_cache.json", # "" = memory only
+    "persist_interval_seconds": 300
+}
+DEFAULT_MESSAGE_INGRESS_SETTINGS: dict = {
+    "max_queue_size": 1000,         # Raw WPP messages waiting for the event loop
+    "overflow_policy": "spill",     # "spill" (to spill_path, replayed in order) | "drop_oldest" | "drop_newest"
+    "spill_path": "./ingress_spill.jsonl"
+}
+DEFAULT_OUTBOUND_SEND_SETTINGS: dict = {
+    "enabled": True,
+    "rate_per_second": 1.0,         # Token bucket refill rate for sends (admin chat exempt); 0 = unpaced
+    "burst": 5,                     # Sends allowed back-to-back before pacing applies
+    "max_attempts": 4,
+    "retry_base_delay_seconds": 2.0, # Doubles per failed attempt...
+    "retry_max_delay_seconds": 60.0, # ...up to this
+    "log_delivery_status": True     # "delivery_status" turns in the chat's interaction log
+}
+DEFAULT_OUTREACH_CAMPAIGN_SETTINGS: dict = {
+    "db_path": "./outreach_campaigns.sqlite3", # Campaign + per-target state (resumable after a crash)
+    "generation_concurrency": 4,    # Proposals generated at once (LLM scheduler "campaign" lane)
+    "send_window": 3,               # Approved messages handed to the send dispatcher at once (pacing is the dispatcher's)
+    "max_targets": 20000,
+    "sample_size": 5                # Default for $campaign sample
+}
+DEFAULT_STATE_PERSISTENCE_SETTINGS: dict = {
+    "enabled": True,
+    "state_dir": "./conversation_state", # snapshot.json + journal.jsonl (histories, summaries, active/prepared outreach)
+    "commit_window_seconds": 0.5,   # Group commit: changes within this window share one journal write (+ fsync)
+    "fsync": True,                  # fsync each journal commit; False leaves flushing to the OS
+    "snapshot_journal_bytes": 8 * 1024 * 1024, # Compact into a new snapshot once the journal grows past this
+    "snapshot_interval_seconds": 3600 # ...or at least this often while it has entries
+}
+DEFAULT_HISTORY_EVICTION_SETTINGS: dict = {
+    "enabled": True,
+    "idle_ttl_seconds": 21600,      # Chats idle this long are moved to the cold store (rehydrated on their next message)
+    "min_idle_seconds": 300,        # Never evict a chat used more recently than this, even over budget
+    "memory_budget_mb": 64,         # Estimated RAM for resident histories/outreach; LRU chats beyond it are evicted
+    "sweep_interval_seconds": 60,
+    "cold_store_path": "./conversation_state/cold_chats.sqlite3"
+}
+DEFAULT_ADAPTIVE_AGGREGATION_SETTINGS: dict = {
+    "enabled": True,                # False: every chat waits message_aggregation_delay_seconds (the unknown-chat default here)
+    "min_window_seconds": 1.5,
+    "max_window_seconds": 15.0,
+    "single_shot_window_seconds": 2.5, # Chats that send one fragment per message
+    "gap_margin_seconds": 1.0,      # Added to the learned 90th-percentile gap
+    "min_gap_samples": 3,           # Gaps (or messages) needed before a chat's own pattern is used
+    "question_window_factor": 0.4,  # Fragment ends with ? or ؟
+    "continuation_window_factor": 1.5, # Fragment ends with ..., ، , or :
+    "long_fragment_chars": 120, "long_fragment_window_factor": 0.6,
+    "short_fragment_chars": 12, "short_fragment_window_factor": 1.3, # "hi", "السلام عليكم": more usually follows
+    "end_markers": ["#"],           # A fragment ending with one of these is sent after min_window_seconds
+    "max_tracked_chats": 20000
+}
+DEFAULT_SPECULATIVE_GENERATION_SETTINGS: dict = {
+    "enabled": False,               # Start reactive generations before the aggregation window closes
+    "quiet_fraction": 0.5,          # Speculate once the buffer has been quiet for this share of its window...
+    "min_quiet_seconds": 1.0,       # ...and at least this long
+    "min_lead_seconds": 1.0,        # Skip when less than this would remain of the window (nothing to gain)
+    "max_concurrent": 1             # Global budget: speculative generations queued or running at once
+}
 
 # --- Initial AI Context & Model Parameter Settings (Defaults for admin_config.json) ---
 DEFAULT_INITIAL_MAX_CHAT_HISTORY_TURNS: int = 20
@@ -124,12 +292,34 @@ g_ollama_api_base_url: str = DEFAULT_OLLAMA_API_BASE_URL
 g_ollama_chat_endpoint: str = DEFAULT_OLLAMA_CHAT_ENDPOINT
 g_ollama_model_name: str = DEFAULT_OLLAMA_MODEL_NAME
 g_ollama_request_timeout: int = DEFAULT_OLLAMA_REQUEST_TIMEOUT_SECONDS
+g_ollama_http_max_connections: int = DEFAULT_OLLAMA_HTTP_MAX_CONNECTIONS
+g_ollama_http_keepalive_seconds: float = DEFAULT_OLLAMA_HTTP_KEEPALIVE_SECONDS
+g_ollama_streaming_settings: dict = DEFAULT_OLLAMA_STREAMING_SETTINGS.copy()
+g_knowledge_settings: dict = DEFAULT_KNOWLEDGE_SETTINGS.copy()
+g_prompt_budget_settings: dict = DEFAULT_PROMPT_BUDGET_SETTINGS.copy()
+g_prompt_cache_settings: dict = DEFAULT_PROMPT_CACHE_SETTINGS.copy()
+g_conversation_summary_settings: dict = DEFAULT_CONVERSATION_SUMMARY_SETTINGS.copy()
+g_reply_cache_settings: dict = DEFAULT_REPLY_CACHE_SETTINGS.copy()
+g_log_writer_settings: dict = DEFAULT_LOG_WRITER_SETTINGS.copy()
+g_log_storage_settings: dict = DEFAULT_LOG_STORAGE_SETTINGS.copy()
+g_log_rotation_settings: dict = DEFAULT_LOG_ROTATION_SETTINGS.copy()
+g_log_search_settings: dict = DEFAULT_LOG_SEARCH_SETTINGS.copy()
+g_analytics_settings: dict = DEFAULT_ANALYTICS_SETTINGS.copy()
+g_contact_cache_settings: dict = DEFAULT_CONTACT_CACHE_SETTINGS.copy()
+g_message_ingress_settings: dict = DEFAULT_MESSAGE_INGRESS_SETTINGS.copy()
+g_outbound_send_settings: dict = DEFAULT_OUTBOUND_SEND_SETTINGS.copy()
+g_outreach_campaign_settings: dict = DEFAULT_OUTREACH_CAMPAIGN_SETTINGS.copy()
+g_state_persistence_settings: dict = DEFAULT_STATE_PERSISTENCE_SETTINGS.copy()
+g_history_eviction_settings: dict = DEFAULT_HISTORY_EVICTION_SETTINGS.copy()
+g_adaptive_aggregation_settings: dict = json.loads(json.dumps(DEFAULT_ADAPTIVE_AGGREGATION_SETTINGS))
+g_speculative_generation_settings: dict = DEFAULT_SPECULATIVE_GENERATION_SETTINGS.copy()
 g_max_chat_history_turns: int = DEFAULT_INITIAL_MAX_CHAT_HISTORY_TURNS
 g_ollama_model_options: dict = DEFAULT_INITIAL_OLLAMA_MODEL_OPTIONS.copy()
 g_command_prefix: str = DEFAULT_COMMAND_PREFIX
 g_max_interaction_log_size: int = DEFAULT_MAX_INTERACTION_LOG_SIZE # For in-memory deque
+g_llm_scheduler_settings: dict = json.loads(json.dumps(DEFAULT_LLM_SCHEDULER_SETTINGS))
 
-# --- Chat Histories and Buffers (Remain in-memory for performance) ---
+# --- Chat Histories and Buffers (In memory; histories are journaled to disk by the state store, Part 23) ---
 CHAT_HISTORIES: dict[str, deque] = {}
 USER_MESSAGE_BUFFERS: dict[str, list[str]] = {}
 USER_MESSAGE_TIMERS: dict[str, asyncio.Task] = {}
@@ -220,6 +410,28 @@ def get_default_admin_config() -> dict:
         # "ollama_chat_endpoint" will be derived from base_url
         "ollama_model_name": DEFAULT_OLLAMA_MODEL_NAME,
         "ollama_request_timeout_seconds": DEFAULT_OLLAMA_REQUEST_TIMEOUT_SECONDS,
+        "ollama_http_max_connections": DEFAULT_OLLAMA_HTTP_MAX_CONNECTIONS,
+        "ollama_http_keepalive_seconds": DEFAULT_OLLAMA_HTTP_KEEPALIVE_SECONDS,
+        "ollama_streaming": DEFAULT_OLLAMA_STREAMING_SETTINGS.copy(),
+        "knowledge_settings": DEFAULT_KNOWLEDGE_SETTINGS.copy(),
+        "prompt_budget": DEFAULT_PROMPT_BUDGET_SETTINGS.copy(),
+        "prompt_cache": DEFAULT_PROMPT_CACHE_SETTINGS.copy(),
+        "conversation_summary": DEFAULT_CONVERSATION_SUMMARY_SETTINGS.copy(),
+        "reply_cache": DEFAULT_REPLY_CACHE_SETTINGS.copy(),
+        "log_writer": DEFAULT_LOG_WRITER_SETTINGS.copy(),
+        "log_storage": DEFAULT_LOG_STORAGE_SETTINGS.copy(),
+        "log_rotation": DEFAULT_LOG_ROTATION_SETTINGS.copy(),
+        "log_search": DEFAULT_LOG_SEARCH_SETTINGS.copy(),
+        "analytics": DEFAULT_ANALYTICS_SETTINGS.copy(),
+        "contact_cache": DEFAULT_CONTACT_CACHE_SETTINGS.copy(),
+        "message_ingress": DEFAULT_MESSAGE_INGRESS_SETTINGS.copy(),
+        "outbound_send": DEFAULT_OUTBOUND_SEND_SETTINGS.copy(),
+        "outreach_campaigns": DEFAULT_OUTREACH_CAMPAIGN_SETTINGS.copy(),
+        "state_persistence": DEFAULT_STATE_PERSISTENCE_SETTINGS.copy(),
+        "history_eviction": DEFAULT_HISTORY_EVICTION_SETTINGS.copy(),
+        "adaptive_aggregation": json.loads(json.dumps(DEFAULT_ADAPTIVE_AGGREGATION_SETTINGS)),
+        "speculative_generation": DEFAULT_SPECULATIVE_GENERATION_SETTINGS.copy(),
+        "script_log_level": logging.getLevelName(SCRIPT_LOG_LEVEL), # DEBUG logs payload previews (capped at 100 chars per message)
         "max_chat_history_turns": DEFAULT_INITIAL_MAX_CHAT_HISTORY_TURNS,
         "ollama_model_options": DEFAULT_INITIAL_OLLAMA_MODEL_OPTIONS.copy(),
         "command_prefix": DEFAULT_COMMAND_PREFIX,
@@ -235,6 +447,7 @@ def get_default_admin_config() -> dict:
         "ai_goals": {}, # Example: {"goal_key": "instruction"}
         "active_goals": [],
         "ai_interaction_style": "friendly_professional", # Default style key or custom string
+        "llm_scheduler": json.loads(json.dumps(DEFAULT_LLM_SCHEDULER_SETTINGS)),
         # Add more settings as needed
     }
 
@@ -245,6 +458,12 @@ def load_admin_config():
     global g_system_prompt, g_ollama_api_base_url, g_ollama_chat_endpoint, g_ollama_model_name
     global g_ollama_request_timeout, g_max_chat_history_turns, g_ollama_model_options
     global g_command_prefix, g_max_interaction_log_size, INTERACTION_LOG
+    global g_ollama_http_max_connections, g_ollama_http_keepalive_seconds, g_llm_scheduler_settings
+    global g_ollama_streaming_settings, g_knowledge_settings, g_prompt_budget_settings, g_prompt_cache_settings
+    global g_conversation_summary_settings, g_reply_cache_settings, g_log_writer_settings, g_log_storage_settings
+    global g_log_rotation_settings, g_log_search_settings, g_analytics_settings, g_contact_cache_settings
+    global g_message_ingress_settings, g_outbound_send_settings, g_outreach_campaign_settings, g_state_persistence_settings
+    global g_history_eviction_settings, g_adaptive_aggregation_settings, g_speculative_generation_settings
 
     defaults = get_default_admin_config()
     if os.path.exists(ADMIN_CONFIG_FILE_PATH):
@@ -254,10 +473,11 @@ def load_admin_config():
                 # Merge loaded config with defaults to ensure all keys are present
                 g_admin_config = {**defaults, **loaded_config}
                 # Ensure nested dictionaries are also merged, e.g., ollama_model_options
-                if 'ollama_model_options' in loaded_config and isinstance(loaded_config['ollama_model_options'], dict):
-                    g_admin_config['ollama_model_options'] = {**defaults['ollama_model_options'], **loaded_config['ollama_model_options']}
-                if 'outreach_settings' in loaded_config and isinstance(loaded_config['outreach_settings'], dict):
-                    g_admin_config['outreach_settings'] = {**defaults['outreach_settings'], **loaded_config['outreach_settings']}
+                for nested_key in ('ollama_model_options', 'outreach_settings', 'llm_scheduler', 'ollama_streaming',
+                                   'knowledge_settings', 'prompt_budget', 'prompt_cache', 'conversation_summary', 'reply_cache', 'log_writer', 'log_storage', 'log_rotation', 'log_search', 'analytics', 'contact_cache', 'message_ingress', 'outbound_send', 'outreach_campaigns', 'state_persistence', 'history_eviction', 'adaptive_aggregation',
+                                   'speculative_generation'):
+                    if nested_key in loaded_config and isinstance(loaded_config[nested_key], dict):
+                        g_admin_config[nested_key] = {**defaults[nested_key], **loaded_config[nested_key]}
 
                 logger.info("Admin config loaded successfully from '%s'.", ADMIN_CONFIG_FILE_PATH)
         except json.JSONDecodeError:
@@ -288,6 +508,34 @@ def load_admin_config():
     g_ollama_chat_endpoint = f"{g_ollama_api_base_url}/api/chat" # Derived
     g_ollama_model_name = g_admin_config.get("ollama_model_name", DEFAULT_OLLAMA_MODEL_NAME)
     g_ollama_request_timeout = g_admin_config.get("ollama_request_timeout_seconds", DEFAULT_OLLAMA_REQUEST_TIMEOUT_SECONDS)
+    g_ollama_http_max_connections = g_admin_config.get("ollama_http_max_connections", DEFAULT_OLLAMA_HTTP_MAX_CONNECTIONS)
+    g_ollama_http_keepalive_seconds = g_admin_config.get("ollama_http_keepalive_seconds", DEFAULT_OLLAMA_HTTP_KEEPALIVE_SECONDS)
+    g_ollama_streaming_settings = {**DEFAULT_OLLAMA_STREAMING_SETTINGS, **g_admin_config.get("ollama_streaming", {})}
+    g_knowledge_settings = {**DEFAULT_KNOWLEDGE_SETTINGS, **g_admin_config.get("knowledge_settings", {})}
+    g_prompt_budget_settings = {**DEFAULT_PROMPT_BUDGET_SETTINGS, **g_admin_config.get("prompt_budget", {})}
+    g_prompt_cache_settings = {**DEFAULT_PROMPT_CACHE_SETTINGS, **g_admin_config.get("prompt_cache", {})}
+    g_conversation_summary_settings = {**DEFAULT_CONVERSATION_SUMMARY_SETTINGS, **g_admin_config.get("conversation_summary", {})}
+    g_reply_cache_settings = {**DEFAULT_REPLY_CACHE_SETTINGS, **g_admin_config.get("reply_cache", {})}
+    g_log_writer_settings = {**DEFAULT_LOG_WRITER_SETTINGS, **g_admin_config.get("log_writer", {})}
+    g_interaction_log_writer.configure(g_log_writer_settings)
+    g_log_storage_settings = {**DEFAULT_LOG_STORAGE_SETTINGS, **g_admin_config.get("log_storage", {})} # Backend switch applies on restart
+    g_log_rotation_settings = {**DEFAULT_LOG_ROTATION_SETTINGS, **g_admin_config.get("log_rotation", {})}
+    g_log_search_settings = {**DEFAULT_LOG_SEARCH_SETTINGS, **g_admin_config.get("log_search", {})}
+    g_analytics_settings = {**DEFAULT_ANALYTICS_SETTINGS, **g_admin_config.get("analytics", {})}
+    g_contact_cache_settings = {**DEFAULT_CONTACT_CACHE_SETTINGS, **g_admin_config.get("contact_cache", {})}
+    g_message_ingress_settings = {**DEFAULT_MESSAGE_INGRESS_SETTINGS, **g_admin_config.get("message_ingress", {})}
+    if g_message_ingress_settings.get("overflow_policy") not in INGRESS_OVERFLOW_POLICIES:
+        logger.warning("Admin config: Unknown message_ingress.overflow_policy '%s'. Using 'spill'.", g_message_ingress_settings.get("overflow_policy"))
+        g_message_ingress_settings["overflow_policy"] = "spill"
+    g_outbound_send_settings = {**DEFAULT_OUTBOUND_SEND_SETTINGS, **g_admin_config.get("outbound_send", {})}
+    g_outreach_campaign_settings = {**DEFAULT_OUTREACH_CAMPAIGN_SETTINGS, **g_admin_config.get("outreach_campaigns", {})}
+    g_state_persistence_settings = {**DEFAULT_STATE_PERSISTENCE_SETTINGS, **g_admin_config.get("state_persistence", {})}
+    g_history_eviction_settings = {**DEFAULT_HISTORY_EVICTION_SETTINGS, **g_admin_config.get("history_eviction", {})}
+    g_adaptive_aggregation_settings = {**json.loads(json.dumps(DEFAULT_ADAPTIVE_AGGREGATION_SETTINGS)), **g_admin_config.get("adaptive_aggregation", {})}
+    g_speculative_generation_settings = {**DEFAULT_SPECULATIVE_GENERATION_SETTINGS, **g_admin_config.get("speculative_generation", {})}
+    configured_log_level = logging.getLevelName(str(g_admin_config.get("script_log_level", logging.getLevelName(SCRIPT_LOG_LEVEL))).upper())
+    logger.setLevel(configured_log_level if isinstance(configured_log_level, int) else SCRIPT_LOG_LEVEL)
+    invalidate_reactive_system_prompt_cache()
     g_max_chat_history_turns = g_admin_config.get("max_chat_history_turns", DEFAULT_INITIAL_MAX_CHAT_HISTORY_TURNS)
     g_ollama_model_options = g_admin_config.get("ollama_model_options", DEFAULT_INITIAL_OLLAMA_MODEL_OPTIONS.copy())
     g_command_prefix = g_admin_config.get("command_prefix", DEFAULT_COMMAND_PREFIX)
@@ -299,6 +547,10 @@ def load_admin_config():
         INTERACTION_LOG = deque(current_log_items, maxlen=new_max_log_size)
     g_max_interaction_log_size = new_max_log_size
 
+    g_llm_scheduler_settings = {**DEFAULT_LLM_SCHEDULER_SETTINGS, **g_admin_config.get("llm_scheduler", {})}
+    if g_llm_scheduler.is_running:
+        g_llm_scheduler.configure(g_llm_scheduler_settings)
+
 
 def save_admin_config():
     """Saves the current g_admin_config dictionary to the JSON file."""
@@ -328,29 +580,14 @@ async def log_interaction_turn(chat_id: str, interaction_type: str, turn_data: d
     Asynchronously logs an interaction turn to a .jsonl file.
     interaction_type: "outreach" or "reactive"
     turn_data: dict containing timestamp, role, content, and other relevant metadata.
+    The turn is stored by the configured log backend; while the buffered log writer runs it is only queued
+    (read_recent_interaction_turns() flushes it first).
     """
     if not chat_id:
         logger.warning("Log interaction: chat_id is empty, cannot log turn.")
         return
 
-    sanitized_chat_id = sanitize_filename(chat_id)
-    log_dir_path = pathlib.Path(INTERACTION_LOGS_DIR)
-    user_log_dir_path = log_dir_path / sanitized_chat_id
-
     try:
-        # Create base logs directory if it doesn't exist
-        if not await asyncio.to_thread(log_dir_path.is_dir):
-            await asyncio.to_thread(log_dir_path.mkdir, parents=True, exist_ok=True)
-            logger.info("Created interaction logs directory: %s", log_dir_path)
-
-        # Create user-specific log directory if it doesn't exist
-        if not await asyncio.to_thread(user_log_dir_path.is_dir):
-            await asyncio.to_thread(user_log_dir_path.mkdir, parents=True, exist_ok=True)
-            logger.info("Created user log directory: %s", user_log_dir_path)
-
-        log_file_name = f"{interaction_type}_history.jsonl"
-        log_file_path = user_log_dir_path / log_file_name
-
         # Ensure essential fields are in turn_data
         if "timestamp_iso" not in turn_data:
             turn_data["timestamp_iso"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -364,15 +601,16 @@ async def log_interaction_turn(chat_id: str, interaction_type: str, turn_data: d
         # turn_data.setdefault("system_prompt_key_active", g_admin_config.get("active_reactive_role"))
         # turn_data.setdefault("outreach_campaign_key", "N/A" if interaction_type != "outreach" else "some_key")
 
-
-        async with aiofiles.open(log_file_path, mode='a', encoding='utf-8') as f:
-            await f.write(json.dumps(turn_data, ensure_ascii=False) + '\n')
+        log_record = (chat_id, interaction_type, turn_data, json.dumps(turn_data, ensure_ascii=False))
+        if g_interaction_log_writer.is_running:
+            g_interaction_log_writer.enqueue(log_record)
+        else: # Writer disabled or not started yet: store directly
+            await asyncio.to_thread(store_log_records, [log_record], False)
         
-        logger.debug("Logged turn to %s for chat_id %s. Data: %s...", log_file_path, chat_id, str(turn_data)[:100])
+        logger.debug("Logged %s turn for chat_id %s. Data: %s...", interaction_type, chat_id, str(turn_data)[:100])
 
     except Exception as e:
-        logger.error("Error logging interaction turn for chat_id %s to %s: %s",
-                     chat_id, user_log_dir_path / (log_file_name if 'log_file_name' in locals() else 'unknown_file'), e, exc_info=False)
+        logger.error("Error logging %s interaction turn for chat_id %s: %s", interaction_type, chat_id, e, exc_info=False)
 
 
 def _get_item_from_numbered_list(list_key: str, identifier: str, pop_list: bool = True) -> str | None:
@@ -462,24 +700,91 @@ def load_knowledge_from_file(filepath: str) -> str:
 # - Now uses globally configured g_ollama_model_name, g_ollama_chat_endpoint, etc.
 # - Logging of interaction turn (user prompt + AI response) will be done by the calling function
 #   (e.g., process_aggregated_messages) AFTER this function returns, so it can include AI response.
+# - NEW: Native asyncio client (OllamaAsyncClient) with a pooled keep-alive session.
+#   query_ollama_chat is now a coroutine, so a long generation no longer blocks the event loop.
 # -----------------------------------------------------------------------------
 print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part4_Integrate: Defining Ollama interaction function.")
 
-def query_ollama_chat(
+class OllamaAsyncClient:
+    """
+    Asyncio HTTP client for the Ollama API.
+    Holds one aiohttp session whose connector keeps a bounded pool of keep-alive connections,
+    so concurrent generations for different chats reuse sockets instead of reconnecting.
+    Pool settings (g_ollama_http_max_connections / g_ollama_http_keepalive_seconds) are read
+    when the session is created; call close() to apply changed settings on the next request.
+    """
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        self._session_loop = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        current_loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not current_loop:
+            connector = aiohttp.TCPConnector(limit=max(1, int(g_ollama_http_max_connections)),
+                                             keepalive_timeout=float(g_ollama_http_keepalive_seconds))
+            self._session = aiohttp.ClientSession(connector=connector, json_serialize=dumps_api_payload) # ChatTurn-aware
+            self._session_loop = current_loop
+            logger.info("Ollama client: New pooled HTTP session created (max connections: %s, keep-alive: %ss).",
+                        g_ollama_http_max_connections, g_ollama_http_keepalive_seconds)
+        return self._session
+
+    async def post_json(self, url: str, payload: dict, timeout_seconds: float) -> dict:
+        """POSTs a JSON payload and returns the decoded JSON response. timeout_seconds is a hard per-request deadline."""
+        session = self._get_session()
+        async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout_seconds)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def post_ndjson_stream(self, url: str, payload: dict, timeout_seconds: float):
+        """POSTs a JSON payload and yields each decoded line of an NDJSON (streaming) response."""
+        session = self._get_session()
+        async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout_seconds)) as response:
+            response.raise_for_status()
+            async for raw_line in response.content:
+                raw_line = raw_line.strip()
+                if raw_line:
+                    yield json.loads(raw_line)
+
+    async def get_json(self, url: str, timeout_seconds: float) -> dict:
+        """GETs a URL and returns the decoded JSON response."""
+        session = self._get_session()
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout_seconds)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def close(self):
+        """Closes the pooled session (and all keep-alive connections)."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Ollama client: Pooled HTTP session closed.")
+        self._session = None
+        self._session_loop = None
+
+g_ollama_client = OllamaAsyncClient()
+
+
+async def query_ollama_chat(
     chat_id: str,
     user_prompt_text: str,
     knowledge_content: str,
     custom_system_prompt: str = None, # For outreach or specific tasks
-    specific_chat_history_deque: deque = None # For outreach or specific tasks
+    specific_chat_history_deque: deque = None, # For outreach or specific tasks
+    deadline_seconds: float = None, # Per-request deadline; defaults to g_ollama_request_timeout
+    on_text_chunk = None, # Optional async callable(str); enables streaming when ollama_streaming.enabled
+    request_stats: dict = None, # Optional out-param: filled with token usage for the interaction log
+    commit_history: bool = True # False: leave history and INTERACTION_LOG untouched (speculative generations)
     ) -> str:
     """
     Queries Ollama /api/chat. Uses global defaults or custom prompts/history.
     Updates the provided history deque (either global CHAT_HISTORIES[chat_id] or specific_chat_history_deque).
     Returns AI's response string or an error message string.
+    Cancelling the awaiting task aborts the in-flight HTTP request; history is left untouched.
+    In streaming mode each token delta is passed to on_text_chunk as it arrives; the full text is still returned.
+    The prompt is packed into the num_ctx budget by assemble_chat_messages (see prompt_budget settings).
     """
     # These globals are now populated from g_admin_config
     global g_system_prompt, g_ollama_model_name, g_max_chat_history_turns, g_ollama_model_options
-    global g_ollama_chat_endpoint, g_ollama_request_timeout
+    global g_ollama_chat_endpoint, g_ollama_request_timeout, g_last_ollama_activity_time
     global CHAT_HISTORIES, INTERACTION_LOG # For in-memory log
 
     # Determine system prompt to use
@@ -497,84 +802,93 @@ def query_ollama_chat(
         logger.info("Ollama chat (Outreach Context): Using specific history for chat_id '%s'. Model: '%s'. Deque maxlen: %s.",
                     chat_id, g_ollama_model_name, history_deque_to_update.maxlen)
     else: # Standard reactive chat
-        # Ensure maxlen is derived from g_max_chat_history_turns (from admin_config)
-        standard_maxlen = g_max_chat_history_turns * 2 if g_max_chat_history_turns > 0 else None
+        # Ensure maxlen is derived from g_max_chat_history_turns (from admin_config) or the summary settings
+        standard_maxlen = get_history_maxlen()
         if chat_id not in CHAT_HISTORIES:
             CHAT_HISTORIES[chat_id] = deque(maxlen=standard_maxlen)
             logger.debug("Ollama chat (Reactive Context): New history deque for chat_id '%s', maxlen: %s.",
                          chat_id, standard_maxlen)
         elif CHAT_HISTORIES[chat_id].maxlen != standard_maxlen: # Maxlen changed via admin command
             logger.info("Ollama chat (Reactive Context): Max history turns changed for chat_id '%s'. Recreating deque.", chat_id)
-            existing_messages = list(CHAT_HISTORIES[chat_id])
-            CHAT_HISTORIES[chat_id] = deque(existing_messages, maxlen=standard_maxlen)
+            CHAT_HISTORIES[chat_id] = resize_history_deque(CHAT_HISTORIES[chat_id], standard_maxlen, get_summary_key("reactive", chat_id))
         history_deque_to_update = CHAT_HISTORIES[chat_id]
         logger.info("Ollama chat (Reactive Context): Using standard history for chat_id '%s'. Model: '%s'. Max turns for history: %d.",
                     chat_id, g_ollama_model_name, g_max_chat_history_turns)
 
-    current_chat_history_list_for_api = list(history_deque_to_update)
+    summary_key = get_summary_key("outreach" if is_outreach_context else "reactive", chat_id)
+    token_usage = {}
+    messages_payload_for_api = assemble_chat_messages(system_prompt_to_use, knowledge_content, history_deque_to_update,
+                                                      user_prompt_text, token_usage, conversation_summary=CHAT_SUMMARIES.get(summary_key, ""))
+    if request_stats is not None:
+        request_stats["token_usage"] = token_usage
 
-    effective_system_prompt = system_prompt_to_use
-    if knowledge_content: # Append general knowledge if provided and relevant
-        effective_system_prompt = (
-            f"المعلومات الأساسية وقاعدة المعرفة العامة (استخدمها إذا كانت ذات صلة بسؤال المستخدم):\n---\n{knowledge_content}\n---\n\n"
-            f"مهمتك وتعليماتك الخاصة (System Prompt):\n{system_prompt_to_use}"
-        )
-    
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug("Ollama chat: Effective system prompt for chat '%s' (is_outreach: %s, first 150 chars): %s...", 
-                     chat_id, is_outreach_context, effective_system_prompt)
-
-    messages_payload_for_api = [{"role": "system", "content": effective_system_prompt}]
-    messages_payload_for_api.extend(current_chat_history_list_for_api)
-    messages_payload_for_api.append({"role": "user", "content": user_prompt_text})
+                     chat_id, is_outreach_context, messages_payload_for_api[0]["content"])
     
     if logger.isEnabledFor(logging.DEBUG):
         try:
-            messages_preview = [{"role": m['role'], "content_preview": m['content'] + ('...' if len(m['content']) > 100 else '')} for m in messages_payload_for_api]
+            messages_preview = [{"role": m['role'], "content_preview": m['content'][:100] + ('...' if len(m['content']) > 100 else '')} for m in messages_payload_for_api]
             debug_payload = {"model": g_ollama_model_name, "messages_preview": messages_preview, "options": g_ollama_model_options}
             logger.debug("Ollama chat: API Request Payload Preview (chat '%s', outreach: %s):\n%s...", 
                          chat_id, is_outreach_context, json.dumps(debug_payload, indent=2, ensure_ascii=False)[:1000])
         except Exception as e_json_dbg: logger.debug("Ollama chat: Could not serialize payload for debug: %s", e_json_dbg)
 
-    api_payload = { "model": g_ollama_model_name, "messages": messages_payload_for_api, "options": g_ollama_model_options, "stream": False }
+    stream_mode = bool(on_text_chunk is not None and g_ollama_streaming_settings.get("enabled"))
+    api_payload = apply_ollama_keep_alive({ "model": g_ollama_model_name, "messages": messages_payload_for_api, "options": g_ollama_model_options, "stream": stream_mode })
+    g_last_ollama_activity_time = time.monotonic()
+    request_deadline = deadline_seconds if deadline_seconds is not None else g_ollama_request_timeout
 
     try:
-        response = requests.post(g_ollama_chat_endpoint, json=api_payload, timeout=g_ollama_request_timeout)
-        response.raise_for_status()
-        response_data = response.json()
+        if stream_mode:
+            streamed_parts = []
+            response_data = {}
+            async for stream_record in g_ollama_client.post_ndjson_stream(g_ollama_chat_endpoint, api_payload, request_deadline):
+                if stream_record.get("error"):
+                    raise aiohttp.ClientError(f"Ollama stream error: {stream_record['error']}")
+                text_piece = stream_record.get("message", {}).get("content", "")
+                if text_piece:
+                    streamed_parts.append(text_piece)
+                    await on_text_chunk(text_piece)
+                if stream_record.get("done"):
+                    response_data = stream_record
+            response_data = {**response_data, "message": {"role": "assistant", "content": "".join(streamed_parts)}}
+        else:
+            response_data = await g_ollama_client.post_json(g_ollama_chat_endpoint, api_payload, request_deadline)
+
+        token_usage["prompt_eval_count"] = response_data.get("prompt_eval_count")
+        token_usage["eval_count"] = response_data.get("eval_count")
+        record_prompt_token_observation(messages_payload_for_api, response_data.get("prompt_eval_count"))
 
         if "message" in response_data and "content" in response_data["message"]:
             assistant_response_text = response_data["message"]["content"].strip()
             logger.info("Ollama chat: Assistant response received for '%s' (outreach: %s, first 100 chars): '%s...'", 
                         chat_id, is_outreach_context, assistant_response_text)
 
+            if not commit_history:
+                return assistant_response_text
             # Append to the correct history deque (user prompt and AI response)
-            history_deque_to_update.append({"role": "user", "content": user_prompt_text})
-            history_deque_to_update.append({"role": "assistant", "content": assistant_response_text})
+            append_history_turn(history_deque_to_update, ChatTurn("user", user_prompt_text), summary_key)
+            append_history_turn(history_deque_to_update, ChatTurn("assistant", assistant_response_text), summary_key)
+            g_conversation_state_store.mark_history_dirty(chat_id, history_deque_to_update)
             logger.debug("Ollama chat: Chat history (type: %s) updated for '%s'. New deque length: %d.", 
                          "outreach" if is_outreach_context else "reactive", chat_id, len(history_deque_to_update))
             
             # Add to the in-memory quick log (persistent .jsonl logging is handled by the caller)
-            INTERACTION_LOG.append({
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "chat_id": chat_id,
-                "user_message": user_prompt_text, "ai_reply": assistant_response_text,
-                "outreach_context": is_outreach_context,
-                "model_used": g_ollama_model_name
-            })
+            INTERACTION_LOG.append(InteractionLogEntry(chat_id, user_prompt_text, assistant_response_text, is_outreach_context, g_ollama_model_name))
             return assistant_response_text
         else:
             logger.error("Ollama chat: 'message.content' key not found in Ollama response for '%s'. Full response: %s", chat_id, response_data)
             return "خطأ: لم يتمكن مساعد الذكاء الاصطناعي من إنشاء رد صالح حاليًا." # AI Error Message
-    except requests.exceptions.Timeout:
-        logger.error("Ollama chat: Request to Ollama timed out for '%s' after %d seconds.", chat_id, g_ollama_request_timeout)
+    except asyncio.TimeoutError:
+        logger.error("Ollama chat: Request to Ollama timed out for '%s' after %s seconds.", chat_id, request_deadline)
         return "خطأ: استغرق مساعد الذكاء الاصطناعي وقتًا طويلاً جدًا للرد هذه المرة." # AI Error Message
-    except requests.exceptions.RequestException as e_req:
+    except json.JSONDecodeError as e_json:
+        logger.error("Ollama chat: Error decoding JSON response from Ollama for '%s': %s", chat_id, e_json)
+        return "خطأ: تم استلام رد بتنسيق غير صالح من مساعد الذكاء الاصطناعي." # AI Error Message
+    except aiohttp.ClientError as e_req:
         logger.error("Ollama chat: API request to Ollama failed for '%s': %s", chat_id, e_req)
         return f"خطأ: هناك مشكلة في الاتصال بخدمة مساعد الذكاء الاصطناعي الآن." # AI Error Message
-    except json.JSONDecodeError:
-        resp_text = response.text if 'response' in locals() and hasattr(response, 'text') else "N/A"
-        logger.error("Ollama chat: Error decoding JSON response from Ollama for '%s'. Response text: %s", chat_id, resp_text)
-        return "خطأ: تم استلام رد بتنسيق غير صالح من مساعد الذكاء الاصطناعي." # AI Error Message
     except Exception as e_ollama_unexpected:
         logger.error("Ollama chat: Unexpected error during Ollama query for '%s': %s", chat_id, e_ollama_unexpected, exc_info=True)
         return "خطأ: حدثت مشكلة غير متوقعة أثناء محاولة معالجة طلبك." # AI Error Message
@@ -584,6 +898,4335 @@ def query_ollama_chat(
 # --- END OF OLLAMA INTERACTION FUNCTION (PART 4 MODIFIED) ---
 # -----------------------------------------------------------------------------
 
+# -----------------------------------------------------------------------------
+# Part 11: LLM Work Scheduler
+# - Bounded worker pool in front of query_ollama_chat.
+# - Strict FIFO per chat_id (a chat never has two generations in flight).
+# - Priority lanes: "admin" is always served first (and has reserved workers),
+#   remaining lanes ("outreach", "reactive", ...) share workers by smooth weighted round-robin.
+# - Background lanes ("summary") are idle-only and capped at max_background_workers.
+# - Running "speculative" jobs are cancelled when a foreground job finds every general worker busy.
+# - Exposes queue depth and wait-time statistics ($llmqueue).
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part11_Integrate: Defining LLM work scheduler.")
+
+LLM_LANE_ADMIN: str = "admin"
+LLM_LANE_OUTREACH: str = "outreach"
+LLM_LANE_REACTIVE: str = "reactive"
+LLM_LANE_SUMMARY: str = "summary"
+LLM_LANE_CAMPAIGN: str = "campaign" # Bulk outreach proposal generation
+LLM_LANE_SPECULATIVE: str = "speculative" # Replies started before the aggregation window closed; always background and preemptible
+
+class _LLMJob:
+    __slots__ = ("lane", "chat_id", "job_factory", "future", "enqueued_at")
+
+    def __init__(self, lane: str, chat_id: str, job_factory, future: asyncio.Future):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.job_factory = job_factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class LLMWorkScheduler:
+    """
+    Schedules LLM coroutines onto a fixed number of asyncio workers.
+    submit() returns the job's result; cancelling the submitting task cancels the job
+    (whether it is still queued or already running).
+    """
+    def __init__(self):
+        self._chat_queues: dict[str, deque] = {}     # chat_id -> deque[_LLMJob] (FIFO per chat)
+        self._ready_chats: dict[str, deque] = {}     # lane -> chat_ids whose head job can run now
+        self._busy_chats: set = set()                # chat_ids with a job currently running
+        self._lane_credit: dict[str, float] = {}     # Smooth weighted round-robin state
+        self._lane_weights: dict[str, float] = {}
+        self._worker_target: int = 0
+        self._admin_reserved_target: int = 0
+        self._background_lanes: set = set()
+        self._max_background_workers: int = 1
+        self._background_running: int = 0
+        self._general_busy: int = 0                  # Jobs running on general (non admin-only) workers
+        self._running_jobs: dict = {}                # _LLMJob -> admin_only flag of the worker running it
+        self._workers: dict[str, asyncio.Task] = {}
+        self._cond: asyncio.Condition | None = None
+        self.is_running: bool = False
+        self._lane_stats: dict[str, dict] = {}
+
+    def _stats_for(self, lane: str) -> dict:
+        if lane not in self._lane_stats:
+            self._lane_stats[lane] = {"queued": 0, "running": 0, "submitted": 0, "started": 0, "completed": 0, "cancelled": 0,
+                                      "wait_total": 0.0, "wait_max": 0.0, "recent_waits": deque(maxlen=500)}
+        return self._lane_stats[lane]
+
+    def configure(self, settings: dict):
+        """Applies worker counts and lane weights. Safe to call while running."""
+        self._worker_target = max(1, int(settings.get("workers", DEFAULT_LLM_SCHEDULER_SETTINGS["workers"])))
+        self._admin_reserved_target = max(0, int(settings.get("admin_reserved_workers", DEFAULT_LLM_SCHEDULER_SETTINGS["admin_reserved_workers"])))
+        self._lane_weights = {lane: max(0.001, float(weight)) for lane, weight in (settings.get("lane_weights") or {}).items()}
+        self._background_lanes = set(settings.get("background_lanes", DEFAULT_LLM_SCHEDULER_SETTINGS["background_lanes"]) or []) | {LLM_LANE_SPECULATIVE}
+        self._max_background_workers = max(0, int(settings.get("max_background_workers", DEFAULT_LLM_SCHEDULER_SETTINGS["max_background_workers"])))
+        if self.is_running:
+            self._spawn_missing_workers()
+            asyncio.get_running_loop().create_task(self._notify_all())
+        logger.info("LLM scheduler: Configured with %d worker(s), %d reserved admin worker(s), lane weights: %s.",
+                    self._worker_target, self._admin_reserved_target, self._lane_weights)
+
+    def start(self, settings: dict):
+        if self.is_running: return
+        self._cond = asyncio.Condition()
+        self.is_running = True
+        self.configure(settings)
+
+    async def stop(self):
+        """Cancels workers and any queued jobs."""
+        if not self.is_running: return
+        self.is_running = False
+        workers = list(self._workers.values())
+        for worker in workers: worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+        for chat_queue in self._chat_queues.values():
+            for job in chat_queue:
+                if not job.future.done(): job.future.cancel()
+        self._chat_queues.clear(); self._ready_chats.clear(); self._busy_chats.clear()
+        logger.info("LLM scheduler: Stopped.")
+
+    def _spawn_missing_workers(self):
+        for worker_name, admin_only, index in ([(f"general-{i}", False, i) for i in range(self._worker_target)] +
+                                               [(f"admin-{i}", True, i) for i in range(self._admin_reserved_target)]):
+            existing = self._workers.get(worker_name)
+            if existing is None or existing.done():
+                self._workers[worker_name] = asyncio.get_running_loop().create_task(self._worker_loop(worker_name, admin_only, index))
+
+    async def _notify_all(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def submit(self, lane: str, chat_id: str, job_factory):
+        """
+        Queues job_factory (a zero-argument callable returning a coroutine) and returns its result.
+        Falls back to running the job inline if the scheduler has not been started.
+        """
+        if not self.is_running:
+            return await job_factory()
+        future = asyncio.get_running_loop().create_future()
+        job = _LLMJob(lane, chat_id, job_factory, future)
+        lane_stats = self._stats_for(lane)
+        async with self._cond:
+            chat_queue = self._chat_queues.setdefault(chat_id, deque())
+            self._drop_abandoned_head(chat_id, chat_queue)
+            chat_queue.append(job)
+            lane_stats["queued"] += 1; lane_stats["submitted"] += 1
+            if len(chat_queue) == 1 and chat_id not in self._busy_chats:
+                self._ready_chats.setdefault(lane, deque()).append(chat_id)
+            if lane not in self._background_lanes:
+                self._preempt_speculative_job(lane)
+            self._cond.notify_all()
+        logger.debug("LLM scheduler: Job queued (lane '%s', chat '%s'). Lane depth: %d.", lane, chat_id, lane_stats["queued"])
+        return await future
+
+    def _drop_abandoned_head(self, chat_id: str, chat_queue: deque):
+        """Discards cancelled jobs at the head of an idle chat's queue, so a new job is not parked in their (background) lane."""
+        if chat_id in self._busy_chats or not chat_queue or not chat_queue[0].future.done():
+            return
+        head_lane = chat_queue[0].lane
+        while chat_queue and chat_queue[0].future.done():
+            abandoned_job = chat_queue.popleft()
+            self._stats_for(abandoned_job.lane)["queued"] -= 1
+            self._stats_for(abandoned_job.lane)["cancelled"] += 1
+        if not chat_queue and chat_id in self._ready_chats.get(head_lane, ()):
+            self._ready_chats[head_lane].remove(chat_id)
+
+    def _preempt_speculative_job(self, lane: str):
+        if self._general_busy < self._worker_target:
+            return
+        if lane == LLM_LANE_ADMIN and sum(1 for admin_only in self._running_jobs.values() if admin_only) < self._admin_reserved_target:
+            return # A reserved admin worker is free
+        for running_job, admin_only in self._running_jobs.items():
+            if running_job.lane == LLM_LANE_SPECULATIVE and not admin_only and not running_job.future.done():
+                logger.info("LLM scheduler: Preempting speculative job for chat '%s' (all workers busy).", running_job.chat_id)
+                running_job.future.cancel() # Cancels the running coroutine via its done callback
+                return
+
+    def _pick_lane(self, admin_only: bool) -> str | None:
+        if self._ready_chats.get(LLM_LANE_ADMIN):
+            return LLM_LANE_ADMIN
+        if admin_only:
+            return None
+        candidate_lanes = [lane for lane, chats in self._ready_chats.items()
+                           if chats and lane != LLM_LANE_ADMIN and lane not in self._background_lanes]
+        if not candidate_lanes and self._background_running < self._max_background_workers:
+            candidate_lanes = [lane for lane, chats in self._ready_chats.items() if chats and lane in self._background_lanes]
+        if not candidate_lanes:
+            return None
+        total_weight = 0.0
+        for lane in candidate_lanes:
+            weight = self._lane_weights.get(lane, 1.0)
+            self._lane_credit[lane] = self._lane_credit.get(lane, 0.0) + weight
+            total_weight += weight
+        chosen_lane = max(candidate_lanes, key=lambda l: self._lane_credit[l])
+        self._lane_credit[chosen_lane] -= total_weight
+        return chosen_lane
+
+    def _take_next_job(self, admin_only: bool) -> _LLMJob | None:
+        while True:
+            lane = self._pick_lane(admin_only)
+            if lane is None:
+                return None
+            chat_id = self._ready_chats[lane].popleft()
+            chat_queue = self._chat_queues.get(chat_id)
+            if not chat_queue:
+                continue
+            job = chat_queue.popleft()
+            self._stats_for(job.lane)["queued"] -= 1
+            if job.future.done(): # Submitter gave up while queued
+                self._stats_for(job.lane)["cancelled"] += 1
+                self._requeue_chat_head(chat_id)
+                continue
+            self._busy_chats.add(chat_id)
+            return job
+
+    def _requeue_chat_head(self, chat_id: str):
+        chat_queue = self._chat_queues.get(chat_id)
+        if chat_queue:
+            self._ready_chats.setdefault(chat_queue[0].lane, deque()).append(chat_id)
+        elif chat_queue is not None:
+            del self._chat_queues[chat_id]
+
+    async def _worker_loop(self, worker_name: str, admin_only: bool, index: int):
+        logger.debug("LLM scheduler: Worker '%s' started.", worker_name)
+        while True:
+            async with self._cond:
+                job = None
+                while job is None:
+                    target = self._admin_reserved_target if admin_only else self._worker_target
+                    if index >= target or not self.is_running:
+                        self._workers.pop(worker_name, None)
+                        logger.debug("LLM scheduler: Worker '%s' retired.", worker_name)
+                        return
+                    job = self._take_next_job(admin_only)
+                    if job is None:
+                        await self._cond.wait()
+            await self._run_job(job, admin_only)
+
+    async def _run_job(self, job: _LLMJob, admin_only: bool = False):
+        lane_stats = self._stats_for(job.lane)
+        waited = time.monotonic() - job.enqueued_at
+        lane_stats["wait_total"] += waited
+        lane_stats["wait_max"] = max(lane_stats["wait_max"], waited)
+        lane_stats["recent_waits"].append(waited)
+        lane_stats["running"] += 1; lane_stats["started"] += 1
+        is_background_job = job.lane in self._background_lanes
+        if is_background_job: self._background_running += 1
+        if not admin_only: self._general_busy += 1
+        self._running_jobs[job] = admin_only
+        job_task = asyncio.ensure_future(job.job_factory())
+        job.future.add_done_callback(lambda f: job_task.cancel() if f.cancelled() else None)
+        try:
+            await asyncio.wait({job_task})
+            if job_task.cancelled():
+                lane_stats["cancelled"] += 1
+                if not job.future.done(): job.future.cancel()
+            elif job_task.exception() is not None:
+                if not job.future.done(): job.future.set_exception(job_task.exception())
+            else:
+                lane_stats["completed"] += 1
+                if not job.future.done(): job.future.set_result(job_task.result())
+        except asyncio.CancelledError: # Worker itself cancelled (scheduler stopping)
+            job_task.cancel()
+            if not job.future.done(): job.future.cancel()
+            raise
+        finally:
+            lane_stats["running"] -= 1
+            if is_background_job: self._background_running -= 1
+            if not admin_only: self._general_busy -= 1
+            self._running_jobs.pop(job, None)
+            async with self._cond:
+                self._busy_chats.discard(job.chat_id)
+                self._requeue_chat_head(job.chat_id)
+                self._cond.notify_all()
+
+    def get_stats(self) -> dict:
+        """Returns per-lane queue depth and wait-time statistics (seconds)."""
+        lanes = {}
+        for lane, lane_stats in self._lane_stats.items():
+            recent_sorted = sorted(lane_stats["recent_waits"])
+            lanes[lane] = {
+                "queued": lane_stats["queued"], "running": lane_stats["running"],
+                "submitted": lane_stats["submitted"], "completed": lane_stats["completed"], "cancelled": lane_stats["cancelled"],
+                "avg_wait": lane_stats["wait_total"] / lane_stats["started"] if lane_stats["started"] else 0.0,
+                "p95_wait": recent_sorted[min(len(recent_sorted) - 1, int(len(recent_sorted) * 0.95))] if recent_sorted else 0.0,
+                "max_wait": lane_stats["wait_max"],
+            }
+        return {"workers": self._worker_target, "admin_reserved_workers": self._admin_reserved_target,
+                "busy_chats": len(self._busy_chats), "lanes": lanes}
+
+g_llm_scheduler = LLMWorkScheduler()
+# --- END OF LLM WORK SCHEDULER (PART 11 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 12: Knowledge Retrieval Engine
+# - Chunks KNOWLEDGE_FILE_PATH once and keeps an in-memory BM25 inverted index.
+# - Arabic normalization (diacritics, tatweel, alef/yaa/taa-marbuta variants, light prefix stripping).
+# - Only the top-k relevant chunks are injected into the system prompt.
+# - The file is re-read only when its mtime/size changes; unchanged chunks reuse their cached term counts.
+# - Optional "embedding" mode: cosine top-k over chunk vectors from Ollama /api/embeddings (needs numpy).
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part12_Integrate: Defining knowledge retrieval engine.")
+
+ARABIC_DIACRITICS_RE = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]') # Tashkeel + tatweel
+ARABIC_CHAR_NORMALIZATION_TABLE = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ة": "ه",
+    "ؤ": "و",
+})
+ARABIC_PREFIXES_TO_STRIP: tuple = ("وال", "بال", "كال", "فال", "لل", "ال")
+SEARCH_TOKEN_RE = re.compile(r'\w+')
+
+def normalize_arabic_text(text: str) -> str:
+    """Normalizes Arabic spelling variants so that lookups are insensitive to diacritics and letter forms."""
+    if not text: return ""
+    text = ARABIC_DIACRITICS_RE.sub('', text)
+    return text.translate(ARABIC_CHAR_NORMALIZATION_TABLE).lower()
+
+def tokenize_for_search(text: str) -> list[str]:
+    """Normalizes and splits text into search terms, stripping common Arabic definite-article prefixes."""
+    tokens = []
+    for token in SEARCH_TOKEN_RE.findall(normalize_arabic_text(text)):
+        for prefix in ARABIC_PREFIXES_TO_STRIP:
+            if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+                token = token[len(prefix):]
+                break
+        if len(token) >= 2 or token.isdigit():
+            tokens.append(token)
+    return tokens
+
+def chunk_knowledge_text(text: str, max_chars: int) -> list[str]:
+    """Splits knowledge text on blank lines, merging short paragraphs and splitting long ones by line."""
+    chunks, current_chunk = [], ""
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph: continue
+        pieces = [paragraph] if len(paragraph) <= max_chars else [line.strip() for line in paragraph.splitlines() if line.strip()]
+        for piece in pieces:
+            if current_chunk and len(current_chunk) + len(piece) + 2 > max_chars:
+                chunks.append(current_chunk); current_chunk = ""
+            current_chunk = f"{current_chunk}\n\n{piece}" if current_chunk else piece
+    if current_chunk: chunks.append(current_chunk)
+    return chunks
+
+class KnowledgeIndex:
+    """
+    BM25 index over the chunks of one knowledge file.
+    refresh_if_changed() is blocking (stat + read + rebuild) and is run via asyncio.to_thread;
+    the index state is swapped in one assignment so searches on the event loop never see a half-built index.
+    """
+    BM25_K1: float = 1.5
+    BM25_B: float = 0.75
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.version: int = 0 # Incremented every time the knowledge content changes
+        self.full_text: str = ""
+        self._file_signature = None # (mtime_ns, size, chunk_max_chars)
+        self._last_check_time: float = 0.0
+        self._rebuild_lock = threading.Lock() # One stat + rebuild at a time, whichever thread calls refresh_if_changed()
+        self._refresh_task: asyncio.Task | None = None # In-flight refresh shared by concurrent refresh_if_due() callers
+        self._term_counts_cache: dict[str, dict] = {} # chunk hash -> {term: tf}, reused across rebuilds
+        self._state = {"chunks": [], "chunk_hashes": [], "doc_lens": [], "postings": {}, "avgdl": 0.0}
+
+    @property
+    def chunks(self) -> list[str]:
+        return self._state["chunks"]
+
+    def refresh_if_changed(self) -> bool:
+        """Rebuilds the index if the file or the chunking settings changed since the last build. Returns True if rebuilt."""
+        with self._rebuild_lock:
+            self._last_check_time = time.monotonic()
+            try:
+                file_stat = os.stat(self.filepath) if self.filepath else None
+            except OSError:
+                file_stat = None
+            max_chars = int(g_knowledge_settings.get("chunk_max_chars", DEFAULT_KNOWLEDGE_SETTINGS["chunk_max_chars"]))
+            new_signature = (file_stat.st_mtime_ns, file_stat.st_size, max_chars) if file_stat else None
+            if new_signature == self._file_signature and self.version:
+                return False
+            self._file_signature = new_signature
+            self._rebuild(load_knowledge_from_file(self.filepath) if file_stat else "", max_chars)
+            return True
+
+    async def refresh_if_due(self, check_interval_seconds: float):
+        """Checks the file's mtime at most once per check_interval_seconds, off the event loop. Concurrent callers share one check."""
+        if self._refresh_task is None:
+            if self.version and time.monotonic() - self._last_check_time < check_interval_seconds:
+                return
+            self._refresh_task = asyncio.ensure_future(asyncio.to_thread(self.refresh_if_changed))
+            self._refresh_task.add_done_callback(self._on_refresh_done)
+        await asyncio.shield(self._refresh_task)
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        if self._refresh_task is task: self._refresh_task = None
+        if not task.cancelled(): task.exception() # Awaiting callers re-raise it; mark it retrieved if they were all cancelled
+
+    def _rebuild(self, text: str, max_chars: int):
+        chunks = chunk_knowledge_text(text, max_chars) if text else []
+        chunk_hashes, doc_lens, postings, term_counts_cache = [], [], {}, {}
+        reused_chunks = 0
+        for chunk_idx, chunk in enumerate(chunks):
+            chunk_hash = hashlib.sha1(chunk.encode('utf-8')).hexdigest()
+            term_counts = self._term_counts_cache.get(chunk_hash)
+            if term_counts is None:
+                term_counts = {}
+                for term in tokenize_for_search(chunk):
+                    term_counts[term] = term_counts.get(term, 0) + 1
+            else:
+                reused_chunks += 1
+            term_counts_cache[chunk_hash] = term_counts
+            chunk_hashes.append(chunk_hash)
+            doc_lens.append(sum(term_counts.values()))
+            for term, term_freq in term_counts.items():
+                postings.setdefault(term, []).append((chunk_idx, term_freq))
+        self._term_counts_cache = term_counts_cache
+        self._state = {"chunks": chunks, "chunk_hashes": chunk_hashes, "doc_lens": doc_lens, "postings": postings,
+                       "avgdl": (sum(doc_lens) / len(doc_lens)) if doc_lens else 0.0}
+        self.full_text = text
+        self.version += 1
+        logger.info("Knowledge index: Built v%d from '%s': %d chunks (%d reused), %d terms.",
+                    self.version, self.filepath, len(chunks), reused_chunks, len(postings))
+
+    def search(self, query_text: str, top_k: int) -> list[tuple[float, str]]:
+        """Returns up to top_k (score, chunk_text) pairs ranked by BM25."""
+        state = self._state # One snapshot: a concurrent rebuild swaps _state, it never mutates it
+        doc_count = len(state["chunks"])
+        if not doc_count or top_k <= 0: return []
+        scores: dict[int, float] = {}
+        for term in set(tokenize_for_search(query_text)):
+            term_postings = state["postings"].get(term)
+            if not term_postings: continue
+            idf = math.log(1 + (doc_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for chunk_idx, term_freq in term_postings:
+                length_norm = 1 - self.BM25_B + self.BM25_B * state["doc_lens"][chunk_idx] / (state["avgdl"] or 1.0)
+                scores[chunk_idx] = scores.get(chunk_idx, 0.0) + idf * term_freq * (self.BM25_K1 + 1) / (term_freq + self.BM25_K1 * length_norm)
+        return [(score, state["chunks"][chunk_idx]) for score, chunk_idx in heapq.nlargest(top_k, ((score, chunk_idx) for chunk_idx, score in scores.items()))]
+
+g_knowledge_index = KnowledgeIndex(KNOWLEDGE_FILE_PATH)
+
+class KnowledgeEmbeddingIndex:
+    """
+    Optional vector index over the KnowledgeIndex chunks (knowledge_settings.mode = "embedding").
+    Chunks are embedded through Ollama /api/embeddings and kept as L2-normalized rows of a NumPy matrix,
+    persisted as a .npy next to a manifest of chunk content hashes, so unchanged chunks are never
+    re-embedded across edits or restarts. The matrix is held in memory, never memory-mapped, so the
+    .npy can always be replaced on rebuild (os.replace over a mapped file fails on Windows). Requires numpy.
+    """
+    MATRIX_FILE_NAME: str = "knowledge_embeddings.npy"
+    MANIFEST_FILE_NAME: str = "knowledge_embeddings_manifest.json"
+
+    def __init__(self):
+        self._matrix = None # np.ndarray, one row per chunk in KnowledgeIndex order
+        self._chunks: list[str] = [] # Chunk texts of the synced knowledge version, row-aligned with _matrix
+        self._row_hashes: list[str] = []
+        self._model_name: str = ""
+        self._synced_knowledge_version: int = -1
+        self._sync_lock: asyncio.Lock | None = None
+
+    @staticmethod
+    def _settings_value(key: str):
+        return g_knowledge_settings.get(key, DEFAULT_KNOWLEDGE_SETTINGS[key])
+
+    def _index_dir(self) -> pathlib.Path:
+        return pathlib.Path(self._settings_value("embedding_index_dir"))
+
+    async def embed_text(self, text: str) -> "np.ndarray":
+        base_url = self._settings_value("embedding_base_url") or g_ollama_api_base_url
+        response_data = await g_ollama_client.post_json(
+            f"{base_url}/api/embeddings", {"model": self._settings_value("embedding_model"), "prompt": text},
+            float(self._settings_value("embedding_timeout_seconds")))
+        vector = np.asarray(response_data["embedding"], dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def _load_persisted(self):
+        """Blocking: loads the manifest and the matrix, if present."""
+        manifest_path = self._index_dir() / self.MANIFEST_FILE_NAME
+        matrix_path = self._index_dir() / self.MATRIX_FILE_NAME
+        if not (manifest_path.exists() and matrix_path.exists()):
+            return
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f: manifest = json.load(f)
+            matrix = np.load(matrix_path)
+            if matrix.shape[0] != len(manifest.get("row_hashes", [])):
+                logger.warning("Knowledge embeddings: Manifest/matrix row mismatch in '%s'. Ignoring persisted index.", self._index_dir())
+                return
+            self._matrix, self._row_hashes, self._model_name = matrix, manifest["row_hashes"], manifest.get("model", "")
+            logger.info("Knowledge embeddings: Loaded %d persisted vectors (model '%s').", len(self._row_hashes), self._model_name)
+        except Exception as e_load_emb:
+            logger.error("Knowledge embeddings: Could not load persisted index from '%s': %s", self._index_dir(), e_load_emb)
+
+    def _persist(self, matrix, row_hashes: list[str], model_name: str):
+        """Blocking: atomically writes matrix + manifest."""
+        index_dir = self._index_dir()
+        index_dir.mkdir(parents=True, exist_ok=True)
+        tmp_matrix_path = index_dir / (self.MATRIX_FILE_NAME + ".tmp")
+        with open(tmp_matrix_path, 'wb') as f: np.save(f, matrix)
+        os.replace(tmp_matrix_path, index_dir / self.MATRIX_FILE_NAME)
+        tmp_manifest_path = index_dir / (self.MANIFEST_FILE_NAME + ".tmp")
+        with open(tmp_manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({"model": model_name, "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0, "row_hashes": row_hashes}, f)
+        os.replace(tmp_manifest_path, index_dir / self.MANIFEST_FILE_NAME)
+
+    async def sync(self, knowledge_index: KnowledgeIndex):
+        """Brings the matrix in line with the current knowledge chunks, embedding only new/changed chunks."""
+        if self._synced_knowledge_version == knowledge_index.version:
+            return
+        if self._sync_lock is None: self._sync_lock = asyncio.Lock()
+        async with self._sync_lock:
+            if self._synced_knowledge_version == knowledge_index.version:
+                return
+            if self._matrix is None:
+                await asyncio.to_thread(self._load_persisted)
+            target_version = knowledge_index.version
+            target_chunks, target_hashes = list(knowledge_index.chunks), list(knowledge_index._state["chunk_hashes"])
+            model_name = self._settings_value("embedding_model")
+            reusable_rows = {} if model_name != self._model_name else {row_hash: row for row, row_hash in enumerate(self._row_hashes)}
+            missing = [i for i, chunk_hash in enumerate(target_hashes) if chunk_hash not in reusable_rows]
+
+            embed_semaphore = asyncio.Semaphore(max(1, int(self._settings_value("embedding_concurrency"))))
+            async def embed_chunk(chunk_idx: int):
+                async with embed_semaphore:
+                    return chunk_idx, await self.embed_text(target_chunks[chunk_idx])
+            new_vectors = dict(await asyncio.gather(*(embed_chunk(i) for i in missing)))
+
+            if not target_chunks:
+                new_matrix = np.zeros((0, 0), dtype=np.float32)
+            else:
+                dim = len(next(iter(new_vectors.values()))) if new_vectors else self._matrix.shape[1]
+                new_matrix = np.empty((len(target_chunks), dim), dtype=np.float32)
+                for i, chunk_hash in enumerate(target_hashes):
+                    new_matrix[i] = new_vectors[i] if i in new_vectors else self._matrix[reusable_rows[chunk_hash]]
+            await asyncio.to_thread(self._persist, new_matrix, target_hashes, model_name)
+            self._matrix, self._chunks, self._row_hashes, self._model_name = new_matrix, target_chunks, target_hashes, model_name
+            self._synced_knowledge_version = target_version
+            logger.info("Knowledge embeddings: Synced to knowledge v%d. %d chunk(s) embedded, %d reused.",
+                        target_version, len(missing), len(target_hashes) - len(missing))
+
+    async def search(self, query_text: str, top_k: int) -> list[tuple[float, str]]:
+        """Returns up to top_k (cosine_similarity, chunk_text) pairs using one matrix-vector product."""
+        matrix, chunks = self._matrix, self._chunks # Taken before awaiting, so a concurrent sync cannot misalign them
+        if matrix is None or not chunks or top_k <= 0:
+            return []
+        query_vector = await self.embed_text(query_text)
+        similarities = np.asarray(matrix @ query_vector)
+        k = min(top_k, similarities.shape[0])
+        top_indices = np.argpartition(-similarities, k - 1)[:k]
+        top_indices = top_indices[np.argsort(-similarities[top_indices])]
+        return [(float(similarities[i]), chunks[i]) for i in top_indices]
+
+g_knowledge_embedding_index = KnowledgeEmbeddingIndex()
+
+async def get_knowledge_for_query(query_text: str) -> str:
+    """
+    Returns the knowledge text to inject for query_text according to knowledge_settings.mode:
+    "bm25" (top-k relevant chunks), "embedding" (top-k by cosine similarity, falls back to bm25 on error)
+    or "whole_file" (entire file, cached until it changes).
+    """
+    await g_knowledge_index.refresh_if_due(float(g_knowledge_settings.get("check_interval_seconds", DEFAULT_KNOWLEDGE_SETTINGS["check_interval_seconds"])))
+    knowledge_mode = g_knowledge_settings.get("mode", DEFAULT_KNOWLEDGE_SETTINGS["mode"])
+    if knowledge_mode == "whole_file":
+        return g_knowledge_index.full_text
+    top_k = int(g_knowledge_settings.get("top_k", DEFAULT_KNOWLEDGE_SETTINGS["top_k"]))
+    ranked_chunks = None
+    if knowledge_mode == "embedding":
+        if np is None:
+            logger.warning("Knowledge retrieval: 'embedding' mode requires numpy, which is not installed. Using bm25.")
+        else:
+            try:
+                await g_knowledge_embedding_index.sync(g_knowledge_index)
+                ranked_chunks = await g_knowledge_embedding_index.search(query_text, top_k)
+            except Exception as e_embedding:
+                logger.error("Knowledge retrieval: Embedding lookup failed (%s). Falling back to bm25.", e_embedding)
+    if ranked_chunks is None:
+        ranked_chunks = g_knowledge_index.search(query_text, top_k)
+    logger.debug("Knowledge retrieval: %d chunk(s) selected for query (scores: %s).",
+                 len(ranked_chunks), [round(score, 2) for score, _ in ranked_chunks])
+    return KNOWLEDGE_CHUNK_SEPARATOR.join(chunk for _, chunk in ranked_chunks)
+# --- END OF KNOWLEDGE RETRIEVAL ENGINE (PART 12 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 13: Prompt Assembly and Token Budget
+# - Estimates tokens with a pluggable estimator (default: calibrated chars-per-token ratio).
+# - Packs system prompt, retrieved knowledge and the newest history turns into
+#   num_ctx minus a reserved output margin, so Ollama never truncates the system prompt away.
+# - Reports per-request token usage (estimated + Ollama's prompt_eval_count/eval_count).
+# - Prefix-stable layout, cached reactive system prompt, keep_alive and model warmup for KV-cache reuse.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part13_Integrate: Defining prompt assembler.")
+
+KNOWLEDGE_CHUNK_SEPARATOR: str = "\n---\n"
+PER_MESSAGE_TOKEN_OVERHEAD: int = 4 # Chat template tokens around each message
+
+g_observed_chars_per_token: deque = deque(maxlen=200) # Calibration samples from real Ollama responses
+
+def _calibrated_chars_per_token() -> float:
+    """
+    Returns the configured chars-per-token ratio, or a calibrated one once enough samples exist.
+    Uses the 20th percentile of observed ratios: KV-cache reuse makes Ollama report fewer prompt tokens
+    than were sent (inflating the ratio), so a low percentile keeps the estimate on the safe side.
+    """
+    configured_ratio = float(g_prompt_budget_settings.get("chars_per_token", DEFAULT_PROMPT_BUDGET_SETTINGS["chars_per_token"]))
+    if not g_prompt_budget_settings.get("calibrate", True) or len(g_observed_chars_per_token) < 10:
+        return configured_ratio
+    samples = sorted(g_observed_chars_per_token)
+    return max(1.0, samples[int(len(samples) * 0.2)])
+
+def estimate_tokens_char_ratio(text: str) -> int:
+    return int(len(text) / _calibrated_chars_per_token()) + 1 if text else 0
+
+TOKEN_ESTIMATORS: dict = {"char_ratio": estimate_tokens_char_ratio} # name -> callable(str) -> int
+
+def register_token_estimator(name: str, estimator_func):
+    """Registers a tokenizer-backed estimator selectable via prompt_budget.tokenizer."""
+    TOKEN_ESTIMATORS[name] = estimator_func
+
+def estimate_tokens(text: str) -> int:
+    estimator_name = g_prompt_budget_settings.get("tokenizer", DEFAULT_PROMPT_BUDGET_SETTINGS["tokenizer"])
+    return TOKEN_ESTIMATORS.get(estimator_name, estimate_tokens_char_ratio)(text)
+
+def record_prompt_token_observation(messages_payload: list, prompt_eval_count):
+    """Feeds a (chars sent, tokens Ollama evaluated) sample into the char-ratio calibration."""
+    content_tokens = (prompt_eval_count or 0) - PER_MESSAGE_TOKEN_OVERHEAD * len(messages_payload)
+    sent_chars = sum(len(m.get("content", "")) for m in messages_payload)
+    if content_tokens > 0 and sent_chars:
+        g_observed_chars_per_token.append(sent_chars / content_tokens)
+
+def format_knowledge_block(knowledge_content: str) -> str:
+    return f"المعلومات الأساسية وقاعدة المعرفة العامة (استخدمها إذا كانت ذات صلة بسؤال المستخدم):\n---\n{knowledge_content}\n---"
+
+def format_system_prompt_with_knowledge(system_prompt: str, knowledge_content: str) -> str:
+    if not knowledge_content:
+        return system_prompt
+    return f"{format_knowledge_block(knowledge_content)}\n\nمهمتك وتعليماتك الخاصة (System Prompt):\n{system_prompt}"
+
+def layout_chat_messages(system_prompt: str, knowledge_content: str, history_turns: list, user_prompt_text: str,
+                         conversation_summary: str = "") -> list[dict]:
+    """
+    Orders the messages according to prompt_cache.prompt_layout.
+    "prefix_stable": the system prompt is sent alone and unchanged, followed by the history; the per-request
+    knowledge block and the user message come last, so Ollama can reuse its KV cache for the whole prefix.
+    "legacy": knowledge is prepended inside the system message (prefix changes with every query).
+    A running conversation summary, if any, always follows the system prompt.
+    """
+    if g_prompt_cache_settings.get("prompt_layout", DEFAULT_PROMPT_CACHE_SETTINGS["prompt_layout"]) == "prefix_stable":
+        messages = [{"role": "system", "content": system_prompt}]
+        if conversation_summary:
+            messages.append({"role": "system", "content": format_summary_block(conversation_summary)})
+        messages.extend(history_turns)
+        if knowledge_content:
+            messages.append({"role": "system", "content": format_knowledge_block(knowledge_content)})
+    else:
+        messages = [{"role": "system", "content": format_system_prompt_with_knowledge(system_prompt, knowledge_content)}]
+        if conversation_summary:
+            messages.append({"role": "system", "content": format_summary_block(conversation_summary)})
+        messages.extend(history_turns)
+    messages.append({"role": "user", "content": user_prompt_text})
+    return messages
+
+def assemble_chat_messages(system_prompt: str, knowledge_content: str, history_turns: list, user_prompt_text: str,
+                           usage_out: dict = None, conversation_summary: str = "") -> list[dict]:
+    """
+    Builds the /api/chat messages list within the token budget. history_turns may be the live history deque
+    (its ChatTurn objects go into the list as-is; dumps_api_payload serializes them).
+    Priority: system prompt, conversation summary and the new user message always; then knowledge chunks in rank order
+    (an oversized single chunk is truncated); then history from the newest turn backwards.
+    Fills usage_out (if given) with the estimated token breakdown.
+    """
+    usage = usage_out if usage_out is not None else {}
+    if not g_prompt_budget_settings.get("enabled", True):
+        messages = layout_chat_messages(system_prompt, knowledge_content, history_turns, user_prompt_text, conversation_summary)
+        usage.update({"budget_enabled": False, "total_estimated": sum(estimate_tokens(m["content"]) + PER_MESSAGE_TOKEN_OVERHEAD for m in messages)})
+        return messages
+
+    num_ctx = int(g_ollama_model_options.get("num_ctx", 2048))
+    reserved_output = int(g_prompt_budget_settings.get("reserved_output_tokens", DEFAULT_PROMPT_BUDGET_SETTINGS["reserved_output_tokens"]))
+    budget = max(0, num_ctx - reserved_output - int(g_prompt_budget_settings.get("safety_margin_tokens", DEFAULT_PROMPT_BUDGET_SETTINGS["safety_margin_tokens"])))
+
+    system_tokens = estimate_tokens(system_prompt) + PER_MESSAGE_TOKEN_OVERHEAD
+    summary_tokens = estimate_tokens(format_summary_block(conversation_summary)) + PER_MESSAGE_TOKEN_OVERHEAD if conversation_summary else 0
+    system_tokens += summary_tokens
+    user_tokens = estimate_tokens(user_prompt_text) + PER_MESSAGE_TOKEN_OVERHEAD
+    remaining = budget - system_tokens - user_tokens
+    if remaining < 0:
+        logger.warning("Prompt assembler: System prompt + user message (~%d tokens) exceed the budget of %d tokens (num_ctx %d).",
+                       system_tokens + user_tokens, budget, num_ctx)
+
+    knowledge_chunks = [c for c in knowledge_content.split(KNOWLEDGE_CHUNK_SEPARATOR) if c.strip()] if knowledge_content else []
+    selected_chunks, knowledge_tokens = [], 0
+    if knowledge_chunks:
+        remaining -= estimate_tokens(format_knowledge_block("")) + PER_MESSAGE_TOKEN_OVERHEAD # Knowledge header overhead
+    for chunk in knowledge_chunks:
+        chunk_tokens = estimate_tokens(chunk) + 2
+        if chunk_tokens <= remaining:
+            selected_chunks.append(chunk); knowledge_tokens += chunk_tokens; remaining -= chunk_tokens
+        elif not selected_chunks and remaining > 32: # Whole-file knowledge or one huge chunk: keep what fits
+            kept_chars = int(remaining * _calibrated_chars_per_token()) - 16
+            selected_chunks.append(chunk[:max(0, kept_chars)]); knowledge_tokens += remaining; remaining = 0
+            break
+        else:
+            break
+
+    selected_history, history_tokens = [], 0
+    for turn in reversed(history_turns):
+        turn_tokens = estimate_tokens(turn["content"]) + PER_MESSAGE_TOKEN_OVERHEAD
+        if turn_tokens > remaining:
+            break
+        selected_history.append(turn); history_tokens += turn_tokens; remaining -= turn_tokens
+    selected_history.reverse()
+
+    messages = layout_chat_messages(system_prompt, KNOWLEDGE_CHUNK_SEPARATOR.join(selected_chunks), selected_history, user_prompt_text,
+                                    conversation_summary)
+
+    usage.update({
+        "budget_enabled": True, "num_ctx": num_ctx, "reserved_output_tokens": reserved_output, "budget": budget,
+        "system_tokens": system_tokens, "summary_tokens": summary_tokens, "knowledge_tokens": knowledge_tokens,
+        "knowledge_chunks_used": len(selected_chunks), "knowledge_chunks_dropped": len(knowledge_chunks) - len(selected_chunks),
+        "history_tokens": history_tokens, "history_turns_used": len(selected_history),
+        "history_turns_dropped": len(history_turns) - len(selected_history),
+        "user_tokens": user_tokens, "total_estimated": system_tokens + knowledge_tokens + history_tokens + user_tokens,
+        "estimator": g_prompt_budget_settings.get("tokenizer", "char_ratio"), "chars_per_token": round(_calibrated_chars_per_token(), 3),
+    })
+    if usage["history_turns_dropped"] or usage["knowledge_chunks_dropped"]:
+        logger.info("Prompt assembler: Budget %d tokens. Dropped %d history turn(s), %d knowledge chunk(s).",
+                    budget, usage["history_turns_dropped"], usage["knowledge_chunks_dropped"])
+    return messages
+
+g_reactive_system_prompt_cache: str | None = None
+g_last_ollama_activity_time: float = 0.0 # time.monotonic() of the last /api/chat request (for idle re-warm)
+
+def invalidate_reactive_system_prompt_cache():
+    """Called by load_admin_config: any config change may alter the role, goals or style."""
+    global g_reactive_system_prompt_cache
+    g_reactive_system_prompt_cache = None
+
+def get_reactive_system_prompt() -> str:
+    """
+    Returns the reactive system prompt (base prompt + active role + active goals + style).
+    Built once and reused until the config changes, so every request sends a byte-identical prefix.
+    """
+    global g_reactive_system_prompt_cache
+    if g_reactive_system_prompt_cache is not None:
+        return g_reactive_system_prompt_cache
+
+    active_role_key = g_admin_config.get("active_reactive_role", "default_assistant")
+    role_prompt_fragment = g_admin_config.get("reactive_roles", {}).get(active_role_key, "")
+    effective_reactive_system_prompt = g_admin_config.get("base_system_prompt_arabic", DEFAULT_AI_SYSTEM_PROMPT_ARABIC)
+    if role_prompt_fragment and role_prompt_fragment != effective_reactive_system_prompt:
+        effective_reactive_system_prompt += f"\n\nتعليمات الدور الإضافية ({active_role_key}):\n{role_prompt_fragment}"
+
+    active_goal_keys = g_admin_config.get("active_goals", [])
+    if active_goal_keys:
+        goal_instructions = []
+        for goal_key in active_goal_keys:
+            goal_desc = g_admin_config.get("ai_goals", {}).get(goal_key)
+            if goal_desc: goal_instructions.append(f"- {goal_desc} ({goal_key})")
+        if goal_instructions:
+            effective_reactive_system_prompt += "\n\nالأهداف النشطة حاليًا:\n" + "\n".join(goal_instructions)
+
+    style_desc = g_admin_config.get("ai_interaction_style", "")
+    if style_desc:
+        effective_reactive_system_prompt += f"\n\nأسلوب التفاعل المطلوب: {style_desc}"
+
+    g_reactive_system_prompt_cache = effective_reactive_system_prompt
+    logger.debug("Prompt assembler: Reactive system prompt rebuilt (%d chars).", len(effective_reactive_system_prompt))
+    return g_reactive_system_prompt_cache
+
+def apply_ollama_keep_alive(api_payload: dict) -> dict:
+    """Adds the configured keep_alive to an /api/chat payload (if any)."""
+    keep_alive_value = g_prompt_cache_settings.get("keep_alive", DEFAULT_PROMPT_CACHE_SETTINGS["keep_alive"])
+    if keep_alive_value not in (None, ""):
+        api_payload["keep_alive"] = keep_alive_value
+    return api_payload
+
+async def warmup_ollama_model(reason: str) -> bool:
+    """
+    Loads the model (honouring keep_alive) and primes Ollama's KV cache with the static reactive system prompt,
+    using the same num_ctx as real requests so the loaded runner is reused. Generates a single token.
+    """
+    global g_last_ollama_activity_time
+    warmup_payload = apply_ollama_keep_alive({
+        "model": g_ollama_model_name,
+        "messages": [{"role": "system", "content": get_reactive_system_prompt()}],
+        "options": {**g_ollama_model_options, "num_predict": 1},
+        "stream": False,
+    })
+    g_last_ollama_activity_time = time.monotonic()
+    warmup_start = time.monotonic()
+    try:
+        await g_ollama_client.post_json(g_ollama_chat_endpoint, warmup_payload, g_ollama_request_timeout)
+        logger.info("Ollama warmup (%s): Model '%s' warm in %.2fs (keep_alive: %s).", reason, g_ollama_model_name,
+                    time.monotonic() - warmup_start, warmup_payload.get("keep_alive", "default"))
+        return True
+    except Exception as e_warmup:
+        logger.warning("Ollama warmup (%s): Failed for model '%s': %s", reason, g_ollama_model_name, e_warmup)
+        return False
+# --- END OF PROMPT ASSEMBLY AND TOKEN BUDGET (PART 13 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 14: Conversation History Helpers and Rolling Summaries
+# - append_history_turn(): single place where turns enter a history deque; turns pushed out by maxlen
+#   are handed to the summarizer instead of being silently dropped.
+# - ConversationSummarizer folds evicted turns into a compact per-chat running summary (CHAT_SUMMARIES)
+#   with a low-priority LLM call on the idle-only "summary" scheduler lane, off the reply path.
+# - The summary is injected as one system message right after the system prompt.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part14_Integrate: Defining history helpers and summarizer.")
+
+CHAT_SUMMARIES: dict[str, str] = {} # "reactive:<chat_id>" / "outreach:<chat_id>" -> running summary
+
+def get_summary_key(interaction_type: str, chat_id: str) -> str:
+    return f"{interaction_type}:{chat_id}"
+
+def get_history_maxlen() -> int | None:
+    """Maxlen for history deques. With summaries enabled only the most recent turns are kept raw."""
+    if g_conversation_summary_settings.get("enabled"):
+        return max(1, int(g_conversation_summary_settings.get("keep_recent_turns", DEFAULT_CONVERSATION_SUMMARY_SETTINGS["keep_recent_turns"]))) * 2
+    return g_max_chat_history_turns * 2 if g_max_chat_history_turns > 0 else None
+
+def append_history_turn(history_deque: deque, turn: dict, summary_key: str = None):
+    """Appends a turn; if maxlen pushes the oldest turn out, it is passed to the summarizer."""
+    if summary_key and history_deque.maxlen is not None and len(history_deque) >= history_deque.maxlen and history_deque:
+        g_conversation_summarizer.on_turns_evicted(summary_key, [history_deque[0]])
+    history_deque.append(turn)
+
+def resize_history_deque(history_deque: deque, new_maxlen: int | None, summary_key: str = None) -> deque:
+    """Returns a deque with new_maxlen; turns that no longer fit are passed to the summarizer."""
+    existing_turns = list(history_deque)
+    if new_maxlen is not None and len(existing_turns) > new_maxlen:
+        if summary_key:
+            g_conversation_summarizer.on_turns_evicted(summary_key, existing_turns[:len(existing_turns) - new_maxlen])
+    return deque(existing_turns, maxlen=new_maxlen)
+
+def format_summary_block(conversation_summary: str) -> str:
+    return f"ملخص المحادثة السابقة مع هذا العميل (للسياق فقط):\n{conversation_summary}"
+
+async def summarize_conversation_turns(previous_summary: str, turns: list) -> str:
+    """Asks the LLM to merge turns into previous_summary. Returns the new summary text ('' on failure)."""
+    max_summary_chars = int(g_conversation_summary_settings.get("max_summary_chars", DEFAULT_CONVERSATION_SUMMARY_SETTINGS["max_summary_chars"]))
+    role_labels = {"user": "العميل", "assistant": "المساعد"}
+    transcript = "\n".join(f"{role_labels.get(turn['role'], turn['role'])}: {turn['content']}" for turn in turns)
+    summary_payload = apply_ollama_keep_alive({
+        "model": g_ollama_model_name,
+        "messages": [
+            {"role": "system", "content": (
+                "أنت تلخص محادثات خدمة العملاء. حدّث الملخص الحالي بإضافة المعلومات المهمة من الرسائل الجديدة: "
+                "اسم العميل واحتياجاته، الخدمات والأسعار التي نوقشت، ما تم الاتفاق عليه، والأسئلة المعلقة. "
+                f"اكتب الملخص بالعربية وبإيجاز شديد (أقل من {max_summary_chars} حرف) دون أي مقدمات.")},
+            {"role": "user", "content": f"الملخص الحالي:\n{previous_summary or '(لا يوجد)'}\n\nالرسائل الجديدة:\n{transcript}"},
+        ],
+        "options": {**g_ollama_model_options, "temperature": 0.2, "num_predict": 400},
+        "stream": False,
+    })
+    response_data = await g_ollama_client.post_json(g_ollama_chat_endpoint, summary_payload, g_ollama_request_timeout)
+    return response_data.get("message", {}).get("content", "").strip()[:max_summary_chars]
+
+class ConversationSummarizer:
+    """
+    Collects evicted turns per summary key and folds them into CHAT_SUMMARIES in background tasks.
+    Nothing here is awaited on the reply path: on_turns_evicted() only buffers and schedules.
+    """
+    def __init__(self):
+        self._pending_turns: dict[str, list] = {}
+        self._folding_keys: set = set()
+        self._fold_tasks: set = set()
+        self.stats = {"folds": 0, "turns_folded": 0, "errors": 0, "fold_seconds_total": 0.0}
+
+    def on_turns_evicted(self, summary_key: str, turns: list):
+        if not g_conversation_summary_settings.get("enabled") or not turns:
+            return
+        pending = self._pending_turns.setdefault(summary_key, [])
+        pending.extend(turns)
+        min_turns = int(g_conversation_summary_settings.get("min_turns_to_fold", DEFAULT_CONVERSATION_SUMMARY_SETTINGS["min_turns_to_fold"]))
+        if len(pending) >= min_turns and summary_key not in self._folding_keys:
+            self._folding_keys.add(summary_key)
+            fold_task = asyncio.get_running_loop().create_task(self._fold(summary_key))
+            self._fold_tasks.add(fold_task)
+            fold_task.add_done_callback(self._fold_tasks.discard)
+
+    def is_folding(self, summary_key: str) -> bool:
+        return summary_key in self._folding_keys
+
+    async def _fold(self, summary_key: str):
+        try:
+            while self._pending_turns.get(summary_key):
+                turns_to_fold = self._pending_turns.pop(summary_key)
+                previous_summary = CHAT_SUMMARIES.get(summary_key, "")
+                fold_start = time.monotonic()
+                try:
+                    new_summary = await g_llm_scheduler.submit(LLM_LANE_SUMMARY, f"summary:{summary_key}",
+                                                               lambda: summarize_conversation_turns(previous_summary, turns_to_fold))
+                except Exception as e_fold:
+                    self.stats["errors"] += 1
+                    logger.error("Summarizer: Folding %d turn(s) for '%s' failed: %s. Turns remain only in the interaction log.",
+                                 len(turns_to_fold), summary_key, e_fold)
+                    continue
+                if new_summary:
+                    CHAT_SUMMARIES[summary_key] = new_summary
+                    g_conversation_state_store.mark_dirty("summary", summary_key)
+                    self.stats["folds"] += 1; self.stats["turns_folded"] += len(turns_to_fold)
+                    self.stats["fold_seconds_total"] += time.monotonic() - fold_start
+                    logger.info("Summarizer: Folded %d turn(s) into summary for '%s' (%d chars).", len(turns_to_fold), summary_key, len(new_summary))
+        finally:
+            self._folding_keys.discard(summary_key)
+
+    async def stop(self):
+        for fold_task in list(self._fold_tasks): fold_task.cancel()
+        await asyncio.gather(*self._fold_tasks, return_exceptions=True)
+
+g_conversation_summarizer = ConversationSummarizer()
+# --- END OF CONVERSATION HISTORY HELPERS AND ROLLING SUMMARIES (PART 14 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 15: Reply Cache
+# - Reuses LLM replies for repeated first-turn customer questions (pricing, services, ...).
+# - Key: normalized aggregated prompt + fingerprint of everything that shapes the reply
+#   (effective system prompt, knowledge version and retrieval settings, model name and options).
+# - LRU + TTL eviction. A fingerprint change (e.g. $setprompt, $setmodel, $settemp, $setconfig or an
+#   edited knowledge file) empties the cache, so stale replies are never served.
+# - Optional semantic layer: paraphrases are matched by embedding similarity, per reactive role.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part15_Integrate: Defining reply cache.")
+
+CACHE_KEY_PUNCTUATION_RE = re.compile(r'[^\w\s]+', re.UNICODE)
+
+def normalize_prompt_for_cache(prompt_text: str) -> str:
+    """Arabic-normalizes prompt_text and drops punctuation, tatweel and extra whitespace."""
+    normalized_text = CACHE_KEY_PUNCTUATION_RE.sub(' ', normalize_arabic_text(prompt_text).replace('ـ', ''))
+    return " ".join(normalized_text.split())
+
+def build_reply_cache_context_fingerprint(system_prompt: str) -> str:
+    """Hash of every input besides the user's prompt that determines the generated reply."""
+    context_parts = {
+        "system_prompt": hashlib.sha1(system_prompt.encode('utf-8')).hexdigest(),
+        "knowledge_version": g_knowledge_index.version,
+        "knowledge_mode": g_knowledge_settings.get("mode"), "knowledge_top_k": g_knowledge_settings.get("top_k"),
+        "model": g_ollama_model_name, "options": g_ollama_model_options,
+        "prompt_layout": g_prompt_cache_settings.get("prompt_layout"),
+    }
+    return hashlib.sha1(json.dumps(context_parts, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class ReplyCache:
+    """LRU + TTL cache of LLM reply texts; cleared whenever the context fingerprint changes."""
+    def __init__(self):
+        self._entries: OrderedDict = OrderedDict() # key -> (reply_text, stored_at_monotonic)
+        self._context_fingerprint: str = ""
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0, "invalidations": 0}
+
+    def clear(self, reason: str):
+        if self._entries:
+            logger.info("Reply cache: Cleared %d entr(y/ies) (%s).", len(self._entries), reason)
+        self._entries.clear()
+        g_semantic_reply_cache.clear()
+        self.stats["invalidations"] += 1
+
+    def _check_context(self, context_fingerprint: str):
+        if context_fingerprint != self._context_fingerprint:
+            if self._context_fingerprint: self.clear("prompt/model/knowledge context changed")
+            self._context_fingerprint = context_fingerprint
+
+    @staticmethod
+    def make_key(normalized_prompt: str, context_fingerprint: str) -> str:
+        return hashlib.sha1(f"{context_fingerprint}\x1f{normalized_prompt}".encode('utf-8')).hexdigest()
+
+    def get(self, normalized_prompt: str, context_fingerprint: str) -> str | None:
+        self._check_context(context_fingerprint)
+        cache_key = self.make_key(normalized_prompt, context_fingerprint)
+        cached_entry = self._entries.get(cache_key)
+        if cached_entry is not None:
+            ttl_seconds = float(g_reply_cache_settings.get("ttl_seconds", DEFAULT_REPLY_CACHE_SETTINGS["ttl_seconds"]))
+            if time.monotonic() - cached_entry[1] <= ttl_seconds:
+                self._entries.move_to_end(cache_key)
+                self.stats["hits"] += 1
+                return cached_entry[0]
+            del self._entries[cache_key]
+            self.stats["expired"] += 1
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, normalized_prompt: str, context_fingerprint: str, reply_text: str):
+        self._check_context(context_fingerprint)
+        cache_key = self.make_key(normalized_prompt, context_fingerprint)
+        self._entries[cache_key] = (reply_text, time.monotonic())
+        self._entries.move_to_end(cache_key)
+        self.stats["stores"] += 1
+        max_entries = max(1, int(g_reply_cache_settings.get("max_entries", DEFAULT_REPLY_CACHE_SETTINGS["max_entries"])))
+        while len(self._entries) > max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+g_reply_cache = ReplyCache()
+
+def is_reply_cache_eligible(chat_id: str) -> bool:
+    """Cached replies ignore history, so by default only a chat's first turn (no history, no summary) qualifies."""
+    if not g_reply_cache_settings.get("enabled"):
+        return False
+    if not g_reply_cache_settings.get("first_turn_only", True):
+        return True
+    return not CHAT_HISTORIES.get(chat_id) and get_summary_key("reactive", chat_id) not in CHAT_SUMMARIES
+
+def record_cached_reply_turn(chat_id: str, user_prompt_text: str, assistant_response_text: str, model_used: str = None):
+    """Adds a reply served from cache (or generated speculatively) to the chat history and in-memory log, as query_ollama_chat would."""
+    standard_maxlen = get_history_maxlen()
+    if chat_id not in CHAT_HISTORIES:
+        CHAT_HISTORIES[chat_id] = deque(maxlen=standard_maxlen)
+    summary_key = get_summary_key("reactive", chat_id)
+    append_history_turn(CHAT_HISTORIES[chat_id], ChatTurn("user", user_prompt_text), summary_key)
+    append_history_turn(CHAT_HISTORIES[chat_id], ChatTurn("assistant", assistant_response_text), summary_key)
+    g_conversation_state_store.mark_dirty("history", chat_id)
+    INTERACTION_LOG.append(InteractionLogEntry(chat_id, user_prompt_text, assistant_response_text, False, model_used or f"{g_ollama_model_name} (cached)"))
+
+class SemanticReplyCache:
+    """
+    Near-duplicate reply cache: per reactive role, a bounded NumPy matrix of L2-normalized prompt embeddings.
+    A lookup is one matrix-vector product; the best match is reused at or above semantic_threshold.
+    Each role's store is reset when its context fingerprint or the embedding dimension changes.
+    Full stores replace their least recently used (or expired) row. Requires numpy.
+    """
+    def __init__(self):
+        self._role_stores: dict[str, dict] = {}
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0, "errors": 0, "seconds_saved": 0.0}
+
+    def clear(self):
+        self._role_stores.clear()
+
+    def _get_store(self, role_key: str, context_fingerprint: str, dimension: int, create: bool) -> dict | None:
+        role_store = self._role_stores.get(role_key)
+        if role_store is not None and (role_store["context"] != context_fingerprint or role_store["vectors"].shape[1] != dimension):
+            role_store = None
+            del self._role_stores[role_key]
+        if role_store is None and create:
+            capacity = max(1, int(g_reply_cache_settings.get("semantic_max_entries_per_role", DEFAULT_REPLY_CACHE_SETTINGS["semantic_max_entries_per_role"])))
+            role_store = {"context": context_fingerprint, "size": 0,
+                          "vectors": np.zeros((capacity, dimension), dtype=np.float32),
+                          "stored_at": np.zeros(capacity, dtype=np.float64), "last_used": np.zeros(capacity, dtype=np.float64),
+                          "prompts": [None] * capacity, "replies": [None] * capacity, "generation_seconds": [0.0] * capacity}
+            self._role_stores[role_key] = role_store
+        return role_store
+
+    def lookup(self, role_key: str, context_fingerprint: str, prompt_vector: "np.ndarray") -> dict:
+        """Returns {"similarity", "matched_prompt", "reply", "generation_seconds"}; "reply" is None below threshold."""
+        role_store = self._get_store(role_key, context_fingerprint, prompt_vector.shape[0], create=False)
+        match = {"similarity": None, "matched_prompt": None, "reply": None, "generation_seconds": 0.0}
+        if role_store and role_store["size"]:
+            size = role_store["size"]
+            ttl_seconds = float(g_reply_cache_settings.get("ttl_seconds", DEFAULT_REPLY_CACHE_SETTINGS["ttl_seconds"]))
+            similarities = role_store["vectors"][:size] @ prompt_vector
+            similarities[time.monotonic() - role_store["stored_at"][:size] > ttl_seconds] = -1.0 # Expired rows never match
+            best_row = int(np.argmax(similarities))
+            match["similarity"] = float(similarities[best_row])
+            match["matched_prompt"] = role_store["prompts"][best_row]
+            threshold = float(g_reply_cache_settings.get("semantic_threshold", DEFAULT_REPLY_CACHE_SETTINGS["semantic_threshold"]))
+            if match["similarity"] >= threshold:
+                role_store["last_used"][best_row] = time.monotonic()
+                match["reply"] = role_store["replies"][best_row]
+                match["generation_seconds"] = role_store["generation_seconds"][best_row]
+        if match["reply"] is not None:
+            self.stats["hits"] += 1; self.stats["seconds_saved"] += match["generation_seconds"]
+        else:
+            self.stats["misses"] += 1
+        return match
+
+    def add(self, role_key: str, context_fingerprint: str, prompt_vector: "np.ndarray", prompt_text: str, reply_text: str,
+            generation_seconds: float):
+        role_store = self._get_store(role_key, context_fingerprint, prompt_vector.shape[0], create=True)
+        capacity = role_store["vectors"].shape[0]
+        if role_store["size"] < capacity:
+            row = role_store["size"]; role_store["size"] += 1
+        else:
+            row = int(np.argmin(np.maximum(role_store["last_used"], role_store["stored_at"]))) # LRU row (expired rows are oldest)
+            self.stats["evicted"] += 1
+        now = time.monotonic()
+        role_store["vectors"][row] = prompt_vector
+        role_store["stored_at"][row] = now; role_store["last_used"][row] = now
+        role_store["prompts"][row] = prompt_text; role_store["replies"][row] = reply_text
+        role_store["generation_seconds"][row] = generation_seconds
+        self.stats["stores"] += 1
+
+    def entry_count(self) -> int:
+        return sum(role_store["size"] for role_store in self._role_stores.values())
+
+g_semantic_reply_cache = SemanticReplyCache()
+
+async def lookup_reply_cache(chat_id: str, prompt_text: str, system_prompt: str) -> tuple[str | None, dict | None]:
+    """
+    Exact lookup, then (if semantic_enabled) nearest-neighbour lookup for a reactive prompt.
+    Returns (cached_reply_or_None, cache_lookup); cache_lookup is None when the chat is not eligible
+    and is otherwise passed back to store_reply_in_cache() and reply_cache_log_fields().
+    """
+    if not is_reply_cache_eligible(chat_id):
+        return None, None
+    lookup_start = time.monotonic()
+    await g_knowledge_index.refresh_if_due(float(g_knowledge_settings.get("check_interval_seconds", DEFAULT_KNOWLEDGE_SETTINGS["check_interval_seconds"])))
+    cache_lookup = {"status": "miss", "normalized_prompt": normalize_prompt_for_cache(prompt_text),
+                    "context": build_reply_cache_context_fingerprint(system_prompt),
+                    "role": g_admin_config.get("active_reactive_role", "default_assistant"), "prompt_vector": None}
+    cached_reply = g_reply_cache.get(cache_lookup["normalized_prompt"], cache_lookup["context"])
+    if cached_reply is not None:
+        cache_lookup["status"] = "hit"
+    elif g_reply_cache_settings.get("semantic_enabled") and np is not None:
+        try:
+            cache_lookup["prompt_vector"] = await g_knowledge_embedding_index.embed_text(prompt_text)
+            semantic_match = g_semantic_reply_cache.lookup(cache_lookup["role"], cache_lookup["context"], cache_lookup["prompt_vector"])
+            cache_lookup.update(similarity=semantic_match["similarity"], matched_prompt=semantic_match["matched_prompt"])
+            if semantic_match["reply"] is not None:
+                cached_reply = semantic_match["reply"]
+                cache_lookup.update(status="semantic_hit", saved_seconds=semantic_match["generation_seconds"])
+        except Exception as e_semantic:
+            g_semantic_reply_cache.stats["errors"] += 1
+            logger.error("Reply cache: Semantic lookup failed for '%s': %s", chat_id, e_semantic)
+    cache_lookup["lookup_seconds"] = time.monotonic() - lookup_start
+    return cached_reply, cache_lookup
+
+def store_reply_in_cache(cache_lookup: dict | None, prompt_text: str, reply_text: str, generation_seconds: float):
+    """Stores a freshly generated reply after a cache miss (exact cache, and semantic cache when an embedding exists)."""
+    if not cache_lookup or cache_lookup["status"] != "miss":
+        return
+    g_reply_cache.put(cache_lookup["normalized_prompt"], cache_lookup["context"], reply_text)
+    if cache_lookup["prompt_vector"] is not None:
+        g_semantic_reply_cache.add(cache_lookup["role"], cache_lookup["context"], cache_lookup["prompt_vector"],
+                                   prompt_text, reply_text, generation_seconds)
+
+def reply_cache_log_fields(cache_lookup: dict | None) -> dict | None:
+    """The cache outcome as recorded in the jsonl log, for auditing reuse quality against latency saved."""
+    if not cache_lookup:
+        return None
+    log_fields = {"status": cache_lookup["status"], "lookup_seconds": round(cache_lookup["lookup_seconds"], 4)}
+    if cache_lookup.get("similarity") is not None:
+        log_fields.update(similarity=round(cache_lookup["similarity"], 4), matched_prompt=cache_lookup["matched_prompt"])
+    if cache_lookup.get("saved_seconds") is not None:
+        log_fields["saved_seconds"] = round(cache_lookup["saved_seconds"], 3)
+    return log_fields
+# --- END OF REPLY CACHE (PART 15 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 16: Interaction Log Storage (Backends and Buffered Writer)
+# - A log backend stores interaction turns and answers "latest turns" queries:
+#   JsonlLogBackend (default, one *_history.jsonl per chat and type) or SqliteLogBackend (WAL, indexed).
+# - log_interaction_turn() only serializes the turn and appends it to an in-memory queue.
+# - One flusher task writes batches (size/time thresholds) in a single worker-thread hop per batch
+#   and fsyncs per the configured policy. Drained completely on shutdown; $logstats reports backlog/latency.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part16_Integrate: Defining interaction log storage.")
+
+# A log record is (chat_id, interaction_type, turn_data, json_line).
+
+LINE_OFFSET_INDEX_SUFFIX: str = ".idx" # Sidecar of <file>.jsonl: one little-endian uint64 start offset per line
+LINE_OFFSET_RECORD = struct.Struct("<Q")
+REVERSE_TAIL_BLOCK_BYTES: int = 64 * 1024
+
+def read_last_lines(file_path: pathlib.Path, line_count: int) -> list[bytes]:
+    """Blocking: the last line_count complete lines of a file, read backwards from EOF in fixed-size blocks."""
+    if line_count <= 0:
+        return []
+    with open(file_path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        tail_data = b""
+        while position > 0 and tail_data.count(b'\n') <= line_count:
+            read_size = min(REVERSE_TAIL_BLOCK_BYTES, position)
+            position -= read_size
+            f.seek(position)
+            tail_data = f.read(read_size) + tail_data
+    lines = tail_data.split(b'\n')
+    if lines and lines[-1] == b"": lines.pop() # Trailing newline
+    if position > 0: lines = lines[1:] # First piece may be a partial line
+    return lines[-line_count:]
+
+def build_line_offset_index(log_file_path: pathlib.Path, index_path: pathlib.Path):
+    """Blocking: (re)builds the sidecar line-offset index of a log file with one sequential scan."""
+    offsets, position = [], 0
+    with open(log_file_path, 'rb') as f:
+        for raw_line in f:
+            if not raw_line.endswith(b'\n'): break
+            offsets.append(position); position += len(raw_line)
+    with open(index_path, 'wb') as index_file:
+        index_file.write(b"".join(LINE_OFFSET_RECORD.pack(offset) for offset in offsets))
+
+def is_line_offset_index_valid(log_file_path: pathlib.Path, index_path: pathlib.Path) -> bool:
+    """Blocking: cheap check that the index covers every complete line (its last entry starts the file's last line)."""
+    if not index_path.exists():
+        return False
+    log_size, index_size = log_file_path.stat().st_size, index_path.stat().st_size
+    if index_size % LINE_OFFSET_RECORD.size or (index_size == 0) != (log_size == 0):
+        return False
+    if not index_size:
+        return True
+    with open(index_path, 'rb') as index_file:
+        index_file.seek(index_size - LINE_OFFSET_RECORD.size)
+        (last_offset,) = LINE_OFFSET_RECORD.unpack(index_file.read(LINE_OFFSET_RECORD.size))
+    if last_offset >= log_size:
+        return False
+    with open(log_file_path, 'rb') as f:
+        f.seek(last_offset)
+        last_line = f.read()
+    return last_line.count(b'\n') == 1 and last_line.endswith(b'\n')
+
+def read_segment_tail(segment_path: pathlib.Path, line_count: int) -> list[bytes]:
+    """Blocking: last line_count lines of a rotated segment (gzip segments are streamed through once)."""
+    if segment_path.suffix == ".gz":
+        with gzip.open(segment_path, 'rb') as f:
+            return [line.rstrip(b'\n') for line in deque(f, maxlen=line_count)]
+    return read_last_lines(segment_path, line_count)
+
+def read_first_timestamp(log_path: pathlib.Path) -> str:
+    """Blocking: timestamp_iso of the first turn in a log file or (gzip) segment, "" if empty or unreadable."""
+    with (gzip.open(log_path, 'rb') if log_path.suffix == ".gz" else open(log_path, 'rb')) as f:
+        first_line = f.readline()
+    try: return json.loads(first_line).get("timestamp_iso", "")
+    except (json.JSONDecodeError, AttributeError): return ""
+
+def compress_log_segment(segment_path: pathlib.Path):
+    """Blocking: gzips a rotated segment next to itself (atomic rename), keeping its mtime for retention."""
+    segment_mtime = segment_path.stat().st_mtime
+    compressed_path = segment_path.with_name(segment_path.name + ".gz")
+    temp_path = compressed_path.with_name(compressed_path.name + ".tmp")
+    with open(segment_path, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    os.utime(temp_path, (segment_mtime, segment_mtime))
+    os.replace(temp_path, compressed_path)
+    segment_path.unlink()
+
+class JsonlLogBackend:
+    """
+    Appends to INTERACTION_LOGS_DIR/<chat>/<type>_history.jsonl, keeping recently used handles open in an LRU.
+    Every log file has a sidecar line-offset index (<file>.idx) maintained on write, so reading the last N turns
+    costs O(N) regardless of file size; without a usable index it falls back to a backwards block reader.
+    Files are rotated by size (on write) or age (maintain()) into <type>_history.<UTC time>.jsonl[.gz] segments;
+    readers continue into segments, newest first, when the active file holds fewer turns than requested.
+    """
+    name: str = "jsonl"
+
+    def __init__(self, logs_dir: str, max_open_files: int = 64):
+        self._logs_dir = pathlib.Path(logs_dir)
+        self.max_open_files = max_open_files
+        self._open_files: OrderedDict = OrderedDict() # path -> (log file, index file), both binary append
+        self._lock = threading.Lock()
+        self.rotation_stats = {"rotated": 0, "compressed": 0, "deleted": 0, "last_maintenance": None}
+
+    def log_file_path(self, chat_id: str, interaction_type: str) -> pathlib.Path:
+        return self._logs_dir / sanitize_filename(chat_id) / f"{interaction_type}_history.jsonl"
+
+    @staticmethod
+    def index_path(log_file_path: pathlib.Path) -> pathlib.Path:
+        return log_file_path.with_name(log_file_path.name + LINE_OFFSET_INDEX_SUFFIX)
+
+    @staticmethod
+    def segment_paths(log_file_path: pathlib.Path) -> list[pathlib.Path]:
+        """Rotated segments of a log file, oldest first."""
+        segment_stem = log_file_path.name[:-len(".jsonl")]
+        return sorted(segment for segment in log_file_path.parent.glob(f"{segment_stem}.*.jsonl*")
+                      if segment.name.endswith((".jsonl", ".jsonl.gz")))
+
+    def _rotate(self, log_file_path: pathlib.Path, reason: str):
+        """Blocking, called with self._lock held: renames the active file to a new segment and drops its index."""
+        open_files = self._open_files.pop(log_file_path, None)
+        for open_file in open_files or ():
+            open_file.close()
+        segment_base = f"{log_file_path.name[:-len('.jsonl')]}.{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}"
+        segment_path, suffix_counter = log_file_path.with_name(f"{segment_base}.jsonl"), 0
+        while segment_path.exists() or segment_path.with_name(segment_path.name + ".gz").exists():
+            suffix_counter += 1
+            segment_path = log_file_path.with_name(f"{segment_base}_{suffix_counter:03d}.jsonl") # Zero-padded: names sort chronologically
+        os.replace(log_file_path, segment_path)
+        self.index_path(log_file_path).unlink(missing_ok=True)
+        self.rotation_stats["rotated"] += 1
+        logger.info("Log rotation: Rotated '%s' to '%s' (%s).", log_file_path, segment_path.name, reason)
+
+    def _get_files(self, log_file_path: pathlib.Path) -> tuple:
+        open_files = self._open_files.get(log_file_path)
+        if open_files is not None:
+            self._open_files.move_to_end(log_file_path)
+            return open_files
+        log_file_path.parent.mkdir(parents=True, exist_ok=True)
+        index_path = self.index_path(log_file_path)
+        if log_file_path.exists() and not is_line_offset_index_valid(log_file_path, index_path):
+            build_line_offset_index(log_file_path, index_path) # Pre-existing log, or a crash between the two writes
+        open_files = (open(log_file_path, 'ab'), open(index_path, 'ab'))
+        self._open_files[log_file_path] = open_files
+        while len(self._open_files) > max(1, int(self.max_open_files)):
+            _, evicted_files = self._open_files.popitem(last=False)
+            for evicted_file in evicted_files: evicted_file.close()
+        return open_files
+
+    def write_records(self, log_records: list, do_fsync: bool) -> int:
+        """Blocking: appends the records grouped per file and their line offsets to the sidecar index. Returns fsyncs done."""
+        lines_by_file: dict[pathlib.Path, list] = {}
+        for chat_id, interaction_type, _, json_line in log_records:
+            lines_by_file.setdefault(self.log_file_path(chat_id, interaction_type), []).append((json_line + '\n').encode('utf-8'))
+        fsync_count = 0
+        with self._lock:
+            for log_file_path, encoded_lines in lines_by_file.items():
+                log_file, index_file = self._get_files(log_file_path)
+                line_offset = log_file.seek(0, os.SEEK_END)
+                line_offsets = []
+                for encoded_line in encoded_lines:
+                    line_offsets.append(LINE_OFFSET_RECORD.pack(line_offset)); line_offset += len(encoded_line)
+                log_file.write(b"".join(encoded_lines)); log_file.flush()
+                index_file.write(b"".join(line_offsets)); index_file.flush()
+                if do_fsync:
+                    os.fsync(log_file.fileno()); fsync_count += 1
+                max_file_bytes = int(g_log_rotation_settings.get("max_file_bytes") or 0)
+                if g_log_rotation_settings.get("enabled") and max_file_bytes and line_offset >= max_file_bytes:
+                    if not do_fsync: os.fsync(log_file.fileno())
+                    self._rotate(log_file_path, f"size {line_offset} bytes") # Only a rename; compression happens in maintain()
+        return fsync_count
+
+    def maintain(self) -> dict:
+        """
+        Blocking maintenance pass (run off the event loop): age-based rotation, compression of rotated segments,
+        and retention (age and per-file segment count). Returns this pass's counters.
+        """
+        pass_stats = {"rotated": 0, "compressed": 0, "deleted": 0}
+        if not g_log_rotation_settings.get("enabled"):
+            return pass_stats
+        now = time.time()
+        max_age_days = float(g_log_rotation_settings.get("max_file_age_days") or 0)
+        rotate_before_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - max_age_days * 86400)) if max_age_days else None
+        retention_days = float(g_log_rotation_settings.get("retention_days") or 0)
+        max_segments = int(g_log_rotation_settings.get("max_segments_per_file") or 0)
+        # Active files plus files whose active part was just rotated away (only segments left)
+        log_file_paths = {log_path.with_name(log_path.name.split('.')[0] + ".jsonl") for log_path in self._logs_dir.glob("*/*_history*.jsonl*")
+                          if not log_path.name.endswith(LINE_OFFSET_INDEX_SUFFIX)}
+        for log_file_path in sorted(log_file_paths):
+            try:
+                if rotate_before_iso and log_file_path.exists() and log_file_path.stat().st_size:
+                    first_timestamp = read_first_timestamp(log_file_path)
+                    if first_timestamp and first_timestamp < rotate_before_iso:
+                        with self._lock: self._rotate(log_file_path, f"older than {max_age_days:g} days")
+                        pass_stats["rotated"] += 1
+                segments = self.segment_paths(log_file_path)
+                for segment_path in segments:
+                    if g_log_rotation_settings.get("compress", True) and segment_path.suffix == ".jsonl":
+                        compress_log_segment(segment_path) # Segments are immutable, so no lock is needed
+                        pass_stats["compressed"] += 1
+                segments = self.segment_paths(log_file_path)
+                expired_segments = [segment for segment in segments if retention_days and now - segment.stat().st_mtime > retention_days * 86400]
+                if max_segments and len(segments) - len(expired_segments) > max_segments:
+                    expired_segments = segments[:len(segments) - max_segments]
+                for segment_path in expired_segments:
+                    segment_path.unlink(); pass_stats["deleted"] += 1
+                if expired_segments:
+                    self._prune_search_index(log_file_path)
+            except OSError as e_maintain:
+                logger.error("Log rotation: Maintenance failed for '%s': %s", log_file_path, e_maintain)
+        for counter_name in ("compressed", "deleted"): self.rotation_stats[counter_name] += pass_stats[counter_name]
+        self.rotation_stats["last_maintenance"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        return pass_stats
+
+    def _prune_search_index(self, log_file_path: pathlib.Path):
+        """Blocking: after retention deleted segments, drops search hits older than the oldest turn still on disk for this log."""
+        keep_from_iso = ""
+        for remaining_path in self.segment_paths(log_file_path) + ([log_file_path] if log_file_path.exists() else []):
+            keep_from_iso = read_first_timestamp(remaining_path)
+            if keep_from_iso: break
+        try:
+            g_log_search_index.delete_turns(chat_id_from_log_dir_name(log_file_path.parent.name),
+                                            log_file_path.name[:-len("_history.jsonl")], keep_from_iso or None)
+        except Exception as e_prune: # Stale hits only point at deleted turns; the next rebuild drops them too
+            g_log_search_index.stats["errors"] += 1
+            logger.error("Log search: Failed to prune index for '%s': %s", log_file_path, e_prune)
+
+    def _read_last_lines(self, log_file_path: pathlib.Path, line_count: int) -> list[bytes]:
+        index_path = self.index_path(log_file_path)
+        if line_count <= 0:
+            return []
+        # Files open for append have an index validated on open and maintained since; others are checked first.
+        if log_file_path in self._open_files or is_line_offset_index_valid(log_file_path, index_path):
+            with open(index_path, 'rb') as index_file:
+                index_size = index_file.seek(0, os.SEEK_END)
+                entries_to_read = min(line_count, index_size // LINE_OFFSET_RECORD.size)
+                if not entries_to_read:
+                    return []
+                index_file.seek(index_size - entries_to_read * LINE_OFFSET_RECORD.size)
+                (first_offset,) = LINE_OFFSET_RECORD.unpack(index_file.read(LINE_OFFSET_RECORD.size))
+            with open(log_file_path, 'rb') as f:
+                f.seek(first_offset)
+                return f.read().splitlines()[:entries_to_read]
+        return read_last_lines(log_file_path, line_count)
+
+    def read_recent_turns(self, chat_id: str, interaction_type: str, limit: int) -> list[dict]:
+        """Blocking: the latest `limit` turns of one chat log, oldest first."""
+        log_file_path = self.log_file_path(chat_id, interaction_type)
+        with self._lock:
+            recent_lines = self._read_last_lines(log_file_path, limit) if log_file_path.exists() else []
+            segments = self.segment_paths(log_file_path) if len(recent_lines) < limit else []
+        for segment_path in reversed(segments): # Newest segment first
+            if len(recent_lines) >= limit: break
+            if not segment_path.exists() and segment_path.with_name(segment_path.name + ".gz").exists():
+                segment_path = segment_path.with_name(segment_path.name + ".gz") # Compressed by a concurrent maintenance pass
+            try: recent_lines = read_segment_tail(segment_path, limit - len(recent_lines)) + recent_lines
+            except FileNotFoundError: continue # Deleted by retention meanwhile
+        recent_turns = []
+        for line in recent_lines:
+            line = line.decode('utf-8', errors='replace')
+            try: recent_turns.append(json.loads(line))
+            except json.JSONDecodeError: recent_turns.append({"role": "raw_log_line_error", "content": line.strip()})
+        return recent_turns
+
+    def close(self):
+        with self._lock:
+            while self._open_files:
+                _, open_files = self._open_files.popitem(last=False)
+                for open_file in open_files:
+                    try:
+                        open_file.flush(); os.fsync(open_file.fileno())
+                    finally:
+                        open_file.close()
+
+def chat_id_from_log_dir_name(dir_name: str) -> str:
+    """Best-effort inverse of sanitize_filename() for WhatsApp ids (only the '@' before the server part is restored)."""
+    return re.sub(r'_(c\.us|g\.us|lid|broadcast|newsletter)$', r'@\1', dir_name)
+
+class SqliteLogBackend:
+    """
+    One SQLite database in WAL mode. Indexed on chat_id, interaction_type, timestamp and outreach_campaign_key;
+    every batch is one executemany() inside one transaction. The full turn is kept as JSON in `payload`.
+    """
+    name: str = "sqlite"
+    SCHEMA_SQL: str = """
+        CREATE TABLE IF NOT EXISTS interaction_turns (
+            id INTEGER PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            interaction_type TEXT NOT NULL,
+            timestamp_iso TEXT NOT NULL,
+            role TEXT,
+            outreach_campaign_key TEXT,
+            is_error INTEGER NOT NULL DEFAULT 0,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_turns_chat ON interaction_turns (chat_id, interaction_type, id);
+        CREATE INDEX IF NOT EXISTS idx_turns_type ON interaction_turns (interaction_type, id);
+        CREATE INDEX IF NOT EXISTS idx_turns_time ON interaction_turns (timestamp_iso);
+        CREATE INDEX IF NOT EXISTS idx_turns_campaign ON interaction_turns (outreach_campaign_key, id);
+        CREATE TABLE IF NOT EXISTS imported_jsonl_files (path TEXT PRIMARY KEY, size_bytes INTEGER NOT NULL, rows INTEGER NOT NULL);
+    """
+
+    def __init__(self, db_path: str, synchronous: str = "NORMAL"):
+        self.db_path = db_path
+        pathlib.Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"PRAGMA synchronous={synchronous if synchronous in ('OFF', 'NORMAL', 'FULL') else 'NORMAL'}")
+        self._connection.executescript(self.SCHEMA_SQL)
+
+    @staticmethod
+    def _row_values(chat_id: str, interaction_type: str, turn_data: dict, json_line: str) -> tuple:
+        return (chat_id, interaction_type, turn_data.get("timestamp_iso", ""), turn_data.get("role"),
+                turn_data.get("outreach_campaign_key"), 1 if turn_data.get("is_error") else 0, json_line)
+
+    def _insert_rows(self, row_values: list):
+        self._connection.executemany(
+            "INSERT INTO interaction_turns (chat_id, interaction_type, timestamp_iso, role, outreach_campaign_key, is_error, payload) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", row_values)
+
+    def write_records(self, log_records: list, do_fsync: bool) -> int:
+        """Blocking: inserts the batch in one transaction (durability follows PRAGMA synchronous)."""
+        with self._lock:
+            with self._connection: # BEGIN ... COMMIT
+                self._connection.execute("BEGIN")
+                self._insert_rows([self._row_values(*log_record) for log_record in log_records])
+        return 0
+
+    def query_turns(self, chat_id: str = None, interaction_type: str = None, campaign_key: str = None,
+                    since_iso: str = None, errors_only: bool = False, limit: int = 50) -> list[dict]:
+        """Blocking: latest matching turns (oldest first), e.g. 'errors today' or 'all outreach for campaign Y'."""
+        conditions, parameters = [], []
+        for column, value in (("chat_id", chat_id), ("interaction_type", interaction_type), ("outreach_campaign_key", campaign_key)):
+            if value is not None:
+                conditions.append(f"{column} = ?"); parameters.append(value)
+        if since_iso:
+            conditions.append("timestamp_iso >= ?"); parameters.append(since_iso)
+        if errors_only:
+            conditions.append("is_error = 1")
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT payload FROM interaction_turns {where_sql} ORDER BY id DESC LIMIT ?", (*parameters, int(limit))).fetchall()
+        return [json.loads(payload) for (payload,) in reversed(rows)]
+
+    def read_recent_turns(self, chat_id: str, interaction_type: str, limit: int) -> list[dict]:
+        return self.query_turns(chat_id=chat_id, interaction_type=interaction_type, limit=limit)
+
+    def read_rows_after(self, after_id: int, limit: int) -> list[tuple]:
+        """Blocking: (id, chat_id, interaction_type, payload) rows with id > after_id, in id order (incremental readers)."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT id, chat_id, interaction_type, payload FROM interaction_turns WHERE id > ? ORDER BY id LIMIT ?",
+                (int(after_id), int(limit))).fetchall()
+
+    def import_jsonl_tree(self, logs_dir: str) -> tuple[int, int]:
+        """
+        Blocking, one-shot: imports every <chat>/<type>_history.jsonl under logs_dir. The byte offset reached in each
+        file is remembered, so re-running only imports lines appended since. Returns (files_imported, rows_imported).
+        Lines carry no chat_id, so it is restored from the sanitized directory name ("967..._c.us" -> "967...@c.us").
+        """
+        files_imported, rows_imported = 0, 0
+        for log_file_path in sorted(pathlib.Path(logs_dir).glob("*/*_history.jsonl")):
+            with self._lock:
+                imported_row = self._connection.execute(
+                    "SELECT size_bytes FROM imported_jsonl_files WHERE path = ?", (str(log_file_path),)).fetchone()
+            imported_offset = imported_row[0] if imported_row else 0
+            if log_file_path.stat().st_size <= imported_offset:
+                continue
+            interaction_type = log_file_path.name[:-len("_history.jsonl")]
+            row_values = []
+            with open(log_file_path, 'rb') as f:
+                f.seek(imported_offset)
+                for raw_line in f:
+                    if not raw_line.endswith(b'\n'): break # Partial last line: import it next time
+                    imported_offset += len(raw_line)
+                    line = raw_line.decode('utf-8', errors='replace').strip()
+                    try: turn_data = json.loads(line) if line else None
+                    except json.JSONDecodeError: turn_data = None
+                    if isinstance(turn_data, dict):
+                        row_values.append(self._row_values(turn_data.get("chat_id") or chat_id_from_log_dir_name(log_file_path.parent.name),
+                                                           interaction_type, turn_data, line))
+            with self._lock:
+                with self._connection:
+                    self._connection.execute("BEGIN")
+                    self._insert_rows(row_values)
+                    self._connection.execute(
+                        "INSERT INTO imported_jsonl_files (path, size_bytes, rows) VALUES (?, ?, ?) "
+                        "ON CONFLICT(path) DO UPDATE SET size_bytes = excluded.size_bytes, rows = rows + excluded.rows",
+                        (str(log_file_path), imported_offset, len(row_values)))
+            files_imported += 1; rows_imported += len(row_values)
+        return files_imported, rows_imported
+
+    def maintain(self) -> dict:
+        """Blocking: retention for the database (rows older than log_rotation.retention_days)."""
+        pass_stats = {"rotated": 0, "compressed": 0, "deleted": 0}
+        retention_days = float(g_log_rotation_settings.get("retention_days") or 0)
+        if g_log_rotation_settings.get("enabled") and retention_days:
+            delete_before_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - retention_days * 86400))
+            with self._lock:
+                with self._connection:
+                    self._connection.execute("BEGIN")
+                    pass_stats["deleted"] = self._connection.execute(
+                        "DELETE FROM interaction_turns WHERE timestamp_iso < ?", (delete_before_iso,)).rowcount
+            if pass_stats["deleted"]:
+                try:
+                    g_log_search_index.delete_turns(before_iso=delete_before_iso)
+                except Exception as e_prune:
+                    g_log_search_index.stats["errors"] += 1
+                    logger.error("Log search: Failed to prune index after SQLite retention: %s", e_prune)
+        return pass_stats
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+g_log_backend = None # Created on first use from log_storage settings
+
+def get_log_backend():
+    """Returns the configured interaction log backend, creating it on first use."""
+    global g_log_backend
+    if g_log_backend is None:
+        if g_log_storage_settings.get("backend") == "sqlite":
+            g_log_backend = SqliteLogBackend(g_log_storage_settings.get("sqlite_path", DEFAULT_LOG_STORAGE_SETTINGS["sqlite_path"]),
+                                             g_log_storage_settings.get("sqlite_synchronous", DEFAULT_LOG_STORAGE_SETTINGS["sqlite_synchronous"]))
+        else:
+            g_log_backend = JsonlLogBackend(INTERACTION_LOGS_DIR, int(g_log_writer_settings.get("max_open_files", DEFAULT_LOG_WRITER_SETTINGS["max_open_files"])))
+        logger.info("Log storage: Using '%s' interaction log backend.", g_log_backend.name)
+    return g_log_backend
+
+def store_log_records(log_records: list, do_fsync: bool) -> int:
+    """Blocking: writes records to the log backend, then adds them to the search index. Returns fsyncs done."""
+    fsync_count = get_log_backend().write_records(log_records, do_fsync)
+    try:
+        g_log_search_index.index_records(log_records)
+    except Exception as e_index: # The log itself is safely stored; a missed index update only affects $searchlogs
+        g_log_search_index.stats["errors"] += 1
+        logger.error("Log search: Failed to index %d record(s): %s", len(log_records), e_index)
+    return fsync_count
+
+class InteractionLogWriter:
+    """Single-writer, batched appender in front of the interaction log backend."""
+    def __init__(self):
+        self._pending: deque = deque() # (log_record, enqueued_at_monotonic)
+        self._wakeup_event: asyncio.Event | None = None
+        self._flush_waiters: list = []
+        self._flusher_task: asyncio.Task | None = None
+        self._batch_in_flight: bool = False # A popped batch is still being written in the worker thread
+        self._stopping: bool = False
+        self._last_fsync_time: float = 0.0
+        self._settings: dict = DEFAULT_LOG_WRITER_SETTINGS.copy()
+        self._write_latencies: deque = deque(maxlen=500)
+        self._queue_latencies: deque = deque(maxlen=500)
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "write_errors": 0, "max_backlog": 0, "fsyncs": 0}
+
+    @property
+    def is_running(self) -> bool:
+        return self._flusher_task is not None and not self._flusher_task.done()
+
+    @property
+    def backlog(self) -> int:
+        return len(self._pending)
+
+    def start(self, settings: dict):
+        self._settings = {**DEFAULT_LOG_WRITER_SETTINGS, **(settings or {})}
+        if self.is_running or not self._settings.get("enabled", True):
+            return
+        self._wakeup_event = asyncio.Event()
+        self._stopping = False
+        self._flusher_task = asyncio.get_running_loop().create_task(self._flusher_loop())
+        logger.info("Log writer: Started (batch %d entries / %.2fs, fsync '%s').",
+                    self._settings["batch_max_entries"], self._settings["batch_max_delay_seconds"], self._settings["fsync"])
+
+    def configure(self, settings: dict):
+        self._settings = {**DEFAULT_LOG_WRITER_SETTINGS, **(settings or {})}
+        if isinstance(g_log_backend, JsonlLogBackend):
+            g_log_backend.max_open_files = int(self._settings["max_open_files"])
+
+    def enqueue(self, log_record: tuple):
+        self._pending.append((log_record, time.monotonic()))
+        self.stats["enqueued"] += 1
+        self.stats["max_backlog"] = max(self.stats["max_backlog"], len(self._pending))
+        if len(self._pending) >= int(self._settings["batch_max_entries"]):
+            self._wakeup_event.set()
+
+    async def flush(self):
+        """Waits until everything enqueued so far is stored (e.g. before reading logs back)."""
+        if not self.is_running or not (self._pending or self._batch_in_flight):
+            return
+        flush_waiter = asyncio.get_running_loop().create_future()
+        self._flush_waiters.append(flush_waiter)
+        self._wakeup_event.set()
+        await flush_waiter
+
+    async def _flusher_loop(self):
+        # Not cancelled on shutdown (a cancelled to_thread hop would keep writing behind our back); stop() sets _stopping instead.
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup_event.wait(), timeout=float(self._settings["batch_max_delay_seconds"]))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup_event.clear()
+            await self._flush_pending()
+        await self._flush_pending() # Drain on shutdown
+        await asyncio.to_thread(get_log_backend().close)
+
+    async def _flush_pending(self):
+        flush_waiters, self._flush_waiters = self._flush_waiters, []
+        while self._pending:
+            batch = [self._pending.popleft() for _ in range(min(len(self._pending), int(self._settings["batch_max_entries"])))]
+            fsync_policy = self._settings.get("fsync", "interval")
+            do_fsync = fsync_policy == "always" or (
+                fsync_policy == "interval" and time.monotonic() - self._last_fsync_time >= float(self._settings["fsync_interval_seconds"]))
+            write_start = time.monotonic()
+            self._batch_in_flight = True
+            try:
+                self.stats["fsyncs"] += await asyncio.to_thread(store_log_records, [log_record for log_record, _ in batch], do_fsync)
+                self.stats["written"] += len(batch)
+                if do_fsync: self._last_fsync_time = time.monotonic()
+            except Exception as e_write:
+                self.stats["write_errors"] += 1
+                logger.error("Log writer: Failed to write batch of %d log record(s): %s", len(batch), e_write)
+            finally:
+                self._batch_in_flight = False
+            write_done = time.monotonic()
+            self.stats["batches"] += 1
+            self._write_latencies.append(write_done - write_start)
+            self._queue_latencies.extend(write_done - enqueued_at for _, enqueued_at in batch)
+        for flush_waiter in flush_waiters:
+            if not flush_waiter.done(): flush_waiter.set_result(None)
+
+    async def stop(self):
+        if not self.is_running:
+            return
+        self._stopping = True
+        self._wakeup_event.set()
+        await asyncio.gather(self._flusher_task, return_exceptions=True)
+        self._flusher_task = None
+        logger.info("Log writer: Stopped. %d record(s) written in %d batch(es).", self.stats["written"], self.stats["batches"])
+
+    def get_stats(self) -> dict:
+        def summarize(samples: deque) -> dict:
+            ordered = sorted(samples)
+            if not ordered: return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+            return {"avg": sum(ordered) / len(ordered), "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], "max": ordered[-1]}
+        return {**self.stats, "running": self.is_running, "backlog": self.backlog,
+                "backend": g_log_backend.name if g_log_backend else g_log_storage_settings.get("backend", "jsonl"),
+                "open_files": len(g_log_backend._open_files) if isinstance(g_log_backend, JsonlLogBackend) else 0,
+                "write_latency": summarize(self._write_latencies), "queue_latency": summarize(self._queue_latencies)}
+
+g_interaction_log_writer = InteractionLogWriter()
+
+async def log_maintenance_loop():
+    """Runs the log backend's maintenance pass (rotation by age, compression, retention) periodically, off the event loop."""
+    while True:
+        try: # Analytics first: segments must be caught up before they are compressed or deleted
+            await asyncio.to_thread(g_log_analytics.update)
+        except Exception as e_analytics:
+            logger.error("Log analytics: Update failed: %s", e_analytics)
+        try:
+            pass_stats = await asyncio.to_thread(get_log_backend().maintain)
+            if any(pass_stats.values()):
+                logger.info("Log rotation: Maintenance pass done (%s).", pass_stats)
+        except Exception as e_maintenance:
+            logger.error("Log rotation: Maintenance pass failed: %s", e_maintenance)
+        await asyncio.sleep(max(30.0, float(g_log_rotation_settings.get("check_interval_seconds", DEFAULT_LOG_ROTATION_SETTINGS["check_interval_seconds"]))))
+
+async def read_recent_interaction_turns(chat_id: str, interaction_type: str, limit: int) -> list[dict]:
+    """Latest `limit` logged turns for a chat (oldest first), including turns still queued in the writer."""
+    await g_interaction_log_writer.flush()
+    return await asyncio.to_thread(get_log_backend().read_recent_turns, chat_id, interaction_type, limit)
+
+def import_jsonl_logs_to_sqlite_cli():
+    """`python AIaspects.py --import-jsonl-logs`: one-shot import of INTERACTION_LOGS_DIR into the SQLite log database."""
+    load_admin_config()
+    sqlite_backend = SqliteLogBackend(g_log_storage_settings.get("sqlite_path", DEFAULT_LOG_STORAGE_SETTINGS["sqlite_path"]),
+                                      g_log_storage_settings.get("sqlite_synchronous", DEFAULT_LOG_STORAGE_SETTINGS["sqlite_synchronous"]))
+    try:
+        files_imported, rows_imported = sqlite_backend.import_jsonl_tree(INTERACTION_LOGS_DIR)
+    finally:
+        sqlite_backend.close()
+    print(f"Imported {rows_imported} turn(s) from {files_imported} jsonl file(s) under '{INTERACTION_LOGS_DIR}' into '{sqlite_backend.db_path}'.")
+    if g_log_storage_settings.get("backend") != "sqlite":
+        print('Set log_storage.backend to "sqlite" in admin_config.json to use it.')
+# --- END OF INTERACTION LOG STORAGE (PART 16 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 17: Interaction Log Search Index
+# - Inverted index over logged `content`, kept in a SQLite FTS5 table (compact on-disk segments, bm25 ranking).
+# - Text is indexed as Arabic-normalized search terms (tokenize_for_search) plus digit-only phone numbers,
+#   with chat_id / interaction type / timestamp / role stored alongside each posting.
+# - Updated by the log writer in the same worker-thread hop as the log write; $searchlogs queries it.
+# - Log retention (either backend) deletes the hits of the turns it removes.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part17_Integrate: Defining interaction log search index.")
+
+PHONE_NUMBER_RE = re.compile(r'\+?\d[\d\s\-()]{6,}\d')
+SEARCH_SINCE_RE = re.compile(r'^(\d+)([hdw])$')
+
+def index_terms_for_text(text: str) -> list[str]:
+    """Search terms for log text/queries: normalized word tokens plus phone numbers with separators removed."""
+    terms = tokenize_for_search(text)
+    for phone_match in PHONE_NUMBER_RE.findall(text or ""):
+        phone_digits = re.sub(r'\D', '', phone_match)
+        if phone_digits not in terms: terms.append(phone_digits)
+    return terms
+
+def parse_search_since(since_text: str) -> str | None:
+    """'24h' / '7d' / '2w' / 'YYYY-MM-DD' -> ISO timestamp lower bound (UTC), or None if not a since-argument."""
+    relative_match = SEARCH_SINCE_RE.match(since_text.lower())
+    if relative_match:
+        unit_seconds = {"h": 3600, "d": 86400, "w": 7 * 86400}[relative_match.group(2)]
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - int(relative_match.group(1)) * unit_seconds))
+    if re.match(r'^\d{4}-\d{2}-\d{2}$', since_text):
+        return f"{since_text}T00:00:00Z"
+    return None
+
+class LogSearchIndex:
+    """Persistent full-text index of logged turns (SQLite FTS5). All methods are blocking; call them off the event loop."""
+    SNIPPET_CHARS: int = 160
+
+    def __init__(self):
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._unavailable_reason: str = ""
+        self.stats = {"indexed": 0, "errors": 0, "queries": 0}
+
+    def _get_connection(self) -> sqlite3.Connection | None:
+        if self._connection is None and not self._unavailable_reason:
+            index_path = g_log_search_settings.get("index_path", DEFAULT_LOG_SEARCH_SETTINGS["index_path"])
+            try:
+                pathlib.Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS log_search USING fts5("
+                    "terms, chat_id UNINDEXED, interaction_type UNINDEXED, timestamp_iso UNINDEXED, role UNINDEXED, snippet UNINDEXED, "
+                    "tokenize = 'unicode61', detail = column)")
+                self._connection = connection
+            except sqlite3.Error as e_open:
+                self._unavailable_reason = str(e_open) # e.g. SQLite built without FTS5
+                logger.error("Log search: Index unavailable ('%s'): %s", index_path, e_open)
+        return self._connection
+
+    @property
+    def unavailable_reason(self) -> str:
+        return self._unavailable_reason
+
+    def index_records(self, log_records: list):
+        """Adds the turns of a log batch to the index in one transaction."""
+        if not g_log_search_settings.get("enabled", True):
+            return
+        rows = []
+        for chat_id, interaction_type, turn_data, _ in log_records:
+            content = str(turn_data.get("content") or "")
+            if chat_id == ADMIN_CHAT_ID and content.startswith(g_command_prefix):
+                continue # Admin commands (including $searchlogs itself) would only pollute results
+            terms = index_terms_for_text(content)
+            if terms:
+                rows.append((" ".join(terms), chat_id, interaction_type, turn_data.get("timestamp_iso", ""),
+                             turn_data.get("role", ""), content[:self.SNIPPET_CHARS]))
+        connection = self._get_connection()
+        if not rows or connection is None:
+            return
+        with self._lock:
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "INSERT INTO log_search (terms, chat_id, interaction_type, timestamp_iso, role, snippet) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.stats["indexed"] += len(rows)
+
+    def search(self, query_text: str, since_iso: str = None, interaction_type: str = None, limit: int = 20) -> list[dict]:
+        """Ranked hits (best first): every query term must occur in the turn (words also match as prefixes, e.g. plurals)."""
+        query_terms = index_terms_for_text(query_text)
+        connection = self._get_connection()
+        if not query_terms or connection is None:
+            return []
+        match_expression = " ".join(f'"{term}"*' if len(term) >= 3 and not term.isdigit() else f'"{term}"' for term in query_terms)
+        conditions, parameters = ["log_search MATCH ?"], [match_expression]
+        if since_iso:
+            conditions.append("timestamp_iso >= ?"); parameters.append(since_iso)
+        if interaction_type:
+            conditions.append("interaction_type = ?"); parameters.append(interaction_type)
+        with self._lock:
+            rows = connection.execute(
+                f"SELECT chat_id, interaction_type, timestamp_iso, role, snippet, bm25(log_search) AS score FROM log_search "
+                f"WHERE {' AND '.join(conditions)} ORDER BY score LIMIT ?", (*parameters, int(limit))).fetchall()
+        self.stats["queries"] += 1
+        return [{"chat_id": chat_id, "interaction_type": row_type, "timestamp_iso": timestamp_iso, "role": role,
+                 "snippet": snippet, "score": -score} for chat_id, row_type, timestamp_iso, role, snippet, score in rows]
+
+    def delete_turns(self, chat_id: str = None, interaction_type: str = None, before_iso: str = None) -> int:
+        """Removes indexed turns (e.g. after log retention), optionally limited to one log and to turns older than before_iso."""
+        conditions, parameters = [], []
+        for column, value in (("chat_id", chat_id), ("interaction_type", interaction_type)):
+            if value is not None:
+                conditions.append(f"{column} = ?"); parameters.append(value)
+        if before_iso:
+            conditions.append("timestamp_iso < ?"); parameters.append(before_iso)
+        connection = self._get_connection()
+        if connection is None:
+            return 0
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            return connection.execute(f"DELETE FROM log_search {where_sql}", parameters).rowcount
+
+    def rebuild_from_jsonl_tree(self, logs_dir: str) -> int:
+        """Re-indexes every jsonl log (active files and rotated segments) under logs_dir. Returns turns indexed."""
+        connection = self._get_connection()
+        if connection is None:
+            return 0
+        with self._lock:
+            connection.execute("DELETE FROM log_search")
+        indexed_before = self.stats["indexed"]
+        for log_path in sorted(pathlib.Path(logs_dir).glob("*/*_history*.jsonl*")):
+            if log_path.name.endswith((LINE_OFFSET_INDEX_SUFFIX, ".tmp")): continue
+            interaction_type = log_path.name.split('.')[0][:-len("_history")]
+            chat_id = chat_id_from_log_dir_name(log_path.parent.name)
+            batch = []
+            with (gzip.open(log_path, 'rt', encoding='utf-8') if log_path.suffix == ".gz" else open(log_path, 'r', encoding='utf-8')) as f:
+                for line in f:
+                    try: turn_data = json.loads(line)
+                    except json.JSONDecodeError: continue
+                    if isinstance(turn_data, dict): batch.append((chat_id, interaction_type, turn_data, line))
+                    if len(batch) >= 1000: self.index_records(batch); batch = []
+            self.index_records(batch)
+        with self._lock:
+            connection.execute("INSERT INTO log_search (log_search) VALUES ('optimize')") # Merge FTS segments
+        return self.stats["indexed"] - indexed_before
+
+    def rebuild_from_sqlite(self, sqlite_backend: "SqliteLogBackend") -> int:
+        """Re-indexes every turn stored in the SQLite log database. Returns turns indexed."""
+        connection = self._get_connection()
+        if connection is None:
+            return 0
+        with self._lock:
+            connection.execute("DELETE FROM log_search")
+        indexed_before, after_id = self.stats["indexed"], 0
+        while True:
+            rows = sqlite_backend.read_rows_after(after_id, 1000)
+            if not rows: break
+            self.index_records([(chat_id, interaction_type, json.loads(payload), payload) for _, chat_id, interaction_type, payload in rows])
+            after_id = rows[-1][0]
+        with self._lock:
+            connection.execute("INSERT INTO log_search (log_search) VALUES ('optimize')")
+        return self.stats["indexed"] - indexed_before
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close(); self._connection = None
+
+g_log_search_index = LogSearchIndex()
+
+def rebuild_log_search_index_cli():
+    """`python AIaspects.py --rebuild-search-index`: (re)indexes all existing logs of the configured backend, e.g. after upgrading."""
+    load_admin_config()
+    log_backend = get_log_backend()
+    try:
+        if isinstance(log_backend, SqliteLogBackend):
+            indexed_turns, log_source = g_log_search_index.rebuild_from_sqlite(log_backend), log_backend.db_path
+        else:
+            indexed_turns, log_source = g_log_search_index.rebuild_from_jsonl_tree(INTERACTION_LOGS_DIR), INTERACTION_LOGS_DIR
+    finally:
+        g_log_search_index.close()
+        log_backend.close()
+    print(f"Indexed {indexed_turns} logged turn(s) from '{log_source}'.")
+    if g_log_search_index.unavailable_reason:
+        print(f"Search index unavailable: {g_log_search_index.unavailable_reason}")
+# --- END OF INTERACTION LOG SEARCH INDEX (PART 17 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 18: Interaction Log Analytics
+# - Streams logged turns into compact aggregates: per-day counters with an hour-of-day histogram, per-campaign
+#   sent/reply/error counts with a capped per-chat contacted/replied bitmap, and a bounded top-chats table.
+# - Incremental: a JSON checkpoint stores the aggregates plus the byte offset reached in every jsonl file
+#   (SQLite backend: the last row id), so each pass only reads bytes appended since. Offsets follow a file
+#   across rotation by inode and into its compressed segment by first-line fingerprint, so rotating and
+#   compressing in one maintenance pass never recounts a file.
+# - Memory is bounded by the number of days kept and the caps in analytics settings, not by log size.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part18_Integrate: Defining interaction log analytics.")
+
+ANALYTICS_DAY_COUNTERS: tuple = ("turns", "user_turns", "assistant_turns", "reactive_turns", "outreach_turns",
+                                 "errors", "cache_hits", "prompt_tokens", "eval_tokens")
+ANALYTICS_CAMPAIGN_SENT, ANALYTICS_CAMPAIGN_REPLIES, ANALYTICS_CAMPAIGN_ERRORS = 0, 1, 2 # Per-day campaign counter slots
+ANALYTICS_CHAT_CONTACTED, ANALYTICS_CHAT_REPLIED = 1, 2 # Per-campaign chat flags
+
+def read_first_line_fingerprint(log_path: pathlib.Path) -> int:
+    """
+    CRC32 of a log file's first line (at most 256 bytes, gzip segments are decompressed); tells a rotated file apart
+    from a new one reusing its inode, and recognizes a file again once it has been compressed.
+    """
+    with (gzip.open(log_path, 'rb') if log_path.suffix == ".gz" else open(log_path, 'rb')) as f:
+        return zlib.crc32(f.readline(256))
+
+class LogAnalytics:
+    """Incremental aggregator over the interaction logs. All methods are blocking; call them off the event loop."""
+    CHECKPOINT_VERSION: int = 1
+    SQLITE_READ_BATCH: int = 5000
+
+    def __init__(self):
+        self._state: dict | None = None
+        self._lock = threading.Lock()
+        self.stats = {"updates": 0, "turns_processed": 0, "bytes_processed": 0, "last_update": None, "last_update_seconds": 0.0}
+
+    def _empty_state(self) -> dict:
+        return {"version": self.CHECKPOINT_VERSION, "sources": {}, "sqlite_last_id": 0, "days": {}, "campaigns": {}, "top_chats": {}}
+
+    def _checkpoint_path(self) -> pathlib.Path:
+        return pathlib.Path(g_analytics_settings.get("checkpoint_path", DEFAULT_ANALYTICS_SETTINGS["checkpoint_path"]))
+
+    def _get_state(self) -> dict:
+        if self._state is None:
+            self._state = self._empty_state()
+            checkpoint_path = self._checkpoint_path()
+            if checkpoint_path.exists():
+                try:
+                    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                        loaded_state = json.load(f)
+                    if loaded_state.get("version") == self.CHECKPOINT_VERSION:
+                        self._state.update(loaded_state)
+                    else:
+                        logger.warning("Log analytics: Checkpoint '%s' has an old format. Recounting from the logs.", checkpoint_path)
+                except (OSError, json.JSONDecodeError, AttributeError) as e_load:
+                    logger.error("Log analytics: Could not read checkpoint '%s' (%s). Recounting from the logs.", checkpoint_path, e_load)
+        return self._state
+
+    def _save_state(self):
+        checkpoint_path = self._checkpoint_path()
+        checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, checkpoint_path) # Aggregates and offsets are replaced together
+
+    def _add_turn(self, chat_id: str, interaction_type: str, turn_data: dict):
+        if chat_id == ADMIN_CHAT_ID or turn_data.get("role") == "delivery_status":
+            return # Admin commands/replies are not customer traffic; delivery receipts are not turns
+        timestamp_iso = str(turn_data.get("timestamp_iso") or "")
+        try: hour_of_day = int(timestamp_iso[11:13])
+        except ValueError: return
+        day_key, role = timestamp_iso[:10], turn_data.get("role")
+        is_error = bool(turn_data.get("is_error"))
+        state = self._state
+        day_counters = state["days"].get(day_key)
+        if day_counters is None:
+            day_counters = state["days"][day_key] = {**{counter: 0 for counter in ANALYTICS_DAY_COUNTERS}, "hours": [0] * 24}
+        day_counters["turns"] += 1
+        day_counters["hours"][hour_of_day % 24] += 1
+        if role in ("user", "assistant"): day_counters[f"{role}_turns"] += 1
+        if interaction_type in ("reactive", "outreach"): day_counters[f"{interaction_type}_turns"] += 1
+        if is_error: day_counters["errors"] += 1
+        reply_cache = turn_data.get("reply_cache")
+        if isinstance(reply_cache, dict) and reply_cache.get("status") in ("hit", "semantic_hit"):
+            day_counters["cache_hits"] += 1
+        token_usage = turn_data.get("token_usage")
+        if isinstance(token_usage, dict):
+            day_counters["prompt_tokens"] += int(token_usage.get("prompt_eval_count") or 0)
+            day_counters["eval_tokens"] += int(token_usage.get("eval_count") or 0)
+
+        campaign_key = turn_data.get("outreach_campaign_key")
+        if interaction_type == "outreach" and campaign_key and role in ("user", "assistant"):
+            campaign = state["campaigns"].setdefault(str(campaign_key), {"days": {}, "chats": {}, "untracked_turns": 0})
+            campaign_day = campaign["days"].setdefault(day_key, [0, 0, 0])
+            campaign_day[ANALYTICS_CAMPAIGN_SENT if role == "assistant" else ANALYTICS_CAMPAIGN_REPLIES] += 1
+            if is_error: campaign_day[ANALYTICS_CAMPAIGN_ERRORS] += 1
+            chat_flag = ANALYTICS_CHAT_CONTACTED if role == "assistant" and not is_error else ANALYTICS_CHAT_REPLIED if role == "user" else 0
+            campaign_chats = campaign["chats"]
+            if chat_id in campaign_chats or len(campaign_chats) < int(g_analytics_settings.get("max_chats_per_campaign", 50000)):
+                campaign_chats[chat_id] = campaign_chats.get(chat_id, 0) | chat_flag
+            else:
+                campaign["untracked_turns"] += 1
+
+        if role == "user": # Space-Saving heavy hitters: approximate most active chats in a fixed number of counters
+            top_chats = state["top_chats"]
+            if chat_id in top_chats or len(top_chats) < int(g_analytics_settings.get("top_chats_capacity", 200)):
+                top_chats[chat_id] = top_chats.get(chat_id, 0) + 1
+            else:
+                evicted_chat = min(top_chats, key=top_chats.get)
+                top_chats[chat_id] = top_chats.pop(evicted_chat) + 1
+        self.stats["turns_processed"] += 1
+
+    def _read_jsonl_from(self, log_path: pathlib.Path, offset: int, chat_id: str, interaction_type: str) -> int:
+        """Aggregates complete lines after `offset`; returns the new offset (a partial last line is left for next time)."""
+        with (gzip.open(log_path, 'rb') if log_path.suffix == ".gz" else open(log_path, 'rb')) as f:
+            f.seek(offset)
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'): break
+                offset += len(raw_line)
+                self.stats["bytes_processed"] += len(raw_line)
+                try: turn_data = json.loads(raw_line)
+                except (json.JSONDecodeError, UnicodeDecodeError): continue
+                if isinstance(turn_data, dict): self._add_turn(chat_id, interaction_type, turn_data)
+        return offset
+
+    def _update_from_jsonl_tree(self, logs_dir: str):
+        """
+        Sources are keyed by path. An uncompressed file whose inode moved (rotated: active file -> segment) takes over
+        the offset recorded for its previous path. A compressed segment seen for the first time takes over the offset
+        of the vanished uncompressed file with the same first line in the same log (rotated and/or compressed since the
+        last pass); without one (logs that predate the checkpoint) it is read from the start.
+        """
+        sources = self._state["sources"]
+        previous_sources = dict(sources) # Entries are replaced, never mutated, during the pass
+        keys_by_inode = {source["inode"]: source_key for source_key, source in sources.items() if source.get("inode")}
+        keys_by_head = {(os.path.dirname(source_key), os.path.basename(source_key).split('.')[0], source["head"]): source_key
+                        for source_key, source in sources.items() if source.get("head")}
+        seen_keys = set()
+        for log_path in sorted(pathlib.Path(logs_dir).glob("*/*_history*.jsonl*")):
+            if log_path.name.endswith((LINE_OFFSET_INDEX_SUFFIX, ".tmp")): continue
+            chat_id = chat_id_from_log_dir_name(log_path.parent.name)
+            interaction_type = log_path.name.split('.')[0][:-len("_history")]
+            try:
+                if log_path.suffix == ".gz":
+                    source_key = str(log_path)[:-len(".gz")]
+                    seen_keys.add(source_key)
+                    if source_key not in sources:
+                        self._read_jsonl_from(log_path, self._compressed_segment_offset(log_path, previous_sources, keys_by_head),
+                                              chat_id, interaction_type)
+                        sources[source_key] = {"inode": 0, "offset": -1, "head": 0} # Fully read; compressed segments never change
+                    continue
+                source_key, file_stat = str(log_path), log_path.stat()
+                seen_keys.add(source_key)
+                source = sources.get(source_key)
+                if source is None or source.get("inode") != file_stat.st_ino:
+                    previous_key = keys_by_inode.get(file_stat.st_ino)
+                    source = sources.get(previous_key) if previous_key and previous_key != source_key else None
+                offset = source["offset"] if source else 0
+                head = read_first_line_fingerprint(log_path) if file_stat.st_size else 0
+                if source and (offset > file_stat.st_size or source.get("head") != head):
+                    offset = 0 # Truncated, or a new file that reused a deleted file's inode
+                if offset < file_stat.st_size:
+                    offset = self._read_jsonl_from(log_path, offset, chat_id, interaction_type)
+                sources[source_key] = {"inode": file_stat.st_ino, "offset": offset, "head": head}
+            except OSError as e_read: # Rotated or deleted mid-pass: picked up again on the next pass
+                logger.warning("Log analytics: Skipped '%s' this pass: %s", log_path, e_read)
+        for source_key in [source_key for source_key in sources if source_key not in seen_keys]:
+            del sources[source_key] # Deleted by retention
+
+    @staticmethod
+    def _compressed_segment_offset(gz_path: pathlib.Path, previous_sources: dict, keys_by_head: dict) -> int:
+        """Offset already aggregated from a new .gz segment: that of the uncompressed file it was made from, else 0."""
+        previous_key = keys_by_head.pop((str(gz_path.parent), gz_path.name.split('.')[0], read_first_line_fingerprint(gz_path)), None)
+        if previous_key is None:
+            return 0
+        previous_source = previous_sources[previous_key]
+        try:
+            if os.stat(previous_key).st_ino == previous_source["inode"]:
+                return 0 # That file is still there: only the first lines coincide
+        except OSError:
+            pass # Gone: it became this segment
+        return previous_source["offset"]
+
+    def _update_from_sqlite(self, sqlite_backend):
+        while True:
+            rows = sqlite_backend.read_rows_after(self._state["sqlite_last_id"], self.SQLITE_READ_BATCH)
+            for row_id, chat_id, interaction_type, payload in rows:
+                self.stats["bytes_processed"] += len(payload)
+                try: turn_data = json.loads(payload)
+                except json.JSONDecodeError: turn_data = None
+                if isinstance(turn_data, dict): self._add_turn(chat_id, interaction_type, turn_data)
+                self._state["sqlite_last_id"] = row_id
+            if len(rows) < self.SQLITE_READ_BATCH:
+                break
+
+    def _prune(self):
+        max_days = int(g_analytics_settings.get("max_days", DEFAULT_ANALYTICS_SETTINGS["max_days"]))
+        for days in [self._state["days"]] + [campaign["days"] for campaign in self._state["campaigns"].values()]:
+            for day_key in sorted(days)[:max(0, len(days) - max_days)]:
+                del days[day_key]
+
+    def update(self) -> int:
+        """Reads what was logged since the last pass and saves the checkpoint. Returns turns aggregated."""
+        if not g_analytics_settings.get("enabled", True):
+            return 0
+        with self._lock:
+            update_start, turns_before = time.monotonic(), self.stats["turns_processed"]
+            self._get_state()
+            log_backend = get_log_backend()
+            if isinstance(log_backend, SqliteLogBackend):
+                self._update_from_sqlite(log_backend)
+            else:
+                self._update_from_jsonl_tree(INTERACTION_LOGS_DIR)
+            self._prune()
+            self._save_state()
+            self.stats["updates"] += 1
+            self.stats["last_update"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.stats["last_update_seconds"] = time.monotonic() - update_start
+            return self.stats["turns_processed"] - turns_before
+
+    def report(self, period: str = "week", campaign_filter: str = None) -> dict:
+        """Totals for 'day' (today, UTC), 'week' (last 7 days) or 'all', optionally only for campaigns matching the filter."""
+        with self._lock:
+            state = self._get_state()
+            period_days = {"day": 1, "week": 7}.get(period)
+            first_day_key = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (period_days - 1) * 86400)) if period_days else ""
+            totals = {counter: 0 for counter in ANALYTICS_DAY_COUNTERS}
+            hours = [0] * 24
+            for day_key, day_counters in state["days"].items():
+                if day_key < first_day_key: continue
+                for counter in ANALYTICS_DAY_COUNTERS: totals[counter] += day_counters[counter]
+                hours = [hour_total + hour_count for hour_total, hour_count in zip(hours, day_counters["hours"])]
+            campaign_reports = []
+            for campaign_key, campaign in state["campaigns"].items():
+                if campaign_filter and campaign_filter.lower() not in campaign_key.lower(): continue
+                period_counts = [0, 0, 0]
+                for day_key, campaign_day in campaign["days"].items():
+                    if day_key >= first_day_key:
+                        period_counts = [count_total + count for count_total, count in zip(period_counts, campaign_day)]
+                contacted = sum(1 for chat_flags in campaign["chats"].values() if chat_flags & ANALYTICS_CHAT_CONTACTED)
+                replied = sum(1 for chat_flags in campaign["chats"].values()
+                              if chat_flags & ANALYTICS_CHAT_CONTACTED and chat_flags & ANALYTICS_CHAT_REPLIED)
+                if any(period_counts) or campaign_filter:
+                    campaign_reports.append({"campaign": campaign_key, "sent": period_counts[ANALYTICS_CAMPAIGN_SENT],
+                                             "replies": period_counts[ANALYTICS_CAMPAIGN_REPLIES], "errors": period_counts[ANALYTICS_CAMPAIGN_ERRORS],
+                                             "contacted_chats": contacted, "replied_chats": replied,
+                                             "reply_rate": replied / contacted if contacted else 0.0,
+                                             "untracked_turns": campaign["untracked_turns"]})
+            campaign_reports.sort(key=lambda campaign_report: campaign_report["sent"], reverse=True)
+            return {"period": period, "first_day": first_day_key or min(state["days"], default=""), "totals": totals, "hours": hours,
+                    "busiest_hours": heapq.nlargest(3, (hour for hour in range(24) if hours[hour]), key=lambda hour: hours[hour]),
+                    "campaigns": campaign_reports, "top_chats": heapq.nlargest(5, state["top_chats"].items(), key=lambda item: item[1])}
+
+    def write_csv(self, output_file):
+        """One row per day: overall counters ('campaign' empty), then per-campaign sent/replies/errors rows."""
+        with self._lock:
+            state = self._get_state()
+            csv_writer = csv.writer(output_file)
+            csv_writer.writerow(["date", "campaign", *ANALYTICS_DAY_COUNTERS, *(f"hour_{hour:02d}" for hour in range(24)),
+                                 "campaign_sent", "campaign_replies", "campaign_errors"])
+            for day_key in sorted(state["days"]):
+                day_counters = state["days"][day_key]
+                csv_writer.writerow([day_key, "", *(day_counters[counter] for counter in ANALYTICS_DAY_COUNTERS), *day_counters["hours"], "", "", ""])
+            for campaign_key in sorted(state["campaigns"]):
+                for day_key, campaign_day in sorted(state["campaigns"][campaign_key]["days"].items()):
+                    csv_writer.writerow([day_key, campaign_key, *([""] * (len(ANALYTICS_DAY_COUNTERS) + 24)), *campaign_day])
+
+g_log_analytics = LogAnalytics()
+
+def format_analytics_report(analytics_report: dict) -> str:
+    """$stats reply text."""
+    totals = analytics_report["totals"]
+    report_lines = [f"Stats ({analytics_report['period']}, since {analytics_report['first_day'] or 'n/a'} UTC):",
+                    f"Turns: {totals['turns']} ({totals['user_turns']} user / {totals['assistant_turns']} assistant; "
+                    f"{totals['reactive_turns']} reactive / {totals['outreach_turns']} outreach). Errors: {totals['errors']}.",
+                    f"Reply cache hits: {totals['cache_hits']}. Tokens: {totals['prompt_tokens']} prompt / {totals['eval_tokens']} generated."]
+    if analytics_report["busiest_hours"]:
+        report_lines.append("Busiest hours (UTC): " + ", ".join(f"{hour:02d}:00 ({analytics_report['hours'][hour]})" for hour in analytics_report["busiest_hours"]))
+    for campaign_report in analytics_report["campaigns"][:10]:
+        report_lines.append(f"Campaign '{campaign_report['campaign']}': {campaign_report['sent']} sent, {campaign_report['replies']} replies, "
+                            f"{campaign_report['errors']} errors. Reply rate (all time): {campaign_report['replied_chats']}/{campaign_report['contacted_chats']} "
+                            f"chats ({campaign_report['reply_rate'] * 100:.0f}%)" + (f", {campaign_report['untracked_turns']} turn(s) over the chat cap" if campaign_report["untracked_turns"] else "") + ".")
+    if analytics_report["top_chats"]:
+        report_lines.append("Most active chats (all time, approx.): " + ", ".join(f"{chat_id} ({count})" for chat_id, count in analytics_report["top_chats"]))
+    return "\n".join(report_lines)
+
+def dump_analytics_csv_cli():
+    """`python AIaspects.py --stats-csv [output.csv]`: catches the analytics up with the logs and writes the daily aggregates as CSV."""
+    load_admin_config()
+    turns_added = g_log_analytics.update()
+    output_arg_index = sys.argv.index("--stats-csv") + 1
+    output_path = sys.argv[output_arg_index] if output_arg_index < len(sys.argv) and not sys.argv[output_arg_index].startswith("--") else None
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            g_log_analytics.write_csv(f)
+        print(f"Aggregated {turns_added} new turn(s); wrote daily stats to '{output_path}'.")
+    else:
+        g_log_analytics.write_csv(sys.stdout)
+    if g_log_backend is not None:
+        g_log_backend.close()
+# --- END OF INTERACTION LOG ANALYTICS (PART 18 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 19: Contact Display-Name Cache
+# - LRU + TTL cache of WhatsApp display names, so a burst of fragments from one chat costs one getContact() call.
+# - Single-flight: concurrent lookups for the same chat share one in-flight browser round-trip.
+# - Lookups are started in the background when a fragment is buffered and awaited (bounded) only when the
+#   aggregation timer fires, so buffering and timer scheduling never wait on the browser.
+# - Persisted to a small JSON file (periodically when changed, and on shutdown) so names survive restarts.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part19_Integrate: Defining contact name cache.")
+
+def contact_display_name(contact_info) -> str:
+    """Best available display name from a getContact() result ("" if none)."""
+    if not contact_info or not isinstance(contact_info, dict):
+        return ""
+    return contact_info.get("name") or contact_info.get("formattedName") or contact_info.get("pushname") or contact_info.get("shortName") or ""
+
+class ContactNameCache:
+    """chat_id -> display name. Names that could not be resolved are cached as "" for negative_ttl_seconds."""
+    def __init__(self):
+        self._entries: OrderedDict = OrderedDict() # chat_id -> (display_name, expires_at epoch seconds)
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._dirty: bool = False
+        self._persist_task: asyncio.Task | None = None
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0, "expired": 0}
+
+    def get_cached(self, chat_id: str) -> str | None:
+        """The cached name ("" = known to have none), or None if not cached/expired."""
+        if not g_contact_cache_settings.get("enabled", True):
+            return None
+        cache_entry = self._entries.get(chat_id)
+        if cache_entry is None:
+            return None
+        if cache_entry[1] < time.time():
+            del self._entries[chat_id]; self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(chat_id)
+        return cache_entry[0]
+
+    def _put(self, chat_id: str, display_name: str):
+        if not g_contact_cache_settings.get("enabled", True):
+            return
+        ttl_seconds = float(g_contact_cache_settings["ttl_seconds"] if display_name else g_contact_cache_settings["negative_ttl_seconds"])
+        self._entries[chat_id] = (display_name, time.time() + ttl_seconds)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > max(1, int(g_contact_cache_settings.get("max_entries", DEFAULT_CONTACT_CACHE_SETTINGS["max_entries"]))):
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def prefetch(self, chat_id: str):
+        """Starts a background lookup unless the name is cached or already being looked up. Never blocks."""
+        if self.get_cached(chat_id) is not None:
+            self.stats["hits"] += 1
+            return
+        if chat_id in self._inflight:
+            self.stats["coalesced"] += 1
+            return
+        if not wpp_client:
+            return
+        self.stats["misses"] += 1
+        self._inflight[chat_id] = asyncio.get_running_loop().create_future()
+        asyncio.get_running_loop().create_task(self._fetch(chat_id))
+
+    async def _fetch(self, chat_id: str):
+        display_name = ""
+        try:
+            display_name = contact_display_name(await asyncio.to_thread(wpp_client.getContact, chat_id))
+            self._put(chat_id, display_name)
+        except Exception as e_get_contact:
+            self.stats["errors"] += 1
+            logger.warning("Contact cache: Could not get contact name for '%s': %s. Using chat_id.", chat_id, e_get_contact)
+            self._put(chat_id, display_name)
+        finally: # Also on cancellation (shutdown): waiters fall back to the chat_id and the next message looks it up again
+            lookup_future = self._inflight.pop(chat_id, None)
+            if lookup_future is not None and not lookup_future.done():
+                lookup_future.set_result(display_name)
+
+    async def get_display_name(self, chat_id: str, fallback: str = None) -> str:
+        """Cached name, else waits (at most lookup_wait_seconds) for an in-flight/new lookup; falls back to `fallback` or chat_id."""
+        fallback = fallback or chat_id
+        cached_name = self.get_cached(chat_id)
+        if cached_name is not None:
+            return cached_name or fallback
+        self.prefetch(chat_id)
+        lookup_future = self._inflight.get(chat_id)
+        if lookup_future is None:
+            return fallback
+        try:
+            return await asyncio.wait_for(asyncio.shield(lookup_future), float(g_contact_cache_settings.get("lookup_wait_seconds", 2.0))) or fallback
+        except asyncio.TimeoutError:
+            return fallback # The lookup keeps running and fills the cache for the next message
+
+    def clear(self):
+        self._entries.clear(); self._dirty = True
+
+    def load(self):
+        persist_path = g_contact_cache_settings.get("persist_path")
+        if not persist_path or not os.path.exists(persist_path):
+            return
+        try:
+            with open(persist_path, 'r', encoding='utf-8') as f:
+                persisted_entries = json.load(f)
+            now = time.time()
+            for chat_id, (display_name, expires_at) in sorted(persisted_entries.items(), key=lambda item: item[1][1]):
+                if expires_at > now: self._entries[chat_id] = (display_name, expires_at)
+            logger.info("Contact cache: Loaded %d name(s) from '%s'.", len(self._entries), persist_path)
+        except (OSError, json.JSONDecodeError, TypeError, ValueError) as e_load:
+            logger.error("Contact cache: Could not load '%s': %s", persist_path, e_load)
+
+    def save(self):
+        """Blocking: writes the positive, unexpired entries (atomic replace)."""
+        persist_path = g_contact_cache_settings.get("persist_path")
+        if not persist_path or not self._dirty:
+            return
+        now = time.time()
+        persisted_entries = {chat_id: cache_entry for chat_id, cache_entry in list(self._entries.items()) if cache_entry[0] and cache_entry[1] > now}
+        self._dirty = False
+        try:
+            temp_path = persist_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(persisted_entries, f, ensure_ascii=False)
+            os.replace(temp_path, persist_path)
+        except OSError as e_save:
+            self._dirty = True
+            logger.error("Contact cache: Could not save '%s': %s", persist_path, e_save)
+
+    async def _persist_loop(self):
+        while True:
+            await asyncio.sleep(max(10.0, float(g_contact_cache_settings.get("persist_interval_seconds", 300))))
+            await asyncio.to_thread(self.save)
+
+    def start(self):
+        self.load()
+        if self._persist_task is None and g_contact_cache_settings.get("persist_path"):
+            self._persist_task = asyncio.get_running_loop().create_task(self._persist_loop())
+
+    async def stop(self):
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            await asyncio.gather(self._persist_task, return_exceptions=True)
+            self._persist_task = None
+        await asyncio.to_thread(self.save)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return (self.stats["hits"] + self.stats["coalesced"]) / lookups if lookups else 0.0
+
+g_contact_name_cache = ContactNameCache()
+# --- END OF CONTACT NAME CACHE (PART 19 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 20: Message Ingress Queue (WPP callback bridge)
+# - The WPP library calls onMessage handlers on its own thread. The handler now only appends the raw message dict
+#   to a bounded, lock-protected queue and wakes the event loop; it never waits for message processing.
+# - One asyncio consumer drains the queue in arrival order through on_new_message_received (filtering, buffering).
+# - When full, the overflow policy applies: "spill" appends to a jsonl file replayed in order once the in-memory
+#   queue drains (also at startup, after a crash), "drop_oldest" / "drop_newest" discard.
+# - A replay first moves the spill file aside to <spill>.replay, which is deleted only once every message in it was
+#   processed; stop() writes back what is left, and start() resumes a replay file left by a crash.
+# - Ingress lag (callback -> consumer) and queue depth are tracked for $ingressstats.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part20_Integrate: Defining message ingress queue.")
+
+INGRESS_OVERFLOW_POLICIES: tuple = ("spill", "drop_oldest", "drop_newest")
+
+class MessageIngressQueue:
+    """Thread-safe submit() for the WPP callback thread; consumed on the main event loop."""
+    def __init__(self):
+        self._pending: deque = deque() # (message, submitted_at monotonic)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup_event: asyncio.Event | None = None
+        self._wakeup_scheduled: bool = False
+        self._spilled_count: int = 0 # Messages in the spill file; while > 0 new overflow keeps going there (order)
+        self._replay_remaining: deque = deque() # Spill entries taken for replay and not processed yet (oldest first)
+        self._consumer_task: asyncio.Task | None = None
+        self._lag_samples: deque = deque(maxlen=500)
+        self.stats = {"submitted": 0, "processed": 0, "errors": 0, "dropped": 0, "spilled": 0, "replayed": 0, "max_depth": 0}
+
+    @property
+    def is_running(self) -> bool:
+        return self._consumer_task is not None and not self._consumer_task.done()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending) + self._spilled_count
+
+    def _spill_path(self) -> str:
+        return g_message_ingress_settings.get("spill_path") or DEFAULT_MESSAGE_INGRESS_SETTINGS["spill_path"]
+
+    def _replay_path(self) -> str:
+        return self._spill_path() + ".replay"
+
+    def _has_spilled_files(self) -> bool:
+        return os.path.exists(self._replay_path()) or os.path.exists(self._spill_path())
+
+    def submit(self, message: dict):
+        """Called on the WPP callback thread. Never blocks on processing (only on a short lock, or a spill append)."""
+        overflow_policy = g_message_ingress_settings.get("overflow_policy", "spill")
+        max_queue_size = max(1, int(g_message_ingress_settings.get("max_queue_size", DEFAULT_MESSAGE_INGRESS_SETTINGS["max_queue_size"])))
+        with self._lock:
+            self.stats["submitted"] += 1
+            if len(self._pending) >= max_queue_size or (self._spilled_count and overflow_policy == "spill"):
+                if overflow_policy == "spill":
+                    try:
+                        with open(self._spill_path(), 'a', encoding='utf-8') as spill_file:
+                            spill_file.write(json.dumps({"submitted_at": time.time(), "message": message}, ensure_ascii=False, default=str) + "\n")
+                        self._spilled_count += 1; self.stats["spilled"] += 1
+                        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._pending) + self._spilled_count)
+                    except (OSError, TypeError) as e_spill:
+                        self.stats["dropped"] += 1
+                        logger.error("Ingress: Queue full and spill failed (%s). Message from '%s' dropped.", e_spill, message.get("from") if isinstance(message, dict) else "?")
+                    self._schedule_wakeup()
+                    return
+                self.stats["dropped"] += 1
+                if overflow_policy == "drop_newest":
+                    logger.warning("Ingress: Queue full (%d). Dropped newest message from '%s'.", max_queue_size, message.get("from") if isinstance(message, dict) else "?")
+                    return
+                self._pending.popleft() # drop_oldest
+            self._pending.append((message, time.monotonic()))
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self._pending) + self._spilled_count)
+            self._schedule_wakeup()
+
+    def _schedule_wakeup(self):
+        # Called with self._lock held. One call_soon_threadsafe per wakeup, not per message, to keep bursts cheap.
+        if self._loop is not None and not self._wakeup_scheduled:
+            self._wakeup_scheduled = True
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup_event.set)
+            except RuntimeError: # Loop closed during shutdown
+                self._wakeup_scheduled = False
+
+    def _take_spilled(self) -> list[dict]:
+        """
+        Blocking: returns the spill entries to replay next (oldest first). A replay file left by an interrupted replay
+        comes first; otherwise the spill file is moved aside as the replay file. The replay file stays on disk until
+        _finish_replay(), so a crash mid-replay loses nothing.
+        """
+        spill_path, replay_path = self._spill_path(), self._replay_path()
+        with self._lock:
+            if not os.path.exists(replay_path):
+                if not os.path.exists(spill_path):
+                    self._spilled_count = 0
+                    return []
+                os.replace(spill_path, replay_path)
+                self._spilled_count = 0
+        spilled_entries = []
+        with open(replay_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try: spilled_entry = json.loads(line)
+                except json.JSONDecodeError: continue
+                if isinstance(spilled_entry, dict): spilled_entries.append(spilled_entry)
+        return spilled_entries
+
+    def _finish_replay(self):
+        """Blocking: every taken entry was processed; removes the replay file, or rewrites it with the entries left."""
+        replay_path = self._replay_path()
+        if not self._replay_remaining:
+            if os.path.exists(replay_path): os.remove(replay_path)
+            return
+        temp_path = replay_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as replay_file:
+            replay_file.writelines(json.dumps(spilled_entry, ensure_ascii=False, default=str) + "\n" for spilled_entry in self._replay_remaining)
+        os.replace(temp_path, replay_path)
+
+    async def _process(self, message: dict, lag_seconds: float):
+        self._lag_samples.append(lag_seconds)
+        try:
+            await on_new_message_received(message)
+            self.stats["processed"] += 1
+        except Exception as e_process:
+            self.stats["errors"] += 1
+            logger.error("Ingress: EXCEPTION in on_new_message_received: %s", e_process, exc_info=True)
+
+    async def _consumer_loop(self):
+        while True:
+            await self._wakeup_event.wait()
+            with self._lock:
+                self._wakeup_event.clear()
+                self._wakeup_scheduled = False
+            while True:
+                with self._lock:
+                    next_item = self._pending.popleft() if self._pending else None
+                    spilled_waiting = self._spilled_count > 0 or (next_item is None and self._has_spilled_files())
+                if next_item is not None:
+                    await self._process(next_item[0], time.monotonic() - next_item[1])
+                elif spilled_waiting: # In-memory queue drained: replay the (older) spilled messages before new ones
+                    self._replay_remaining = deque(await asyncio.to_thread(self._take_spilled))
+                    while self._replay_remaining:
+                        spilled_entry = self._replay_remaining[0]
+                        self.stats["replayed"] += 1
+                        await self._process(spilled_entry.get("message"), max(0.0, time.time() - spilled_entry.get("submitted_at", time.time())))
+                        self._replay_remaining.popleft() # Only now: a replay cancelled mid-message keeps that message
+                    await asyncio.to_thread(self._finish_replay)
+                else:
+                    break
+
+    def start(self, event_loop: asyncio.AbstractEventLoop):
+        if self.is_running:
+            return
+        self._loop = event_loop
+        self._wakeup_event = asyncio.Event()
+        self._wakeup_scheduled = False
+        self._consumer_task = event_loop.create_task(self._consumer_loop())
+        if self._has_spilled_files(): # Left over from the previous run
+            logger.warning("Ingress: Replaying messages spilled to '%s' before the last shutdown.", self._spill_path())
+        if self._pending or self._has_spilled_files():
+            self._wakeup_event.set()
+        logger.info("Ingress: Started (max queue %s, overflow '%s').", g_message_ingress_settings.get("max_queue_size"), g_message_ingress_settings.get("overflow_policy"))
+
+    async def stop(self, drain_timeout_seconds: float = 5.0):
+        """Gives the consumer a moment to drain, then cancels it. Undrained in-memory messages are spilled (policy 'spill')."""
+        if not self.is_running:
+            return
+        drain_deadline = time.monotonic() + drain_timeout_seconds
+        while self._pending and time.monotonic() < drain_deadline:
+            await asyncio.sleep(0.05)
+        self._consumer_task.cancel()
+        await asyncio.gather(self._consumer_task, return_exceptions=True)
+        self._consumer_task, self._loop = None, None
+        if self._replay_remaining: # Interrupted replay: keep the unprocessed entries for the next start()
+            try:
+                await asyncio.to_thread(self._finish_replay)
+                logger.info("Ingress: %d spilled message(s) left to replay on the next start.", len(self._replay_remaining))
+                self._replay_remaining.clear()
+            except OSError as e_replay:
+                logger.error("Ingress: Could not save %d unreplayed message(s): %s", len(self._replay_remaining), e_replay)
+        with self._lock:
+            if self._pending and g_message_ingress_settings.get("overflow_policy", "spill") == "spill":
+                leftover_lines = [json.dumps({"submitted_at": time.time(), "message": message}, ensure_ascii=False, default=str) + "\n"
+                                  for message, _ in self._pending]
+                try:
+                    # Leftovers are older than anything already spilled, but replay order is by file line; prepend them.
+                    spill_path = self._spill_path()
+                    previous_spill = ""
+                    if os.path.exists(spill_path):
+                        with open(spill_path, 'r', encoding='utf-8') as spill_file: previous_spill = spill_file.read()
+                    with open(spill_path, 'w', encoding='utf-8') as spill_file:
+                        spill_file.write("".join(leftover_lines) + previous_spill)
+                    self.stats["spilled"] += len(leftover_lines)
+                    self._pending.clear()
+                except (OSError, TypeError) as e_spill:
+                    logger.error("Ingress: Could not spill %d undrained message(s) on shutdown: %s", len(self._pending), e_spill)
+        logger.info("Ingress: Stopped. %d message(s) processed, %d dropped, %d spilled.", self.stats["processed"], self.stats["dropped"], self.stats["spilled"])
+
+    def get_stats(self) -> dict:
+        ordered_lags = sorted(self._lag_samples)
+        lag_summary = {"avg": sum(ordered_lags) / len(ordered_lags), "p95": ordered_lags[min(len(ordered_lags) - 1, int(len(ordered_lags) * 0.95))],
+                       "max": ordered_lags[-1]} if ordered_lags else {"avg": 0.0, "p95": 0.0, "max": 0.0}
+        return {**self.stats, "running": self.is_running, "queued": len(self._pending), "spill_backlog": self._spilled_count, "lag": lag_summary}
+
+g_message_ingress = MessageIngressQueue()
+# --- END OF MESSAGE INGRESS QUEUE (PART 20 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 21: Outbound Send Dispatcher
+# - Every wpp_client.sendText goes through send_text(), which queues the message and returns an asyncio.Future
+#   (True = delivered, False = gave up) instead of calling the browser on the event loop.
+# - Messages to one chat keep their order (a per-chat FIFO whose head must succeed before the next is sent);
+#   chats are served round-robin, so a chat in retry backoff does not hold up the others.
+# - A global token bucket paces sends to avoid WhatsApp throttling during outreach bursts. The admin chat has its own
+#   queue, served before any other chat and never paced; a pacing wait is cut short when new messages arrive.
+# - sendText runs on one dedicated worker thread. Sends that fail before reaching the client (not connected) are
+#   retried with exponential backoff; a failure inside sendText (e.g. a timeout) may still have delivered the
+#   message, so it is reported as "unknown" and never retried.
+# - Delivery status is logged as a "delivery_status" turn via log_interaction_turn for customer messages.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part21_Integrate: Defining outbound send dispatcher.")
+
+class OutboundSendDispatcher:
+    """Paced, retrying, per-chat ordered delivery of outgoing WhatsApp messages."""
+    def __init__(self):
+        self._chat_queues: dict[str, deque] = {} # chat_id -> deque of send jobs (dicts), head = next to send
+        self._ready_chats: deque = deque()       # Round-robin order of chats with queued jobs
+        self._retry_not_before: dict[str, float] = {}
+        self._sending_job: dict | None = None    # The job inside sendText right now (cannot be withdrawn)
+        self._wakeup_event: asyncio.Event | None = None
+        self._dispatch_task: asyncio.Task | None = None
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self._tokens: float = 0.0
+        self._tokens_updated_at: float = 0.0
+        self._queue_latencies: deque = deque(maxlen=500)
+        self._send_latencies: deque = deque(maxlen=500)
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "unknown": 0, "retries": 0, "max_backlog": 0, "paced_waits": 0}
+
+    @property
+    def is_running(self) -> bool:
+        return self._dispatch_task is not None and not self._dispatch_task.done()
+
+    @property
+    def backlog(self) -> int:
+        return sum(len(chat_queue) for chat_queue in self._chat_queues.values())
+
+    def send_text(self, chat_id: str, text: str, interaction_type: str = None, log_fields: dict = None) -> asyncio.Future:
+        """
+        Queues `text` for `chat_id`. The returned future resolves to True once sent, False if every attempt failed
+        before reaching WhatsApp, or None if sendText itself failed (the message may or may not have been delivered).
+        interaction_type ("reactive"/"outreach") enables delivery status logging for that chat's log.
+        Without a running dispatcher (startup/shutdown), sends inline as before.
+        """
+        send_future = asyncio.get_running_loop().create_future()
+        send_job = {"chat_id": chat_id, "text": text, "future": send_future, "enqueued_at": time.monotonic(), "attempts": 0,
+                    "interaction_type": interaction_type, "log_fields": log_fields or {}, "last_error": None}
+        if not self.is_running:
+            if not wpp_client:
+                logger.error("Send dispatcher: Inline send to '%s' failed: wpp_client not connected", chat_id)
+                send_future.set_result(False)
+                return send_future
+            try:
+                wpp_client.sendText(chat_id, text)
+                send_future.set_result(True)
+            except Exception as e_send:
+                logger.error("Send dispatcher: Inline send to '%s' failed, delivery unknown: %s", chat_id, e_send)
+                send_future.set_result(None)
+            return send_future
+        chat_queue = self._chat_queues.get(chat_id)
+        if chat_queue is None:
+            chat_queue = self._chat_queues[chat_id] = deque()
+            if chat_id != ADMIN_CHAT_ID: self._ready_chats.append(chat_id) # The admin queue is served outside the round-robin
+        chat_queue.append(send_job)
+        self.stats["queued"] += 1
+        self.stats["max_backlog"] = max(self.stats["max_backlog"], self.backlog)
+        self._wakeup_event.set()
+        return send_future
+
+    def _pacing_delay(self, chat_id: str) -> float:
+        """Takes a token (returns 0.0) or returns the seconds until one is available."""
+        if chat_id == ADMIN_CHAT_ID:
+            return 0.0
+        rate_per_second = float(g_outbound_send_settings.get("rate_per_second") or 0)
+        if rate_per_second <= 0:
+            return 0.0
+        now = time.monotonic()
+        burst = max(1.0, float(g_outbound_send_settings.get("burst", DEFAULT_OUTBOUND_SEND_SETTINGS["burst"])))
+        self._tokens = min(burst, self._tokens + (now - self._tokens_updated_at) * rate_per_second)
+        self._tokens_updated_at = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / rate_per_second
+
+    def _next_ready_chat(self) -> tuple[str | None, float]:
+        """(chat to serve next, admin chat first; or None and the seconds until a chat in backoff becomes ready)."""
+        now, soonest_wait = time.monotonic(), None
+        if self._chat_queues.get(ADMIN_CHAT_ID):
+            not_before = self._retry_not_before.get(ADMIN_CHAT_ID, 0.0)
+            if not_before <= now:
+                return ADMIN_CHAT_ID, 0.0
+            soonest_wait = not_before - now
+        for _ in range(len(self._ready_chats)):
+            chat_id = self._ready_chats[0]
+            not_before = self._retry_not_before.get(chat_id, 0.0)
+            if not_before <= now:
+                return chat_id, 0.0
+            soonest_wait = not_before - now if soonest_wait is None else min(soonest_wait, not_before - now)
+            self._ready_chats.rotate(-1)
+        return None, soonest_wait
+
+    async def _wait_for_work(self, timeout_seconds: float | None):
+        try:
+            await asyncio.wait_for(self._wakeup_event.wait(), timeout_seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup_event.clear()
+
+    async def _dispatch_loop(self):
+        while True:
+            chat_id, ready_in_seconds = self._next_ready_chat()
+            if chat_id is None:
+                await self._wait_for_work(ready_in_seconds) # None: idle until send_text()
+                continue
+            pacing_delay = self._pacing_delay(chat_id)
+            if pacing_delay > 0:
+                self.stats["paced_waits"] += 1
+                await self._wait_for_work(pacing_delay) # Cut short by send_text(), then re-pick: an admin message goes first
+                continue
+            if chat_id != ADMIN_CHAT_ID: self._ready_chats.popleft()
+            await self._send_head(chat_id)
+            if self._chat_queues.get(chat_id):
+                if chat_id != ADMIN_CHAT_ID: self._ready_chats.append(chat_id) # Round-robin: next chat first
+            else:
+                self._chat_queues.pop(chat_id, None); self._retry_not_before.pop(chat_id, None)
+
+    async def _send_head(self, chat_id: str):
+        send_job = self._chat_queues[chat_id][0]
+        send_job["attempts"] += 1
+        send_start = time.monotonic()
+        if not wpp_client: # e.g. reconnecting: nothing was sent, so it is safe to retry
+            send_job["last_error"] = "wpp_client not connected"
+            max_attempts = max(1, int(g_outbound_send_settings.get("max_attempts", DEFAULT_OUTBOUND_SEND_SETTINGS["max_attempts"])))
+            if send_job["attempts"] < max_attempts:
+                retry_delay = min(float(g_outbound_send_settings.get("retry_max_delay_seconds", 60.0)),
+                                  float(g_outbound_send_settings.get("retry_base_delay_seconds", 2.0)) * 2 ** (send_job["attempts"] - 1))
+                self._retry_not_before[chat_id] = time.monotonic() + retry_delay
+                self.stats["retries"] += 1
+                logger.warning("Send dispatcher: Send to '%s' failed (attempt %d/%d): %s. Retrying in %.1fs.",
+                               chat_id, send_job["attempts"], max_attempts, send_job["last_error"], retry_delay)
+                return
+            self._chat_queues[chat_id].popleft()
+            self.stats["failed"] += 1
+            logger.error("Send dispatcher: Giving up on message to '%s' after %d attempt(s): %s", chat_id, send_job["attempts"], send_job["last_error"])
+            await self._complete(send_job, delivered=False)
+            return
+        self._sending_job = send_job
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, wpp_client.sendText, chat_id, send_job["text"])
+        except Exception as e_send: # Timeout or browser error mid-send: it may have gone out, so never resend it
+            send_job["last_error"] = str(e_send) or type(e_send).__name__
+            self._chat_queues[chat_id].popleft()
+            self.stats["unknown"] += 1
+            logger.error("Send dispatcher: sendText to '%s' failed, delivery unknown (not retried): %s", chat_id, send_job["last_error"])
+            await self._complete(send_job, delivered=None)
+            return
+        finally:
+            self._sending_job = None
+        self._send_latencies.append(time.monotonic() - send_start)
+        self._chat_queues[chat_id].popleft()
+        self._retry_not_before.pop(chat_id, None)
+        self.stats["sent"] += 1
+        await self._complete(send_job, delivered=True)
+
+    def withdraw(self, predicate) -> int:
+        """Removes queued jobs matching predicate(send_job) (not one already inside sendText); their futures resolve False."""
+        withdrawn_jobs = []
+        for chat_id, chat_queue in list(self._chat_queues.items()):
+            chat_withdrawn = [send_job for send_job in chat_queue if send_job is not self._sending_job and predicate(send_job)]
+            if not chat_withdrawn:
+                continue
+            withdrawn_jobs.extend(chat_withdrawn)
+            withdrawn_ids = {id(send_job) for send_job in chat_withdrawn}
+            kept_jobs = deque(send_job for send_job in chat_queue if id(send_job) not in withdrawn_ids)
+            if kept_jobs:
+                self._chat_queues[chat_id] = kept_jobs
+            else:
+                del self._chat_queues[chat_id]
+                self._retry_not_before.pop(chat_id, None)
+                if chat_id in self._ready_chats: self._ready_chats.remove(chat_id)
+        for send_job in withdrawn_jobs:
+            if not send_job["future"].done(): send_job["future"].set_result(False)
+        return len(withdrawn_jobs)
+
+    async def _complete(self, send_job: dict, delivered: bool | None):
+        queue_seconds = time.monotonic() - send_job["enqueued_at"]
+        self._queue_latencies.append(queue_seconds)
+        if not send_job["future"].done():
+            send_job["future"].set_result(delivered)
+        if send_job["interaction_type"] and g_outbound_send_settings.get("log_delivery_status", True):
+            await log_interaction_turn(send_job["chat_id"], send_job["interaction_type"], {
+                "role": "delivery_status", "content": "", "delivery_status": {True: "sent", False: "failed", None: "unknown"}[delivered],
+                "attempts": send_job["attempts"], "queue_seconds": round(queue_seconds, 3), "chars": len(send_job["text"]),
+                **({"error": send_job["last_error"]} if send_job["last_error"] else {}), **send_job["log_fields"]})
+
+    def start(self):
+        if self.is_running or not g_outbound_send_settings.get("enabled", True):
+            return
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="wpp-send")
+        self._wakeup_event = asyncio.Event()
+        self._tokens, self._tokens_updated_at = float(g_outbound_send_settings.get("burst", 1)), time.monotonic()
+        self._dispatch_task = asyncio.get_running_loop().create_task(self._dispatch_loop())
+        logger.info("Send dispatcher: Started (%.2f msg/s, burst %s, %s attempt(s)).", float(g_outbound_send_settings.get("rate_per_second") or 0),
+                    g_outbound_send_settings.get("burst"), g_outbound_send_settings.get("max_attempts"))
+
+    async def stop(self, drain_timeout_seconds: float = 10.0):
+        """Keeps dispatching for up to drain_timeout_seconds, then fails whatever is still queued."""
+        if not self.is_running:
+            return
+        drain_deadline = time.monotonic() + drain_timeout_seconds
+        while self._chat_queues and wpp_client and time.monotonic() < drain_deadline:
+            await asyncio.sleep(0.1)
+        self._dispatch_task.cancel()
+        await asyncio.gather(self._dispatch_task, return_exceptions=True)
+        self._dispatch_task = None
+        undelivered_count = self.backlog
+        for chat_queue in self._chat_queues.values():
+            for send_job in chat_queue:
+                if not send_job["future"].done(): send_job["future"].set_result(False)
+        self._chat_queues.clear(); self._ready_chats.clear(); self._retry_not_before.clear()
+        self._executor.shutdown(wait=True)
+        logger.info("Send dispatcher: Stopped. %d sent, %d failed, %d unknown, %d undelivered at shutdown.",
+                    self.stats["sent"], self.stats["failed"], self.stats["unknown"], undelivered_count)
+
+    def get_stats(self) -> dict:
+        def summarize(samples: deque) -> dict:
+            ordered = sorted(samples)
+            if not ordered: return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+            return {"avg": sum(ordered) / len(ordered), "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], "max": ordered[-1]}
+        return {**self.stats, "running": self.is_running, "backlog": self.backlog, "chats_queued": len(self._chat_queues),
+                "chats_in_backoff": sum(1 for not_before in self._retry_not_before.values() if not_before > time.monotonic()),
+                "queue_latency": summarize(self._queue_latencies), "send_latency": summarize(self._send_latencies)}
+
+g_outbound_dispatcher = OutboundSendDispatcher()
+# --- END OF OUTBOUND SEND DISPATCHER (PART 21 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 22: Bulk Outreach Campaigns
+# - A campaign is a target list (CSV/JSON of chat IDs or phone numbers plus per-target variables) and one
+#   outreach prompt; {variable} placeholders in the prompt/message are filled per target.
+# - Proposals are generated concurrently (generation_concurrency cap) on the scheduler's "campaign" lane, which
+#   competes fairly with live chats instead of inheriting the outreach lane's weight.
+# - The admin approves all proposals, or a random sample first (pilot), then approved targets are sent through
+#   the outbound send dispatcher (paced, retried) with a bounded in-flight window; pause (while generating/sending), resume, cancel (withdraws queued sends).
+# - Every target's state lives in a SQLite (WAL) database and is updated as it changes, so after a crash the
+#   campaign resumes where it stopped. Targets caught mid-send are marked send_unknown instead of re-sent.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part22_Integrate: Defining bulk outreach campaigns.")
+
+CAMPAIGN_NAME_RE = re.compile(r'^[A-Za-z0-9_\-]{1,40}$')
+CAMPAIGN_TARGET_STATES: tuple = ("pending", "generated", "generation_failed", "approved", "sending", "sent",
+                                 "send_failed", "send_unknown", "skipped")
+CAMPAIGN_RUNNING_STATES: tuple = ("generating", "sending") # Statuses with a runner; the only ones that can be paused
+CAMPAIGN_INITIATOR_PROMPT: str = "ابدأ المحادثة الآن بناءً على تعليماتك." # Same opener as $prepareoutreach
+
+def split_quoted_args(args_str: str) -> list[str]:
+    """Splits admin command arguments on spaces, keeping "double quoted" parts together (quotes removed)."""
+    split_args, current_arg, in_quote = [], "", False
+    for char_ in args_str:
+        if char_ == '"': in_quote = not in_quote
+        elif char_ == ' ' and not in_quote:
+            if current_arg: split_args.append(current_arg); current_arg = ""
+        else: current_arg += char_
+    if current_arg: split_args.append(current_arg)
+    return split_args
+
+def normalize_target_chat_id(raw_target: str) -> str | None:
+    """'967 774-361-616' / '+967774361616' / '967774361616@c.us' -> '967774361616@c.us'; None if not a chat ID."""
+    raw_target = str(raw_target or "").strip()
+    if raw_target.endswith(("@c.us", "@g.us")):
+        return raw_target if raw_target.split('@')[0].isdigit() else None
+    phone_digits = re.sub(r'[\s\-()+]', '', raw_target)
+    return f"{phone_digits}@c.us" if phone_digits.isdigit() and len(phone_digits) >= 6 else None
+
+def load_campaign_targets(targets_path: str, max_targets: int) -> tuple[list, int]:
+    """
+    Blocking: reads a CSV (header row; chat_id/phone/number column, other columns become variables) or JSON
+    (list of IDs, or of objects with chat_id/phone plus variables) target list.
+    Returns ([(chat_id, variables), ...] deduplicated in file order, rejected row count).
+    """
+    if targets_path.lower().endswith(".json"):
+        with open(targets_path, 'r', encoding='utf-8') as f:
+            raw_targets = json.load(f)
+        if isinstance(raw_targets, dict): raw_targets = raw_targets.get("targets", [])
+        raw_rows = [raw_target if isinstance(raw_target, dict) else {"chat_id": raw_target} for raw_target in raw_targets]
+    else:
+        with open(targets_path, 'r', encoding='utf-8-sig', newline='') as f:
+            raw_rows = list(csv.DictReader(f))
+    targets, seen_chat_ids, rejected_count = [], set(), 0
+    for raw_row in raw_rows:
+        id_column = next((column for column in ("chat_id", "phone", "number") if raw_row.get(column)), next(iter(raw_row), None))
+        chat_id = normalize_target_chat_id(raw_row.get(id_column)) if id_column else None
+        if not chat_id or chat_id in seen_chat_ids or len(targets) >= max_targets:
+            rejected_count += 1
+            continue
+        seen_chat_ids.add(chat_id)
+        targets.append((chat_id, {str(column): str(value) for column, value in raw_row.items()
+                                  if column != id_column and column is not None and value not in (None, "")}))
+    return targets, rejected_count
+
+class _CampaignTemplateVariables(dict):
+    def __missing__(self, key): # Unknown placeholders stay as written
+        return "{" + key + "}"
+
+def fill_campaign_template(template: str, variables: dict) -> str:
+    try:
+        return template.format_map(_CampaignTemplateVariables(variables))
+    except (ValueError, IndexError, AttributeError): # Literal braces in the prompt: use it as-is
+        return template
+
+async def start_outreach_conversation(target_chat_id: str, sent_message: str, system_prompt: str, task_description: str, source_id: str):
+    """Logs a delivered first outreach message and makes the chat an active outreach (its replies use the outreach prompt)."""
+    await log_interaction_turn(target_chat_id, "outreach", {
+        "role": "assistant", "content": sent_message,
+        "outreach_campaign_key": task_description,
+        "system_prompt_used": system_prompt + "..."
+    })
+    ACTIVE_OUTREACH_CONVERSATIONS[target_chat_id] = {
+        "system_prompt": system_prompt,
+        "task_description": task_description,
+        "history": deque([ChatTurn("assistant", sent_message)], maxlen=get_history_maxlen()),
+        "is_active": True,
+        "start_time": time.time(),
+        "prepared_id_source": source_id
+    }
+    g_history_manager.touch(target_chat_id)
+    g_conversation_state_store.mark_dirty("outreach", target_chat_id)
+
+class OutreachCampaignStore:
+    """Campaign and per-target state in SQLite (WAL). Blocking; call off the event loop."""
+    SCHEMA_SQL: str = """
+        CREATE TABLE IF NOT EXISTS campaigns (
+            name TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            resume_status TEXT,
+            system_prompt TEXT NOT NULL,
+            initiator_template TEXT NOT NULL,
+            task_description TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS campaign_targets (
+            campaign TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            chat_id TEXT NOT NULL,
+            variables TEXT NOT NULL,
+            state TEXT NOT NULL,
+            message TEXT,
+            error TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (campaign, idx)
+        );
+        CREATE INDEX IF NOT EXISTS idx_campaign_targets_state ON campaign_targets (campaign, state, idx);
+    """
+
+    def __init__(self, db_path: str):
+        pathlib.Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA_SQL)
+        self._connection.row_factory = sqlite3.Row
+
+    def create_campaign(self, name: str, system_prompt: str, initiator_template: str, task_description: str, targets: list):
+        now = time.time()
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN")
+                self._connection.execute(
+                    "INSERT INTO campaigns (name, status, system_prompt, initiator_template, task_description, created_at, updated_at) "
+                    "VALUES (?, 'generating', ?, ?, ?, ?, ?)", (name, system_prompt, initiator_template, task_description, now, now))
+                self._connection.executemany(
+                    "INSERT INTO campaign_targets (campaign, idx, chat_id, variables, state, updated_at) VALUES (?, ?, ?, ?, 'pending', ?)",
+                    [(name, idx, chat_id, json.dumps(variables, ensure_ascii=False), now) for idx, (chat_id, variables) in enumerate(targets)])
+
+    def get_campaign(self, name: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM campaigns WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def list_campaigns(self) -> list[dict]:
+        with self._lock:
+            return [dict(row) for row in self._connection.execute("SELECT * FROM campaigns ORDER BY created_at")]
+
+    def set_campaign_status(self, name: str, status: str, resume_status: str = None, expected_status: str = None) -> bool:
+        """Sets the status; with expected_status only if the campaign is still in that status (compare-and-set). Returns True if set."""
+        expected_sql, expected_parameters = (" AND status = ?", (expected_status,)) if expected_status else ("", ())
+        with self._lock:
+            return self._connection.execute(f"UPDATE campaigns SET status = ?, resume_status = ?, updated_at = ? WHERE name = ?{expected_sql}",
+                                            (status, resume_status, time.time(), name, *expected_parameters)).rowcount == 1
+
+    def state_counts(self, name: str) -> dict:
+        with self._lock:
+            return {state: count for state, count in self._connection.execute(
+                "SELECT state, COUNT(*) FROM campaign_targets WHERE campaign = ? GROUP BY state", (name,))}
+
+    def fetch_targets(self, name: str, state: str, limit: int, after_idx: int = -1, random_order: bool = False) -> list[dict]:
+        order_sql = "random()" if random_order else "idx"
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT idx, chat_id, variables, message, error FROM campaign_targets WHERE campaign = ? AND state = ? AND idx > ? "
+                f"ORDER BY {order_sql} LIMIT ?", (name, state, after_idx, int(limit))).fetchall()
+        return [{**dict(row), "variables": json.loads(row["variables"])} for row in rows]
+
+    def update_target(self, name: str, idx: int, state: str, message: str = None, error: str = None):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE campaign_targets SET state = ?, message = COALESCE(?, message), error = ?, updated_at = ? WHERE campaign = ? AND idx = ?",
+                (state, message, error, time.time(), name, idx))
+
+    def move_targets(self, name: str, from_state: str, to_state: str, random_limit: int = None) -> int:
+        """Moves every (or a random sample of `random_limit`) target in from_state to to_state. Returns targets moved."""
+        sample_sql = " AND idx IN (SELECT idx FROM campaign_targets WHERE campaign = ? AND state = ? ORDER BY random() LIMIT ?)" if random_limit else ""
+        sample_parameters = (name, from_state, int(random_limit)) if random_limit else ()
+        with self._lock:
+            return self._connection.execute(
+                f"UPDATE campaign_targets SET state = ?, updated_at = ? WHERE campaign = ? AND state = ?{sample_sql}",
+                (to_state, time.time(), name, from_state, *sample_parameters)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class OutreachCampaignEngine:
+    """Runs campaigns: one runner task per active campaign, driven by the campaign's status in the store."""
+    THROUGHPUT_WINDOW_SECONDS: float = 300.0
+
+    def __init__(self):
+        self._store: OutreachCampaignStore | None = None
+        self._runners: dict[str, asyncio.Task] = {}
+        self._stop_requested: set = set() # Campaign names whose runner should finish in-flight work and exit
+        self._completion_times: dict[str, dict] = {} # name -> {"generated": deque, "sent": deque} of monotonic times
+        self._rerun_requested: set = set() # Campaign names to re-run once their current runner exits
+        self._cancelling: set = set() # Campaign names being cancelled: sends withdrawn from the dispatcher count as skipped
+        self._status_lock = asyncio.Lock() # Serializes approvals with a runner's end-of-round status decision
+
+    def get_store(self) -> OutreachCampaignStore:
+        if self._store is None:
+            self._store = OutreachCampaignStore(g_outreach_campaign_settings.get("db_path", DEFAULT_OUTREACH_CAMPAIGN_SETTINGS["db_path"]))
+        return self._store
+
+    def _record_completion(self, name: str, kind: str):
+        self._completion_times.setdefault(name, {"generated": deque(maxlen=5000), "sent": deque(maxlen=5000)})[kind].append(time.monotonic())
+
+    def throughput_per_minute(self, name: str, kind: str) -> float:
+        completion_times = self._completion_times.get(name, {}).get(kind) or ()
+        window_start = time.monotonic() - self.THROUGHPUT_WINDOW_SECONDS
+        recent = [completed_at for completed_at in completion_times if completed_at >= window_start]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / max(1.0, recent[-1] - recent[0]) * 60.0
+
+    def is_running(self, name: str) -> bool:
+        runner = self._runners.get(name)
+        return runner is not None and not runner.done()
+
+    async def create(self, name: str, targets_path: str, prompt_key_or_message: str, custom_system_prompt: str = None) -> str:
+        if not CAMPAIGN_NAME_RE.match(name):
+            return "Error: Campaign name must be 1-40 letters, digits, '_' or '-'."
+        store = self.get_store()
+        if await asyncio.to_thread(store.get_campaign, name):
+            return f"Error: Campaign '{name}' already exists."
+        try:
+            targets, rejected_count = await asyncio.to_thread(
+                load_campaign_targets, targets_path, int(g_outreach_campaign_settings.get("max_targets", DEFAULT_OUTREACH_CAMPAIGN_SETTINGS["max_targets"])))
+        except (OSError, ValueError, csv.Error) as e_load:
+            return f"Error: Could not read targets from '{targets_path}': {e_load}"
+        if not targets:
+            return f"Error: No valid targets in '{targets_path}' ({rejected_count} row(s) rejected)."
+        if prompt_key_or_message in g_outreach_prompts: # Same conventions as $prepareoutreach
+            system_prompt, initiator_template = custom_system_prompt or g_outreach_prompts[prompt_key_or_message], CAMPAIGN_INITIATOR_PROMPT
+        else:
+            system_prompt, initiator_template = custom_system_prompt or g_system_prompt, prompt_key_or_message
+        await asyncio.to_thread(store.create_campaign, name, system_prompt, initiator_template, f"campaign:{name}", targets)
+        self.start_runner(name)
+        logger.info("Campaigns: Created '%s' with %d target(s) (%d rejected).", name, len(targets), rejected_count)
+        return (f"Campaign '{name}' created: {len(targets)} target(s)" + (f", {rejected_count} row(s) rejected (invalid/duplicate/over limit)" if rejected_count else "") +
+                f". Generating proposals ({g_outreach_campaign_settings.get('generation_concurrency')} at a time); "
+                f"you will be notified when they are ready. Progress: {g_command_prefix}campaign status {name}")
+
+    def start_runner(self, name: str):
+        if self.is_running(name):
+            self._rerun_requested.add(name) # It may already be past its last status check
+            return
+        self._stop_requested.discard(name)
+        self._runners[name] = asyncio.get_running_loop().create_task(self._run(name))
+
+    async def _run(self, name: str):
+        store, campaign = self.get_store(), None
+        try:
+            campaign = await asyncio.to_thread(store.get_campaign, name)
+            if campaign and campaign["status"] == "generating":
+                await self._generate_pending(campaign)
+                if name in self._stop_requested: return
+                async with self._status_lock:
+                    if name in self._stop_requested: return # Paused/cancelled while the last generations finished
+                    state_counts = await asyncio.to_thread(store.state_counts, name)
+                    next_status = "sending" if state_counts.get("approved") else "awaiting_approval" # Approved while generating: send them
+                    if not await asyncio.to_thread(store.set_campaign_status, name, next_status, None, "generating"): return
+                    campaign = {**campaign, "status": next_status}
+                if campaign["status"] != "sending":
+                    g_outbound_dispatcher.send_text(ADMIN_CHAT_ID, (
+                        f"Campaign '{name}': {state_counts.get('generated', 0)} proposal(s) ready, {state_counts.get('generation_failed', 0)} failed.\n"
+                        f"Review: {g_command_prefix}campaign sample {name} [n]\n"
+                        f"Approve: {g_command_prefix}campaign approve {name} all | {g_command_prefix}campaign approve {name} sample <n>"))
+                    return
+            if campaign and campaign["status"] == "sending":
+                final_status = None
+                while final_status is None: # Targets approved while a round was finishing are sent by another round
+                    await self._send_approved(campaign)
+                    if name in self._stop_requested: return
+                    async with self._status_lock:
+                        if name in self._stop_requested: return
+                        state_counts = await asyncio.to_thread(store.state_counts, name)
+                        if not state_counts.get("approved"):
+                            final_status = "awaiting_approval" if state_counts.get("generated") else "completed"
+                            if not await asyncio.to_thread(store.set_campaign_status, name, final_status, None, "sending"): return
+                g_outbound_dispatcher.send_text(ADMIN_CHAT_ID, (
+                    f"Campaign '{name}': sending round finished. Sent {state_counts.get('sent', 0)}, failed {state_counts.get('send_failed', 0)}"
+                    + (f", {state_counts.get('generated')} proposal(s) still awaiting approval." if final_status == "awaiting_approval" else ". Campaign completed.")))
+        except Exception as e_run:
+            logger.error("Campaigns: Runner for '%s' failed: %s", name, e_run, exc_info=True)
+            g_outbound_dispatcher.send_text(ADMIN_CHAT_ID, f"Campaign '{name}' stopped on an error: {e_run}. Use {g_command_prefix}campaign resume {name}.")
+            if campaign and campaign["status"] in CAMPAIGN_RUNNING_STATES:
+                await asyncio.to_thread(store.set_campaign_status, name, "paused", campaign["status"], campaign["status"])
+        finally:
+            if name in self._rerun_requested and name not in self._stop_requested:
+                self._rerun_requested.discard(name)
+                asyncio.get_running_loop().call_soon(self.start_runner, name) # Runs after this task is done
+
+    async def _generate_one(self, campaign: dict, target: dict):
+        store = self.get_store()
+        system_prompt = fill_campaign_template(campaign["system_prompt"], target["variables"])
+        initiator_prompt = fill_campaign_template(campaign["initiator_template"], target["variables"])
+        try:
+            proposed_message = await g_llm_scheduler.submit(LLM_LANE_CAMPAIGN, target["chat_id"], lambda: query_ollama_chat(
+                target["chat_id"], initiator_prompt, "", custom_system_prompt=system_prompt,
+                specific_chat_history_deque=deque(maxlen=get_history_maxlen())))
+        except Exception as e_generate:
+            proposed_message = f"Error: {e_generate}"
+        if proposed_message and not proposed_message.startswith("خطأ:") and not proposed_message.startswith("Error:"):
+            await asyncio.to_thread(store.update_target, campaign["name"], target["idx"], "generated", proposed_message)
+            self._record_completion(campaign["name"], "generated")
+        else:
+            await asyncio.to_thread(store.update_target, campaign["name"], target["idx"], "generation_failed", None, str(proposed_message)[:300])
+
+    async def _generate_pending(self, campaign: dict):
+        """Generates every pending target, at most generation_concurrency at a time, reading targets in chunks."""
+        store, name = self.get_store(), campaign["name"]
+        concurrency = max(1, int(g_outreach_campaign_settings.get("generation_concurrency", DEFAULT_OUTREACH_CAMPAIGN_SETTINGS["generation_concurrency"])))
+        in_flight: set = set()
+        after_idx = -1
+        while name not in self._stop_requested:
+            targets = await asyncio.to_thread(store.fetch_targets, name, "pending", 200, after_idx)
+            if not targets:
+                break
+            for target in targets:
+                if name in self._stop_requested: break
+                if len(in_flight) >= concurrency:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight.add(asyncio.get_running_loop().create_task(self._generate_one(campaign, target)))
+                after_idx = target["idx"]
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True) # Pause/stop: let in-flight generations finish
+
+    async def _send_one(self, campaign: dict, target: dict):
+        store, name = self.get_store(), campaign["name"]
+        await asyncio.to_thread(store.update_target, name, target["idx"], "sending")
+        try:
+            delivered = await g_outbound_dispatcher.send_text(target["chat_id"], target["message"], "outreach", # False: gave up, None: unknown
+                                                              {"outreach_campaign_key": campaign["task_description"], "campaign_target": target["idx"]})
+        except asyncio.CancelledError: # Runner torn down: the dispatcher may still be sending it (or have sent it)
+            await asyncio.to_thread(store.update_target, name, target["idx"], "send_unknown", None, "campaign runner stopped mid-send")
+            raise
+        if delivered is False and name in self._cancelling: # Withdrawn from the send queue by cancel()
+            await asyncio.to_thread(store.update_target, name, target["idx"], "skipped", None, "campaign cancelled before sending")
+        elif delivered:
+            await asyncio.to_thread(store.update_target, name, target["idx"], "sent")
+            await start_outreach_conversation(target["chat_id"], target["message"], fill_campaign_template(campaign["system_prompt"], target["variables"]),
+                                              campaign["task_description"], f"{name}#{target['idx']}")
+            self._record_completion(name, "sent")
+        elif delivered is None:
+            await asyncio.to_thread(store.update_target, name, target["idx"], "send_unknown", None, "sendText failed mid-send; may have been delivered")
+        else:
+            await asyncio.to_thread(store.update_target, name, target["idx"], "send_failed", None, "not delivered by the send dispatcher")
+
+    async def _send_approved(self, campaign: dict):
+        """Sends approved targets in list order with at most send_window messages handed to the dispatcher at once."""
+        store, name = self.get_store(), campaign["name"]
+        send_window = max(1, int(g_outreach_campaign_settings.get("send_window", DEFAULT_OUTREACH_CAMPAIGN_SETTINGS["send_window"])))
+        in_flight: set = set()
+        try:
+            while name not in self._stop_requested:
+                targets = await asyncio.to_thread(store.fetch_targets, name, "approved", 100)
+                targets = [target for target in targets if target["idx"] not in {task.campaign_idx for task in in_flight}]
+                if not targets:
+                    if not in_flight: break
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                for target in targets:
+                    if name in self._stop_requested: break
+                    while not wpp_client and name not in self._stop_requested: # Disconnected: hold sends until the session is back
+                        await asyncio.sleep(2.0)
+                    if name in self._stop_requested: break
+                    if g_history_manager.has_active_outreach(target["chat_id"]):
+                        await asyncio.to_thread(store.update_target, name, target["idx"], "skipped", None, "already in an active outreach")
+                        continue
+                    if len(in_flight) >= send_window:
+                        _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    send_task = asyncio.get_running_loop().create_task(self._send_one(campaign, target))
+                    send_task.campaign_idx = target["idx"]
+                    in_flight.add(send_task)
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+        except asyncio.CancelledError: # Runner torn down: in-flight sends record themselves as send_unknown
+            for send_task in in_flight: send_task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            raise
+
+    async def _stop_runner(self, name: str, timeout_seconds: float = 30.0):
+        runner = self._runners.get(name)
+        if runner is None or runner.done():
+            return
+        self._stop_requested.add(name)
+        self._rerun_requested.discard(name)
+        try:
+            await asyncio.wait_for(asyncio.shield(runner), timeout_seconds)
+        except asyncio.TimeoutError:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    async def approve(self, name: str, sample_size: int = None) -> int:
+        """Approves generated proposals. While generation is still running they are sent once it finishes."""
+        store = self.get_store()
+        async with self._status_lock:
+            approved_count = await asyncio.to_thread(store.move_targets, name, "generated", "approved", sample_size)
+            if approved_count:
+                campaign = await asyncio.to_thread(store.get_campaign, name)
+                if campaign["status"] != "generating": # The generation runner switches to sending by itself
+                    await asyncio.to_thread(store.set_campaign_status, name, "sending")
+        if approved_count:
+            self.start_runner(name)
+        return approved_count
+
+    async def pause(self, name: str) -> bool:
+        """Pauses a generating/sending campaign, then lets its runner finish in-flight work. False if it was not running."""
+        store = self.get_store()
+        async with self._status_lock: # The runner's status transitions take the same lock and re-check _stop_requested
+            campaign = await asyncio.to_thread(store.get_campaign, name)
+            if not campaign or campaign["status"] not in CAMPAIGN_RUNNING_STATES:
+                return False
+            if not await asyncio.to_thread(store.set_campaign_status, name, "paused", campaign["status"], campaign["status"]):
+                return False
+            self._stop_requested.add(name)
+        await self._stop_runner(name)
+        return True
+
+    async def resume(self, name: str) -> str | None:
+        """Restores the status a campaign was paused in (restarting its runner). None if it was not paused."""
+        store = self.get_store()
+        campaign = await asyncio.to_thread(store.get_campaign, name)
+        resume_status = campaign.get("resume_status") or "generating"
+        if not await asyncio.to_thread(store.set_campaign_status, name, resume_status, None, "paused"):
+            return None
+        if resume_status in CAMPAIGN_RUNNING_STATES:
+            self.start_runner(name)
+        return resume_status
+
+    async def cancel(self, name: str):
+        """Cancels a campaign: its queued sends are withdrawn from the dispatcher (targets marked skipped)."""
+        store = self.get_store()
+        self._cancelling.add(name)
+        try:
+            await asyncio.to_thread(store.set_campaign_status, name, "cancelled")
+            self._stop_requested.add(name)
+            withdrawn_count = g_outbound_dispatcher.withdraw(lambda send_job: send_job["log_fields"].get("outreach_campaign_key") == f"campaign:{name}")
+            await self._stop_runner(name)
+            if withdrawn_count:
+                logger.info("Campaigns: Cancelled '%s'; %d queued send(s) withdrawn.", name, withdrawn_count)
+        finally:
+            self._cancelling.discard(name)
+
+    async def resume_all(self):
+        """At startup: restarts campaigns that were generating or sending when the process stopped."""
+        store = self.get_store()
+        for campaign in await asyncio.to_thread(store.list_campaigns):
+            if campaign["status"] not in ("generating", "sending"):
+                continue
+            unknown_count = await asyncio.to_thread(store.move_targets, campaign["name"], "sending", "send_unknown")
+            logger.info("Campaigns: Resuming '%s' (%s)%s.", campaign["name"], campaign["status"],
+                        f"; {unknown_count} target(s) were mid-send and are marked send_unknown" if unknown_count else "")
+            self.start_runner(campaign["name"])
+
+    async def stop(self):
+        """Shutdown: runners finish their in-flight work (bounded), statuses stay as-is so resume_all() continues."""
+        await asyncio.gather(*(self._stop_runner(name, 15.0) for name in list(self._runners)), return_exceptions=True)
+        if self._store is not None:
+            await asyncio.to_thread(self._store.close)
+            self._store = None
+
+    async def status_report(self, name: str) -> str:
+        campaign = await asyncio.to_thread(self.get_store().get_campaign, name)
+        if not campaign:
+            return f"Error: No campaign named '{name}'."
+        state_counts = await asyncio.to_thread(self.get_store().state_counts, name)
+        total_targets = sum(state_counts.values())
+        done_targets = sum(state_counts.get(state, 0) for state in ("sent", "send_failed", "send_unknown", "skipped", "generation_failed"))
+        report_lines = [f"Campaign '{name}': {campaign['status'].upper()}{' (runner active)' if self.is_running(name) else ''}. "
+                        f"{total_targets} target(s), {done_targets} done ({done_targets / total_targets * 100 if total_targets else 0:.0f}%).",
+                        ", ".join(f"{state} {state_counts[state]}" for state in CAMPAIGN_TARGET_STATES if state_counts.get(state))]
+        generation_rate, send_rate = self.throughput_per_minute(name, "generated"), self.throughput_per_minute(name, "sent")
+        if generation_rate or send_rate:
+            report_lines.append(f"Throughput (last {self.THROUGHPUT_WINDOW_SECONDS / 60:.0f} min): {generation_rate:.1f} generated/min, {send_rate:.1f} sent/min.")
+        if campaign["status"] == "sending" and send_rate and state_counts.get("approved"):
+            report_lines.append(f"ETA for {state_counts['approved']} approved: ~{state_counts['approved'] / send_rate:.0f} min.")
+        elif campaign["status"] == "generating" and generation_rate and state_counts.get("pending"):
+            report_lines.append(f"ETA for {state_counts['pending']} pending proposals: ~{state_counts['pending'] / generation_rate:.0f} min.")
+        return "\n".join(report_lines)
+
+g_campaign_engine = OutreachCampaignEngine()
+# --- END OF BULK OUTREACH CAMPAIGNS (PART 22 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 23: Conversation State Persistence (journal + snapshots)
+# - CHAT_HISTORIES, CHAT_SUMMARIES, ACTIVE_OUTREACH_CONVERSATIONS, PREPARED_OUTREACHES and
+#   g_next_prepared_id_counter survive restarts (including the exit after MAX_RECONNECTION_ATTEMPTS).
+# - Mutation sites only call mark_dirty(kind, key); a background task writes the current value of every dirty
+#   entry as one journal line per entry, once per commit window (group commit: one write + fsync per window).
+# - The journal is compacted into snapshot.json (temp file + fsync + atomic rename) when it grows past
+#   snapshot_journal_bytes, periodically, and on shutdown. The snapshot is written from an image of the journaled
+#   values that each commit updates for its dirty entries, so a snapshot copies nothing on the event loop. Journal lines carry a sequence number, so lines
+#   already covered by the snapshot are skipped if the process dies between the rename and the truncation.
+# - Recovery reads one snapshot plus a bounded journal; a torn last line (crash mid-write) is discarded.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part23_Integrate: Defining conversation state persistence.")
+
+STATE_ENTITY_KINDS: tuple = ("history", "summary", "outreach", "prepared")
+
+def capture_state_entity(kind: str, key: str):
+    """JSON-ready current value of one persisted entry (None = deleted). Called on the event loop."""
+    if kind == "history":
+        history_deque = CHAT_HISTORIES.get(key)
+        return list(history_deque) if history_deque is not None else None
+    if kind == "summary":
+        return CHAT_SUMMARIES.get(key)
+    if kind == "outreach":
+        outreach_data = ACTIVE_OUTREACH_CONVERSATIONS.get(key)
+        return {**outreach_data, "history": list(outreach_data.get("history") or ())} if outreach_data is not None else None
+    if kind == "prepared":
+        prepared_details = PREPARED_OUTREACHES.get(key)
+        return dict(prepared_details) if prepared_details is not None else None
+    raise ValueError(f"Unknown state entity kind '{kind}'")
+
+class ConversationStateStore:
+    """Append-only journal of entry updates plus periodic compact snapshots, with a single background writer."""
+    def __init__(self):
+        self._dirty: set = set() # (kind, key) changed since the last commit
+        self._journaled_state: dict = {kind: {} for kind in STATE_ENTITY_KINDS} # Latest journaled value per entry (what a snapshot holds)
+        self._wakeup_event: asyncio.Event | None = None
+        self._commit_task: asyncio.Task | None = None
+        self._stopping: bool = False
+        self._journal_file = None # Opened/used only inside asyncio.to_thread calls, one at a time
+        self._seq: int = 0
+        self._journaled_prepared_counter: int | None = None
+        self._journal_bytes: int = 0
+        self._last_snapshot_time: float = 0.0
+        self._commit_latencies: deque = deque(maxlen=500)
+        self.stats = {"commits": 0, "records": 0, "bytes": 0, "fsyncs": 0, "snapshots": 0, "errors": 0,
+                      "recovered_entries": 0, "recovered_journal_records": 0, "torn_records": 0, "recovery_seconds": 0.0}
+
+    @property
+    def is_running(self) -> bool:
+        return self._commit_task is not None and not self._commit_task.done()
+
+    def _paths(self) -> tuple[str, str]:
+        state_dir = g_state_persistence_settings.get("state_dir", DEFAULT_STATE_PERSISTENCE_SETTINGS["state_dir"])
+        return os.path.join(state_dir, "snapshot.json"), os.path.join(state_dir, "journal.jsonl")
+
+    def mark_dirty(self, kind: str, key: str):
+        """Records that an entry changed; it is journaled within commit_window_seconds. Never blocks."""
+        if not g_state_persistence_settings.get("enabled", True):
+            return
+        self._dirty.add((kind, key))
+        if self._wakeup_event is not None:
+            self._wakeup_event.set()
+
+    def is_pending(self, kind: str, key: str) -> bool:
+        """True while a change to the entry is not yet in the journal."""
+        return (kind, key) in self._dirty
+
+    def mark_history_dirty(self, chat_id: str, history_deque: deque):
+        """mark_dirty for whichever persisted history `history_deque` is (temporary deques are ignored)."""
+        if CHAT_HISTORIES.get(chat_id) is history_deque:
+            self.mark_dirty("history", chat_id)
+        elif ACTIVE_OUTREACH_CONVERSATIONS.get(chat_id, {}).get("history") is history_deque:
+            self.mark_dirty("outreach", chat_id)
+
+    def load_state(self) -> dict:
+        """Blocking: snapshot + journal replay -> {kind: {key: value}, "meta": {...}}. Truncates a torn journal tail."""
+        snapshot_path, journal_path = self._paths()
+        recovered_state = {kind: {} for kind in STATE_ENTITY_KINDS}
+        recovered_state["meta"] = {}
+        snapshot_seq = 0
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            snapshot_seq = int(snapshot.get("seq", 0))
+            for kind in STATE_ENTITY_KINDS:
+                recovered_state[kind].update(snapshot.get(kind) or {})
+            recovered_state["meta"].update(snapshot.get("meta") or {})
+        self._seq = snapshot_seq
+        if os.path.exists(journal_path):
+            valid_length = 0
+            with open(journal_path, 'rb') as f:
+                for raw_line in f:
+                    try:
+                        if not raw_line.endswith(b"\n"): raise ValueError("incomplete line")
+                        journal_record = json.loads(raw_line)
+                    except ValueError:
+                        self.stats["torn_records"] += 1
+                        logger.warning("State store: Discarding torn journal record at byte %d of '%s' (crash mid-write).", valid_length, journal_path)
+                        break
+                    valid_length += len(raw_line)
+                    record_seq = int(journal_record.get("seq", 0))
+                    self._seq = max(self._seq, record_seq)
+                    if record_seq <= snapshot_seq:
+                        continue # Already in the snapshot (crash between snapshot rename and journal truncation)
+                    self.stats["recovered_journal_records"] += 1
+                    target = recovered_state["meta"] if journal_record.get("kind") == "meta" else recovered_state.get(journal_record.get("kind"))
+                    if target is None:
+                        continue
+                    if journal_record.get("value") is None:
+                        target.pop(journal_record.get("key"), None)
+                    else:
+                        target[journal_record.get("key")] = journal_record["value"]
+            if valid_length < os.path.getsize(journal_path):
+                with open(journal_path, 'r+b') as f:
+                    f.truncate(valid_length)
+            self._journal_bytes = valid_length
+        return recovered_state
+
+    def restore(self) -> int:
+        """Loads persisted state into the in-memory globals (at startup, before messages are processed). Returns entries restored."""
+        global g_next_prepared_id_counter
+        if not g_state_persistence_settings.get("enabled", True):
+            return 0
+        recovery_start = time.monotonic()
+        try:
+            recovered_state = self.load_state()
+        except (OSError, ValueError, TypeError) as e_load:
+            self.stats["errors"] += 1
+            logger.error("State store: Could not load persisted conversation state: %s. Starting empty.", e_load, exc_info=True)
+            return 0
+        history_maxlen = get_history_maxlen()
+        for chat_id, turns in recovered_state["history"].items():
+            CHAT_HISTORIES[chat_id] = deque(turns_from_records(turns), maxlen=history_maxlen)
+        CHAT_SUMMARIES.update(recovered_state["summary"])
+        for chat_id, outreach_data in recovered_state["outreach"].items():
+            ACTIVE_OUTREACH_CONVERSATIONS[chat_id] = {**outreach_data, "history": deque(turns_from_records(outreach_data.get("history")), maxlen=history_maxlen)}
+        PREPARED_OUTREACHES.update(recovered_state["prepared"])
+        prepared_id_numbers = [int(prep_id[1:]) for prep_id in PREPARED_OUTREACHES if prep_id[1:].isdigit()]
+        g_next_prepared_id_counter = max([g_next_prepared_id_counter, int(recovered_state["meta"].get("next_prepared_id", 0))] + prepared_id_numbers)
+        self._journaled_prepared_counter = g_next_prepared_id_counter
+        self._journaled_state = {kind: {key: capture_state_entity(kind, key) for key in resident_entries}
+                                 for kind, resident_entries in (("history", CHAT_HISTORIES), ("summary", CHAT_SUMMARIES),
+                                                                ("outreach", ACTIVE_OUTREACH_CONVERSATIONS), ("prepared", PREPARED_OUTREACHES))}
+        restored_count = sum(len(recovered_state[kind]) for kind in STATE_ENTITY_KINDS)
+        self.stats["recovered_entries"] = restored_count
+        self.stats["recovery_seconds"] = time.monotonic() - recovery_start
+        logger.info("State store: Restored %d history(ies), %d summary(ies), %d outreach conversation(s), %d prepared outreach(es) "
+                    "(%d journal record(s) replayed) in %.3fs.", len(recovered_state["history"]), len(recovered_state["summary"]),
+                    len(recovered_state["outreach"]), len(recovered_state["prepared"]), self.stats["recovered_journal_records"], self.stats["recovery_seconds"])
+        return restored_count
+
+    def _append_journal(self, journal_records: list, do_fsync: bool) -> int:
+        """Blocking: appends records as JSON lines (one write); returns bytes written."""
+        if self._journal_file is None:
+            _, journal_path = self._paths()
+            os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+            self._journal_file = open(journal_path, 'ab')
+        journal_bytes = "".join(json.dumps(journal_record, ensure_ascii=False, default=state_json_default) + "\n" for journal_record in journal_records).encode('utf-8')
+        self._journal_file.write(journal_bytes)
+        self._journal_file.flush()
+        if do_fsync:
+            os.fsync(self._journal_file.fileno())
+        return len(journal_bytes)
+
+    def _store_snapshot(self, snapshot: dict):
+        """Blocking: temp file + fsync + atomic rename, then starts an empty journal."""
+        snapshot_path, journal_path = self._paths()
+        os.makedirs(os.path.dirname(snapshot_path) or ".", exist_ok=True)
+        temp_path = snapshot_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, default=state_json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, snapshot_path)
+        if os.name != "nt": # Make the rename itself durable (directories cannot be opened for fsync on Windows)
+            directory_fd = os.open(os.path.dirname(snapshot_path) or ".", os.O_RDONLY)
+            try: os.fsync(directory_fd)
+            finally: os.close(directory_fd)
+        if self._journal_file is not None:
+            self._journal_file.close()
+        self._journal_file = open(journal_path, 'wb') # Truncate: every record is now covered by the snapshot's seq
+
+    async def _commit(self):
+        dirty_entries, self._dirty = self._dirty, set()
+        journal_records = []
+        for kind, key in dirty_entries:
+            self._seq += 1
+            journal_records.append({"seq": self._seq, "kind": kind, "key": key, "value": capture_state_entity(kind, key)})
+        journaled_prepared_counter = None
+        if g_next_prepared_id_counter != self._journaled_prepared_counter:
+            self._seq += 1
+            journaled_prepared_counter = g_next_prepared_id_counter
+            journal_records.append({"seq": self._seq, "kind": "meta", "key": "next_prepared_id", "value": journaled_prepared_counter})
+        if not journal_records:
+            return
+        commit_start = time.monotonic()
+        do_fsync = bool(g_state_persistence_settings.get("fsync", True))
+        try:
+            written_bytes = await asyncio.to_thread(self._append_journal, journal_records, do_fsync)
+        except Exception as e_commit:
+            self._dirty |= dirty_entries # Retried with their then-current values next window
+            self.stats["errors"] += 1
+            logger.error("State store: Journal commit of %d record(s) failed: %s", len(journal_records), e_commit)
+            return
+        if journaled_prepared_counter is not None:
+            self._journaled_prepared_counter = journaled_prepared_counter
+        for journal_record in journal_records:
+            if journal_record["kind"] == "meta":
+                continue
+            if journal_record["value"] is None:
+                self._journaled_state[journal_record["kind"]].pop(journal_record["key"], None)
+            else:
+                self._journaled_state[journal_record["kind"]][journal_record["key"]] = journal_record["value"]
+        self._journal_bytes += written_bytes
+        self.stats["commits"] += 1; self.stats["records"] += len(journal_records); self.stats["bytes"] += written_bytes
+        if do_fsync: self.stats["fsyncs"] += 1
+        self._commit_latencies.append(time.monotonic() - commit_start)
+
+    async def snapshot(self):
+        """Writes the journaled state as a new snapshot and empties the journal. Only the commit loop calls this."""
+        await self._commit() # Brings the journaled image up to date (dirty entries only)
+        snapshot = {"format": 1, "seq": self._seq, "saved_at": time.time(),
+                    "meta": {"next_prepared_id": g_next_prepared_id_counter}, **self._journaled_state}
+        try:
+            await asyncio.to_thread(self._store_snapshot, snapshot)
+        except Exception as e_snapshot:
+            self.stats["errors"] += 1
+            logger.error("State store: Snapshot failed (journal kept): %s", e_snapshot)
+            return
+        self._journal_bytes = 0
+        self._last_snapshot_time = time.monotonic()
+        self.stats["snapshots"] += 1
+        logger.info("State store: Snapshot written (seq %d, %d history(ies), %d outreach, %d prepared).",
+                    self._seq, len(snapshot["history"]), len(snapshot["outreach"]), len(snapshot["prepared"]))
+
+    def _snapshot_due(self) -> bool:
+        if self._journal_bytes >= int(g_state_persistence_settings.get("snapshot_journal_bytes", DEFAULT_STATE_PERSISTENCE_SETTINGS["snapshot_journal_bytes"])):
+            return True
+        return self._journal_bytes > 0 and time.monotonic() - self._last_snapshot_time >= float(
+            g_state_persistence_settings.get("snapshot_interval_seconds", DEFAULT_STATE_PERSISTENCE_SETTINGS["snapshot_interval_seconds"]))
+
+    async def _commit_loop(self):
+        # Not cancelled on shutdown (a cancelled to_thread write would continue behind our back); stop() sets _stopping instead.
+        while not self._stopping:
+            await self._wakeup_event.wait()
+            if not self._stopping: # Group commit: collect everything that changes during the window
+                await asyncio.sleep(max(0.0, float(g_state_persistence_settings.get("commit_window_seconds", 0.5))))
+            self._wakeup_event.clear()
+            await self._commit()
+            if self._snapshot_due():
+                await self.snapshot()
+        await self.snapshot() # Shutdown: the next start reads one snapshot and an empty journal
+
+    def start(self):
+        if self.is_running or not g_state_persistence_settings.get("enabled", True):
+            return
+        self._wakeup_event = asyncio.Event()
+        self._stopping = False
+        self._last_snapshot_time = time.monotonic()
+        if self._dirty: self._wakeup_event.set()
+        self._commit_task = asyncio.get_running_loop().create_task(self._commit_loop())
+        logger.info("State store: Started (commit window %.2fs, fsync %s, state dir '%s').",
+                    float(g_state_persistence_settings.get("commit_window_seconds", 0.5)), bool(g_state_persistence_settings.get("fsync", True)),
+                    g_state_persistence_settings.get("state_dir"))
+
+    async def stop(self):
+        if not self.is_running:
+            return
+        self._stopping = True
+        self._wakeup_event.set()
+        await asyncio.gather(self._commit_task, return_exceptions=True)
+        self._commit_task = None
+        if self._journal_file is not None:
+            await asyncio.to_thread(self._journal_file.close)
+            self._journal_file = None
+        logger.info("State store: Stopped. %d record(s) journaled in %d commit(s), %d snapshot(s).",
+                    self.stats["records"], self.stats["commits"], self.stats["snapshots"])
+
+    def get_stats(self) -> dict:
+        ordered_latencies = sorted(self._commit_latencies)
+        return {**self.stats, "running": self.is_running, "pending_entries": len(self._dirty), "journal_bytes": self._journal_bytes, "seq": self._seq,
+                "commit_latency_avg": sum(ordered_latencies) / len(ordered_latencies) if ordered_latencies else 0.0,
+                "commit_latency_max": ordered_latencies[-1] if ordered_latencies else 0.0}
+
+g_conversation_state_store = ConversationStateStore()
+# --- END OF CONVERSATION STATE PERSISTENCE (PART 23 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 24: Idle Chat Eviction (cold storage for chat state)
+# - A periodic sweep moves idle chats out of RAM: reactive history + its summary, and outreach conversations
+#   (ended ones right away, active ones after the idle TTL) go to a compact SQLite cold store (zlib'd JSON rows).
+# - A global memory budget (estimated bytes) evicts least-recently-used chats beyond the TTL rule.
+# - Chats are rehydrated lazily (single-flight, off the event loop) when their next message is processed.
+# - Chats with buffered fragments, a pending/running reply, an in-flight summary fold, or uncommitted state
+#   are never evicted. Empty message buffers are dropped by the same sweep.
+# - Evicted entries are removed from the state store (Part 23); the cold store then holds their latest value.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part24_Integrate: Defining idle chat eviction.")
+
+HISTORY_TURN_OVERHEAD_BYTES: int = 160 # Rough per-turn cost of a ChatTurn, its ts float and the content string header
+
+def estimate_turns_bytes(turns) -> int:
+    """Approximate RAM held by a list/deque of turns (text counted at 2 bytes per char)."""
+    return sum(HISTORY_TURN_OVERHEAD_BYTES + 2 * len(turn.get("content") or "") for turn in turns)
+
+class ColdChatStore:
+    """(kind, chat_id) -> evicted chat state in SQLite (WAL). Blocking; call off the event loop."""
+    SCHEMA_SQL: str = """
+        CREATE TABLE IF NOT EXISTS cold_chats (
+            kind TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            is_active INTEGER NOT NULL,
+            evicted_at REAL NOT NULL,
+            state BLOB NOT NULL,
+            PRIMARY KEY (kind, chat_id)
+        );
+    """
+
+    def __init__(self, db_path: str):
+        pathlib.Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(self.SCHEMA_SQL)
+
+    def put_many(self, cold_rows: list):
+        """cold_rows: [(kind, chat_id, is_active, state_dict)]. Returns compressed bytes written."""
+        now = time.time()
+        encoded_rows = [(kind, chat_id, int(bool(is_active)), now, zlib.compress(json.dumps(state, ensure_ascii=False, default=state_json_default).encode('utf-8')))
+                        for kind, chat_id, is_active, state in cold_rows]
+        with self._lock:
+            with self._connection:
+                self._connection.execute("BEGIN")
+                self._connection.executemany("INSERT OR REPLACE INTO cold_chats (kind, chat_id, is_active, evicted_at, state) VALUES (?, ?, ?, ?, ?)", encoded_rows)
+        return sum(len(encoded_row[4]) for encoded_row in encoded_rows)
+
+    def get(self, kind: str, chat_id: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute("SELECT state FROM cold_chats WHERE kind = ? AND chat_id = ?", (kind, chat_id)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def list_index(self) -> list:
+        with self._lock:
+            return self._connection.execute("SELECT kind, chat_id, is_active FROM cold_chats").fetchall()
+
+    def stored_bytes(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(LENGTH(state)), 0) FROM cold_chats").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class ChatHistoryManager:
+    """Tracks chat recency, evicts idle chats to the cold store and rehydrates them on demand."""
+    def __init__(self):
+        self._cold_store: ColdChatStore | None = None
+        self._cold_index: dict[tuple, bool] = {} # (kind, chat_id) -> is_active; only entries NOT resident in memory
+        self._last_access: dict[str, float] = {} # chat_id -> monotonic time of its last processed message (or first sighting)
+        self._rehydrating: dict[tuple, asyncio.Future] = {}
+        self._sweep_task: asyncio.Task | None = None
+        self._rehydrate_latencies: deque = deque(maxlen=500)
+        self._resident_bytes: int = 0
+        self.stats = {"evicted_idle": 0, "evicted_budget": 0, "evicted_ended_outreach": 0, "rehydrated": 0, "rehydrate_errors": 0,
+                      "evict_errors": 0, "buffers_purged": 0, "sweeps": 0, "cold_bytes_written": 0, "last_sweep_seconds": 0.0}
+
+    def _get_cold_store(self) -> ColdChatStore:
+        if self._cold_store is None:
+            self._cold_store = ColdChatStore(g_history_eviction_settings.get("cold_store_path", DEFAULT_HISTORY_EVICTION_SETTINGS["cold_store_path"]))
+        return self._cold_store
+
+    def touch(self, chat_id: str):
+        if self._sweep_task is not None:
+            self._last_access[chat_id] = time.monotonic()
+
+    def has_active_outreach(self, chat_id: str) -> bool:
+        """Active outreach, whether resident or idle in the cold store."""
+        outreach_data = ACTIVE_OUTREACH_CONVERSATIONS.get(chat_id)
+        if outreach_data is not None:
+            return bool(outreach_data.get("is_active"))
+        return self._cold_index.get(("outreach", chat_id), False)
+
+    def cold_count(self, kind: str, active_only: bool = False) -> int:
+        return len(self.cold_chat_ids(kind, active_only))
+
+    def cold_chat_ids(self, kind: str, active_only: bool = False) -> list:
+        return [chat_id for (cold_kind, chat_id), is_active in self._cold_index.items() if cold_kind == kind and (is_active or not active_only)]
+
+    async def ensure_resident(self, chat_id: str, include_inactive_outreach: bool = False):
+        """Marks the chat as used and loads its evicted state back into memory (ended outreach only if asked)."""
+        self.touch(chat_id)
+        for kind in ("reactive", "outreach"):
+            cold_key = (kind, chat_id)
+            if cold_key not in self._cold_index:
+                continue
+            if kind == "outreach" and not self._cold_index[cold_key] and not include_inactive_outreach:
+                continue
+            await self._rehydrate(cold_key)
+
+    async def _rehydrate(self, cold_key: tuple):
+        inflight_future = self._rehydrating.get(cold_key)
+        if inflight_future is not None:
+            await asyncio.shield(inflight_future)
+            return
+        kind, chat_id = cold_key
+        self._rehydrating[cold_key] = asyncio.get_running_loop().create_future()
+        rehydrate_start = time.monotonic()
+        try:
+            cold_state = await asyncio.to_thread(self._get_cold_store().get, kind, chat_id)
+            summary_key = get_summary_key(kind, chat_id)
+            if cold_state is not None and kind == "reactive" and chat_id not in CHAT_HISTORIES:
+                CHAT_HISTORIES[chat_id] = resize_history_deque(deque(turns_from_records(cold_state.get("history"))), get_history_maxlen(), summary_key)
+                g_conversation_state_store.mark_dirty("history", chat_id)
+            elif cold_state is not None and kind == "outreach" and chat_id not in ACTIVE_OUTREACH_CONVERSATIONS:
+                outreach_data = cold_state.get("outreach") or {}
+                ACTIVE_OUTREACH_CONVERSATIONS[chat_id] = {**outreach_data, "history": resize_history_deque(
+                    deque(turns_from_records(outreach_data.get("history"))), get_history_maxlen(), summary_key)}
+                g_conversation_state_store.mark_dirty("outreach", chat_id)
+            if cold_state is not None and cold_state.get("summary") and summary_key not in CHAT_SUMMARIES:
+                CHAT_SUMMARIES[summary_key] = cold_state["summary"]
+                g_conversation_state_store.mark_dirty("summary", summary_key)
+            self._cold_index.pop(cold_key, None) # The cold row stays until the next eviction overwrites it; memory wins
+            self.stats["rehydrated"] += 1
+            self._rehydrate_latencies.append(time.monotonic() - rehydrate_start)
+            logger.debug("History manager: Rehydrated %s state for '%s' in %.1fms.", kind, chat_id, (time.monotonic() - rehydrate_start) * 1000)
+        except Exception as e_rehydrate:
+            self.stats["rehydrate_errors"] += 1
+            logger.error("History manager: Could not rehydrate %s state for '%s': %s. Continuing without it.", kind, chat_id, e_rehydrate)
+        finally:
+            self._rehydrating.pop(cold_key).set_result(None)
+
+    def _is_evictable(self, kind: str, chat_id: str) -> bool:
+        summary_key = get_summary_key(kind, chat_id)
+        return (chat_id not in USER_MESSAGE_TIMERS and not USER_MESSAGE_BUFFERS.get(chat_id)
+                and not g_adaptive_aggregation.is_awaiting_reply(chat_id) # A superseded timer may still be replying
+                and not g_conversation_summarizer.is_folding(summary_key)
+                and not g_conversation_state_store.is_pending("history" if kind == "reactive" else "outreach", chat_id)
+                and not g_conversation_state_store.is_pending("summary", summary_key))
+
+    def _capture_cold_state(self, kind: str, chat_id: str) -> dict:
+        if kind == "reactive":
+            return {"history": list(CHAT_HISTORIES[chat_id]), "summary": CHAT_SUMMARIES.get(get_summary_key(kind, chat_id))}
+        return {"outreach": capture_state_entity("outreach", chat_id), "summary": CHAT_SUMMARIES.get(get_summary_key(kind, chat_id))}
+
+    def _remove_resident(self, kind: str, chat_id: str):
+        summary_key = get_summary_key(kind, chat_id)
+        if kind == "reactive":
+            CHAT_HISTORIES.pop(chat_id, None)
+            g_conversation_state_store.mark_dirty("history", chat_id)
+        else:
+            ACTIVE_OUTREACH_CONVERSATIONS.pop(chat_id, None)
+            g_conversation_state_store.mark_dirty("outreach", chat_id)
+        if CHAT_SUMMARIES.pop(summary_key, None) is not None:
+            g_conversation_state_store.mark_dirty("summary", summary_key)
+
+    async def sweep(self):
+        """One eviction pass: ended outreach, chats idle past the TTL, then LRU chats while over the memory budget."""
+        sweep_start = now = time.monotonic()
+        for chat_id in [chat_id for chat_id, buffered in USER_MESSAGE_BUFFERS.items() if not buffered and chat_id not in USER_MESSAGE_TIMERS]:
+            del USER_MESSAGE_BUFFERS[chat_id]
+            self.stats["buffers_purged"] += 1
+        idle_ttl_seconds = float(g_history_eviction_settings.get("idle_ttl_seconds", DEFAULT_HISTORY_EVICTION_SETTINGS["idle_ttl_seconds"]))
+        min_idle_seconds = float(g_history_eviction_settings.get("min_idle_seconds", DEFAULT_HISTORY_EVICTION_SETTINGS["min_idle_seconds"]))
+        memory_budget_bytes = float(g_history_eviction_settings.get("memory_budget_mb", DEFAULT_HISTORY_EVICTION_SETTINGS["memory_budget_mb"])) * 1024 * 1024
+
+        resident_sizes = {} # (kind, chat_id) -> estimated bytes
+        for chat_id, history_deque in CHAT_HISTORIES.items():
+            resident_sizes[("reactive", chat_id)] = estimate_turns_bytes(history_deque) + 2 * len(CHAT_SUMMARIES.get(get_summary_key("reactive", chat_id)) or "")
+        for chat_id, outreach_data in ACTIVE_OUTREACH_CONVERSATIONS.items():
+            resident_sizes[("outreach", chat_id)] = (estimate_turns_bytes(outreach_data.get("history") or ()) + 2 * len(outreach_data.get("system_prompt") or "")
+                                                     + 2 * len(CHAT_SUMMARIES.get(get_summary_key("outreach", chat_id)) or ""))
+        self._resident_bytes = sum(resident_sizes.values())
+
+        for _, chat_id in resident_sizes:
+            self._last_access.setdefault(chat_id, now) # Untracked (restored or just created): idle from first sighting
+        idle_for = lambda resident_key: now - self._last_access[resident_key[1]]
+        to_evict = {} # (kind, chat_id) -> reason
+        for resident_key in resident_sizes:
+            if resident_key[1] == ADMIN_CHAT_ID or idle_for(resident_key) < min_idle_seconds or not self._is_evictable(*resident_key):
+                continue
+            if resident_key[0] == "outreach" and not ACTIVE_OUTREACH_CONVERSATIONS[resident_key[1]].get("is_active"):
+                to_evict[resident_key] = "evicted_ended_outreach"
+            elif idle_for(resident_key) >= idle_ttl_seconds:
+                to_evict[resident_key] = "evicted_idle"
+        remaining_bytes = self._resident_bytes - sum(resident_sizes[resident_key] for resident_key in to_evict)
+        if remaining_bytes > memory_budget_bytes:
+            for resident_key in sorted((resident_key for resident_key in resident_sizes if resident_key not in to_evict), key=idle_for, reverse=True):
+                if remaining_bytes <= memory_budget_bytes: break
+                if resident_key[1] == ADMIN_CHAT_ID or idle_for(resident_key) < min_idle_seconds or not self._is_evictable(*resident_key):
+                    continue
+                to_evict[resident_key] = "evicted_budget"
+                remaining_bytes -= resident_sizes[resident_key]
+
+        if to_evict:
+            access_at_capture = {chat_id: self._last_access.get(chat_id) for _, chat_id in to_evict}
+            cold_rows = [(kind, chat_id, kind == "reactive" or bool(ACTIVE_OUTREACH_CONVERSATIONS[chat_id].get("is_active")), self._capture_cold_state(kind, chat_id))
+                         for kind, chat_id in to_evict]
+            try:
+                self.stats["cold_bytes_written"] += await asyncio.to_thread(self._get_cold_store().put_many, cold_rows)
+            except Exception as e_evict:
+                self.stats["evict_errors"] += 1
+                logger.error("History manager: Writing %d chat(s) to the cold store failed: %s. Keeping them in memory.", len(cold_rows), e_evict)
+            else:
+                for kind, chat_id, is_active, _ in cold_rows:
+                    if self._last_access.get(chat_id) != access_at_capture[chat_id] or not self._is_evictable(kind, chat_id):
+                        continue # Used while the rows were written: stays resident (memory wins over the cold row)
+                    self._remove_resident(kind, chat_id)
+                    self._cold_index[(kind, chat_id)] = is_active
+                    self._resident_bytes -= resident_sizes[(kind, chat_id)]
+                    self.stats[to_evict[(kind, chat_id)]] += 1
+                resident_chat_ids = CHAT_HISTORIES.keys() | ACTIVE_OUTREACH_CONVERSATIONS.keys() | USER_MESSAGE_BUFFERS.keys()
+                for chat_id in [chat_id for chat_id in self._last_access if chat_id not in resident_chat_ids]:
+                    del self._last_access[chat_id]
+                logger.info("History manager: Evicted %d chat state(s) to the cold store; ~%.1f MB resident in %d chat(s).",
+                            len(cold_rows), self._resident_bytes / 1024 / 1024, len(CHAT_HISTORIES) + len(ACTIVE_OUTREACH_CONVERSATIONS))
+        self.stats["sweeps"] += 1
+        self.stats["last_sweep_seconds"] = time.monotonic() - sweep_start
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(max(5.0, float(g_history_eviction_settings.get("sweep_interval_seconds", 60))))
+            try:
+                await self.sweep()
+            except Exception as e_sweep:
+                logger.error("History manager: Sweep failed: %s", e_sweep, exc_info=True)
+
+    def start(self):
+        """Loads the cold index (blocking, at startup, after the state store restored resident state) and starts sweeping."""
+        if self._sweep_task is not None or not g_history_eviction_settings.get("enabled", True):
+            return
+        try:
+            for kind, chat_id, is_active in self._get_cold_store().list_index():
+                resident = chat_id in (CHAT_HISTORIES if kind == "reactive" else ACTIVE_OUTREACH_CONVERSATIONS)
+                if not resident: self._cold_index[(kind, chat_id)] = bool(is_active)
+        except sqlite3.Error as e_index:
+            logger.error("History manager: Could not read the cold store index: %s. Evicted chats start fresh.", e_index)
+        self._sweep_task = asyncio.get_running_loop().create_task(self._sweep_loop())
+        logger.info("History manager: Started (idle TTL %ss, budget %s MB). %d chat state(s) in the cold store.",
+                    g_history_eviction_settings.get("idle_ttl_seconds"), g_history_eviction_settings.get("memory_budget_mb"), len(self._cold_index))
+
+    async def stop(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            await asyncio.gather(self._sweep_task, return_exceptions=True)
+            self._sweep_task = None
+        if self._cold_store is not None:
+            await asyncio.to_thread(self._cold_store.close)
+            self._cold_store = None
+
+    async def get_stats(self) -> dict:
+        ordered_latencies = sorted(self._rehydrate_latencies)
+        cold_bytes = await asyncio.to_thread(self._get_cold_store().stored_bytes) if g_history_eviction_settings.get("enabled", True) else 0
+        return {**self.stats, "resident_reactive": len(CHAT_HISTORIES), "resident_outreach": len(ACTIVE_OUTREACH_CONVERSATIONS),
+                "resident_bytes": self._resident_bytes, "buffers": len(USER_MESSAGE_BUFFERS),
+                "cold_reactive": self.cold_count("reactive"), "cold_outreach": self.cold_count("outreach"), "cold_bytes": cold_bytes,
+                "rehydrate_latency_avg": sum(ordered_latencies) / len(ordered_latencies) if ordered_latencies else 0.0,
+                "rehydrate_latency_p95": ordered_latencies[min(len(ordered_latencies) - 1, int(len(ordered_latencies) * 0.95))] if ordered_latencies else 0.0,
+                "rehydrate_latency_max": ordered_latencies[-1] if ordered_latencies else 0.0}
+
+g_history_manager = ChatHistoryManager()
+# --- END OF IDLE CHAT EVICTION (PART 24 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 25: Compact Turn Records
+# - ChatTurn: slotted history turn (role interned, content, numeric ts) used by CHAT_HISTORIES and outreach histories.
+#   Reads like the old {"role", "content"} dicts (turn["content"], turn.get("role")), so consumers are unchanged.
+# - Turns go into the /api/chat payload as-is: the pooled HTTP session serializes them through a json default hook,
+#   so no per-request dict copies of the history are built.
+# - InteractionLogEntry: slotted INTERACTION_LOG entry with an epoch timestamp (formatted only when displayed).
+# - `python AIaspects.py --bench-memory [chats]` reports resident bytes per chat for dict vs slotted turns.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part25_Integrate: Defining compact turn records.")
+
+class ChatTurn:
+    """One history turn: a 56-byte slotted object plus its ts float, instead of a 184-byte two-key dict."""
+    __slots__ = ("role", "content", "ts")
+
+    def __init__(self, role: str, content: str, ts: float = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.ts = time.time() if ts is None else ts
+
+    def __getitem__(self, key: str):
+        if key in ChatTurn.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in ChatTurn.__slots__ else default
+
+    def __repr__(self) -> str:
+        return f"ChatTurn({self.role!r}, {self.content[:40]!r}...)"
+
+    def as_message(self) -> dict:
+        return {"role": self.role, "content": self.content}
+
+    def as_record(self) -> dict:
+        return {"role": self.role, "content": self.content, "ts": self.ts}
+
+    @classmethod
+    def from_record(cls, record) -> "ChatTurn":
+        """From a persisted record (also accepts the older {"role", "content"} dicts and ChatTurn itself)."""
+        if isinstance(record, ChatTurn):
+            return record
+        return cls(record.get("role") or "user", record.get("content") or "", record.get("ts", 0.0))
+
+def turns_from_records(records) -> list:
+    return [ChatTurn.from_record(record) for record in records or ()]
+
+def api_payload_json_default(value):
+    """json default hook for /api/chat payloads: history turns are written as plain messages."""
+    if isinstance(value, ChatTurn):
+        return value.as_message()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_api_payload(payload) -> str:
+    return json.dumps(payload, default=api_payload_json_default)
+
+def state_json_default(value):
+    """json default hook for persisted state: turns keep their timestamp; anything else unknown is stringified."""
+    if isinstance(value, ChatTurn):
+        return value.as_record()
+    return str(value)
+
+class InteractionLogEntry:
+    """One INTERACTION_LOG entry (in-memory quick log of recent LLM replies)."""
+    __slots__ = ("ts", "chat_id", "user_message", "ai_reply", "outreach_context", "model_used")
+
+    def __init__(self, chat_id: str, user_message: str, ai_reply: str, outreach_context: bool, model_used: str):
+        self.ts = time.time()
+        self.chat_id = chat_id
+        self.user_message = user_message
+        self.ai_reply = ai_reply
+        self.outreach_context = outreach_context
+        self.model_used = model_used
+
+def bench_memory_cli():
+    """`python AIaspects.py --bench-memory [chats]`: resident bytes per chat with full histories, dict vs ChatTurn."""
+    import gc, tracemalloc
+    chat_count_index = sys.argv.index("--bench-memory") + 1
+    chat_count = int(sys.argv[chat_count_index]) if chat_count_index < len(sys.argv) and sys.argv[chat_count_index].isdigit() else 10000
+    turns_per_chat = DEFAULT_INITIAL_MAX_CHAT_HISTORY_TURNS * 2
+    sample_texts = ("كم سعر تصميم الشعار؟", "سعر تصميم الشعار يبدأ من 500 ريال ويشمل ثلاث نماذج وتعديلين. هل تود معرفة المزيد؟")
+    representations = (("dict turns (previous)", lambda role, content: {"role": role, "content": content}),
+                       ("ChatTurn (__slots__)", ChatTurn))
+
+    def build_histories(make_turn) -> dict:
+        histories = {}
+        for chat_index in range(chat_count):
+            history = deque(maxlen=turns_per_chat)
+            for turn_index in range(turns_per_chat):
+                history.append(make_turn(("user", "assistant")[turn_index % 2], f"{sample_texts[turn_index % 2]} #{chat_index}/{turn_index}"))
+            histories[f"9665{chat_index:08d}@c.us"] = history
+        return histories
+
+    print(f"Memory benchmark: {chat_count} chat(s) x {turns_per_chat} turn(s) (Python {sys.version.split()[0]}).")
+    results = {}
+    for label, make_turn in representations:
+        gc.collect()
+        tracemalloc.start()
+        build_start = time.perf_counter()
+        histories = build_histories(make_turn)
+        build_seconds = time.perf_counter() - build_start
+        traced_bytes, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        text_bytes = sum(sys.getsizeof(turn["content"]) for history in histories.values() for turn in history)
+        results[label] = traced_bytes
+        print(f"  {label:<24} {traced_bytes / 1024 / 1024:8.1f} MB total, {traced_bytes / chat_count:8.0f} B/chat, "
+              f"{(traced_bytes - text_bytes) / chat_count / turns_per_chat:6.0f} B/turn excluding text, "
+              f"built in {build_seconds:.2f}s")
+        del histories
+    (old_label, old_bytes), (new_label, new_bytes) = results.items()
+    print(f"  Saved {(old_bytes - new_bytes) / chat_count:.0f} B/chat ({(1 - new_bytes / old_bytes) * 100:.1f}%) with {new_label}.")
+
+    gc.collect()
+    tracemalloc.start()
+    old_ring = [{"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "chat_id": f"9665{i:08d}@c.us", "user_message": sample_texts[0],
+                 "ai_reply": sample_texts[1], "outreach_context": False, "model_used": g_ollama_model_name} for i in range(chat_count)]
+    old_ring_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del old_ring
+    gc.collect()
+    tracemalloc.start()
+    new_ring = [InteractionLogEntry(f"9665{i:08d}@c.us", sample_texts[0], sample_texts[1], False, g_ollama_model_name) for i in range(chat_count)]
+    new_ring_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del new_ring
+    print(f"  INTERACTION_LOG entries: {old_ring_bytes / chat_count:.0f} B (dict + formatted timestamp) vs "
+          f"{new_ring_bytes / chat_count:.0f} B (InteractionLogEntry) per entry.")
+# --- END OF COMPACT TURN RECORDS (PART 25 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 26: Adaptive Message Aggregation Window
+# - Replaces the fixed aggregation delay with a per-chat window, chosen when each fragment is buffered:
+#   * learned: ~90th percentile of the chat's gaps between fragments of one message (plus a margin);
+#   * single-shot senders (bursts of ~1 fragment) get a short window; unknown chats start from the configured delay;
+#   * a trailing ?/؟ or a long fragment shortens it, a trailing ...,،: or a very short fragment lengthens it;
+#   * an explicit end marker (configurable) or an admin command closes it after min_window_seconds.
+# - Always clamped to [min_window_seconds, max_window_seconds].
+# - A fragment arriving after the window closed but before the reply finished counts as a "late fragment"
+#   (the window was too short); its gap is learned, so that chat's window grows.
+# - Once a window has closed the reply is no longer cancelled by further fragments: they form the next message.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part26_Integrate: Defining adaptive aggregation window.")
+
+AGGREGATION_QUESTION_SUFFIXES: tuple = ("?", "؟")
+AGGREGATION_CONTINUATION_SUFFIXES: tuple = ("...", "…", "،", ",", ":", "-")
+
+class _ChatGapProfile:
+    __slots__ = ("last_fragment_at", "window_open", "awaiting_reply", "gaps", "bursts", "burst_fragments_total", "current_burst_fragments")
+
+    def __init__(self):
+        self.last_fragment_at = None
+        self.window_open = False
+        self.awaiting_reply = False
+        self.gaps = deque(maxlen=16) # Seconds between fragments of the same message
+        self.bursts = 0
+        self.burst_fragments_total = 0
+        self.current_burst_fragments = 0
+
+class AdaptiveAggregationWindow:
+    """Per-chat aggregation windows learned from inter-fragment gaps plus text heuristics."""
+    def __init__(self):
+        self._profiles: OrderedDict = OrderedDict() # chat_id -> _ChatGapProfile (LRU, max_tracked_chats)
+        self._processing_tasks: dict = {} # Timer task whose window closed (now generating/sending the reply) -> chat_id, oldest first
+        self._windows_used: deque = deque(maxlen=1000) # Added latency samples (seconds)
+        self.reason_counts: dict[str, int] = {}
+        self.stats = {"windows": 0, "fragments": 0, "late_fragments": 0, "saved_seconds_total": 0.0}
+
+    def _settings_float(self, key: str) -> float:
+        return float(g_adaptive_aggregation_settings.get(key, DEFAULT_ADAPTIVE_AGGREGATION_SETTINGS[key]))
+
+    def _get_profile(self, chat_id: str) -> _ChatGapProfile:
+        profile = self._profiles.get(chat_id)
+        if profile is None:
+            profile = self._profiles[chat_id] = _ChatGapProfile()
+            while len(self._profiles) > max(1, int(g_adaptive_aggregation_settings.get("max_tracked_chats", 20000))):
+                self._profiles.popitem(last=False)
+        else:
+            self._profiles.move_to_end(chat_id)
+        return profile
+
+    def _base_window(self, profile: _ChatGapProfile) -> tuple[float, str]:
+        min_gap_samples = int(g_adaptive_aggregation_settings.get("min_gap_samples", DEFAULT_ADAPTIVE_AGGREGATION_SETTINGS["min_gap_samples"]))
+        if len(profile.gaps) >= min_gap_samples:
+            ordered_gaps = sorted(profile.gaps)
+            return ordered_gaps[int((len(ordered_gaps) - 1) * 0.9)] + self._settings_float("gap_margin_seconds"), "learned"
+        if profile.bursts >= min_gap_samples and profile.burst_fragments_total <= profile.bursts * 1.2:
+            return self._settings_float("single_shot_window_seconds"), "single_shot"
+        return float(g_message_aggregation_delay), "default"
+
+    def on_fragment(self, chat_id: str, text: str, is_admin_command: bool = False) -> float:
+        """Records a buffered fragment and returns the aggregation window (seconds) to wait from now."""
+        now = time.monotonic()
+        profile = self._get_profile(chat_id)
+        max_window_seconds = self._settings_float("max_window_seconds")
+        if profile.last_fragment_at is not None and (profile.window_open or profile.awaiting_reply):
+            fragment_gap = now - profile.last_fragment_at
+            if fragment_gap <= max_window_seconds * 2:
+                profile.gaps.append(fragment_gap)
+            if not profile.window_open:
+                self.stats["late_fragments"] += 1 # Still typing when the window closed
+        if not profile.window_open:
+            profile.current_burst_fragments = 0
+        profile.current_burst_fragments += 1
+        profile.window_open = True
+        profile.last_fragment_at = now
+        self.stats["fragments"] += 1
+
+        if not g_adaptive_aggregation_settings.get("enabled", True):
+            window_seconds, reason = float(g_message_aggregation_delay), "fixed"
+        else:
+            stripped_text = (text or "").rstrip()
+            end_markers = [marker for marker in g_adaptive_aggregation_settings.get("end_markers", []) if marker]
+            if is_admin_command or any(stripped_text.endswith(marker) for marker in end_markers):
+                window_seconds, reason = 0.0, "end_marker"
+            else:
+                window_seconds, reason = self._base_window(profile)
+                if stripped_text.endswith(AGGREGATION_QUESTION_SUFFIXES):
+                    window_seconds *= self._settings_float("question_window_factor"); reason += "+question"
+                elif stripped_text.endswith(AGGREGATION_CONTINUATION_SUFFIXES):
+                    window_seconds *= self._settings_float("continuation_window_factor"); reason += "+continuation"
+                elif len(stripped_text) >= int(g_adaptive_aggregation_settings.get("long_fragment_chars", 120)):
+                    window_seconds *= self._settings_float("long_fragment_window_factor"); reason += "+long"
+                elif len(stripped_text) <= int(g_adaptive_aggregation_settings.get("short_fragment_chars", 12)):
+                    window_seconds *= self._settings_float("short_fragment_window_factor"); reason += "+short"
+            window_seconds = min(max_window_seconds, max(self._settings_float("min_window_seconds"), window_seconds))
+        self.reason_counts[reason] = self.reason_counts.get(reason, 0) + 1
+        return window_seconds
+
+    def on_window_closed(self, chat_id: str, window_seconds: float):
+        """Called by the timer task when its window expired; from here on the task is processing the message."""
+        profile = self._get_profile(chat_id)
+        profile.window_open = False
+        profile.awaiting_reply = True
+        profile.bursts += 1
+        profile.burst_fragments_total += profile.current_burst_fragments
+        self._processing_tasks[asyncio.current_task()] = chat_id
+        self._windows_used.append(window_seconds)
+        self.stats["windows"] += 1
+        self.stats["saved_seconds_total"] += float(g_message_aggregation_delay) - window_seconds
+
+    def on_processing_done(self, chat_id: str):
+        self._processing_tasks.pop(asyncio.current_task(), None)
+        profile = self._profiles.get(chat_id)
+        if profile is not None:
+            profile.awaiting_reply = self.is_awaiting_reply(chat_id) # An overlapping later message may still be processing
+
+    def is_processing(self, timer_task: asyncio.Task) -> bool:
+        return timer_task in self._processing_tasks
+
+    def is_awaiting_reply(self, chat_id: str) -> bool:
+        return chat_id in self._processing_tasks.values()
+
+    def earlier_processing_tasks(self, chat_id: str) -> list:
+        """Processing tasks of chat_id whose window closed before the calling task's window."""
+        current_task = asyncio.current_task()
+        earlier_tasks = []
+        for processing_task, processing_chat_id in self._processing_tasks.items():
+            if processing_task is current_task:
+                break
+            if processing_chat_id == chat_id:
+                earlier_tasks.append(processing_task)
+        return earlier_tasks
+
+    def processing_tasks(self) -> list:
+        return list(self._processing_tasks)
+
+    def describe_chat(self, chat_id: str) -> str:
+        profile = self._profiles.get(chat_id)
+        if profile is None:
+            return f"No aggregation profile for '{chat_id}' (next window: {float(g_message_aggregation_delay):.1f}s default)."
+        base_window, base_reason = self._base_window(profile)
+        ordered_gaps = sorted(profile.gaps)
+        return (f"Aggregation profile for '{chat_id}': {profile.bursts} message(s), "
+                f"{profile.burst_fragments_total / profile.bursts if profile.bursts else 0:.2f} fragment(s)/message, "
+                f"{len(ordered_gaps)} gap sample(s)" + (f" (median {ordered_gaps[len(ordered_gaps) // 2]:.1f}s, max {ordered_gaps[-1]:.1f}s)" if ordered_gaps else "")
+                + f". Base window: {base_window:.1f}s ({base_reason}).")
+
+    def get_stats(self) -> dict:
+        ordered_windows = sorted(self._windows_used)
+        return {**self.stats, "tracked_chats": len(self._profiles), "reasons": dict(self.reason_counts),
+                "window_avg": sum(ordered_windows) / len(ordered_windows) if ordered_windows else 0.0,
+                "window_p50": ordered_windows[len(ordered_windows) // 2] if ordered_windows else 0.0,
+                "window_p95": ordered_windows[min(len(ordered_windows) - 1, int(len(ordered_windows) * 0.95))] if ordered_windows else 0.0,
+                "late_fragment_rate": self.stats["late_fragments"] / self.stats["fragments"] if self.stats["fragments"] else 0.0}
+
+g_adaptive_aggregation = AdaptiveAggregationWindow()
+# --- END OF ADAPTIVE MESSAGE AGGREGATION WINDOW (PART 26 NEW) ---
+
+# -----------------------------------------------------------------------------
+# Part 27: Speculative Generation During the Aggregation Window
+# - Optional (speculative_generation.enabled). Once a reactive chat's buffer has been quiet for a pre-window
+#   (quiet_fraction of its aggregation window, at least min_quiet_seconds), the reply to the buffer so far is
+#   generated in the background, without touching history.
+# - When the window closes on the same buffer (same system prompt, same history), the finished or still running
+#   generation is adopted and its turns committed. A new fragment cancels it; the next quiet pre-window restarts it.
+# - Budget: at most max_concurrent speculations, run in the idle-only "speculative" scheduler lane and preempted
+#   as soon as foreground work finds every general worker busy.
+# - Generation seconds saved (overlap with the window) vs wasted (discarded work) are reported by $specstats.
+# -----------------------------------------------------------------------------
+print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part27_Integrate: Defining speculative generation.")
+
+def is_llm_reply_ok(reply_text: str | None) -> bool:
+    return bool(reply_text) and not reply_text.startswith("خطأ:") and not reply_text.startswith("Error:")
+
+def reactive_history_fingerprint(chat_id: str) -> tuple:
+    """(turn count, last turn, summary) of a chat's reactive context. Turns are immutable ChatTurn records."""
+    history_deque = CHAT_HISTORIES.get(chat_id)
+    return (len(history_deque) if history_deque else 0, history_deque[-1] if history_deque else None,
+            CHAT_SUMMARIES.get(get_summary_key("reactive", chat_id), ""))
+
+class _Speculation:
+    __slots__ = ("chat_id", "prompt_text", "system_prompt", "timer_task", "task", "history_fingerprint", "request_stats",
+                 "started_at", "finished_at", "result", "claimed", "committed", "cancel_reason")
+
+    def __init__(self, chat_id: str, prompt_text: str, system_prompt: str, timer_task: asyncio.Task):
+        self.chat_id = chat_id
+        self.prompt_text = prompt_text
+        self.system_prompt = system_prompt
+        self.timer_task = timer_task # The aggregation timer that may adopt the result
+        self.task = None
+        self.history_fingerprint = None
+        self.request_stats = {}
+        self.started_at = None # Set when the scheduler starts the generation
+        self.finished_at = None
+        self.result = None
+        self.claimed = False
+        self.committed = False
+        self.cancel_reason = None
+
+class SpeculativeGenerator:
+    """Generates reactive replies while the aggregation window is still open and hands them to the timer that closes it."""
+    def __init__(self):
+        self._speculations: dict[str, _Speculation] = {} # chat_id -> speculation queued, running or awaiting adoption
+        self.outcome_counts: dict[str, int] = {}
+        self.stats = {"started": 0, "skipped_budget": 0, "saved_seconds_total": 0.0, "wasted_seconds_total": 0.0}
+
+    def _settings_float(self, key: str) -> float:
+        return float(g_speculative_generation_settings.get(key, DEFAULT_SPECULATIVE_GENERATION_SETTINGS[key]))
+
+    def _count_outcome(self, outcome: str):
+        self.outcome_counts[outcome] = self.outcome_counts.get(outcome, 0) + 1
+
+    def pre_window_seconds(self, window_seconds: float) -> float | None:
+        """Quiet time after which a window of window_seconds speculates, or None when there is nothing to gain."""
+        if not g_speculative_generation_settings.get("enabled") or not g_llm_scheduler.is_running:
+            return None
+        quiet_seconds = max(self._settings_float("min_quiet_seconds"), window_seconds * self._settings_float("quiet_fraction"))
+        if window_seconds - quiet_seconds < self._settings_float("min_lead_seconds"):
+            return None
+        return quiet_seconds
+
+    def _is_eligible(self, chat_id: str, prompt_text: str) -> bool:
+        """Only plain reactive replies are speculated: outreach, admin, toggles and streamed replies take the normal path."""
+        return (AI_IS_ACTIVE and bool(prompt_text) and chat_id != ADMIN_CHAT_ID
+                and prompt_text.lower() != g_ai_toggle_passphrase.lower()
+                and not g_ollama_streaming_settings.get("enabled")
+                and not g_history_manager.has_active_outreach(chat_id)
+                and not g_adaptive_aggregation.is_awaiting_reply(chat_id)) # The previous reply would change the history
+
+    def maybe_start(self, chat_id: str):
+        """Called by the aggregation timer once the buffer has been quiet for its pre-window."""
+        if chat_id in self._speculations:
+            return
+        prompt_text = "\n".join(USER_MESSAGE_BUFFERS.get(chat_id) or []).strip()
+        if not self._is_eligible(chat_id, prompt_text):
+            return
+        if len(self._speculations) >= max(0, int(g_speculative_generation_settings.get("max_concurrent", 1))):
+            self.stats["skipped_budget"] += 1
+            return
+        speculation = _Speculation(chat_id, prompt_text, get_reactive_system_prompt(), asyncio.current_task())
+        speculation.task = asyncio.get_running_loop().create_task(self._run(speculation))
+        self._speculations[chat_id] = speculation
+        self.stats["started"] += 1
+        logger.debug("Speculative generation: Started for '%s' (%d chars buffered).", chat_id, len(prompt_text))
+
+    async def _run(self, speculation: _Speculation):
+        chat_id = speculation.chat_id
+
+        async def generate():
+            speculation.started_at = time.monotonic()
+            speculation.history_fingerprint = reactive_history_fingerprint(chat_id)
+            reply_text = await query_ollama_chat(chat_id, speculation.prompt_text, knowledge_content,
+                                                 custom_system_prompt=speculation.system_prompt,
+                                                 request_stats=speculation.request_stats, commit_history=False)
+            speculation.finished_at = time.monotonic()
+            speculation.result = reply_text
+            if speculation.claimed:
+                self._commit(speculation) # Still inside the chat's scheduler slot, before its next job
+            return reply_text
+
+        try:
+            await g_history_manager.ensure_resident(chat_id)
+            knowledge_content = await get_knowledge_for_query(speculation.prompt_text)
+            return await g_llm_scheduler.submit(LLM_LANE_SPECULATIVE, chat_id, generate)
+        except asyncio.CancelledError:
+            if speculation.cancel_reason is None: # Preempted by the scheduler, not cancelled by us
+                self._discard(speculation, "preempted")
+            return None
+        except Exception as e_speculation:
+            logger.warning("Speculative generation: Failed for '%s': %s", chat_id, e_speculation)
+            return None
+
+    def _commit(self, speculation: _Speculation):
+        if speculation.committed or not is_llm_reply_ok(speculation.result):
+            return
+        speculation.committed = True
+        record_cached_reply_turn(speculation.chat_id, speculation.prompt_text, speculation.result,
+                                 model_used=f"{g_ollama_model_name} (speculative)")
+
+    def _discard(self, speculation: _Speculation, reason: str):
+        """Drops a speculation that will not be delivered; the time it spent generating counts as wasted."""
+        if self._speculations.get(speculation.chat_id) is speculation:
+            del self._speculations[speculation.chat_id]
+        if speculation.cancel_reason is not None:
+            return
+        speculation.cancel_reason = reason
+        if speculation.task is not None and not speculation.task.done() and speculation.task is not asyncio.current_task():
+            speculation.task.cancel()
+        if speculation.started_at is not None:
+            self.stats["wasted_seconds_total"] += (speculation.finished_at or time.monotonic()) - speculation.started_at
+        self._count_outcome(reason)
+        logger.debug("Speculative generation: Discarded for '%s' (%s).", speculation.chat_id, reason)
+
+    def on_new_fragment(self, chat_id: str):
+        """A fragment extended the buffer before the window closed: the speculated reply no longer matches it."""
+        speculation = self._speculations.get(chat_id)
+        if speculation is not None and not speculation.claimed:
+            self._discard(speculation, "new_fragment")
+
+    def release(self, chat_id: str):
+        """Called when the aggregation timer finishes: a speculation it did not adopt is dropped."""
+        speculation = self._speculations.get(chat_id)
+        if speculation is not None and speculation.timer_task is asyncio.current_task() and not speculation.claimed:
+            self._discard(speculation, "unused")
+
+    async def take_reply(self, chat_id: str, prompt_text: str, system_prompt: str, request_stats: dict) -> tuple[str, float] | None:
+        """
+        Called by the timer's reactive path on a reply-cache miss. Returns (speculated reply, seconds it took to generate);
+        the reply is already recorded in history. Waits for it if it is still generating; None when the reply must be
+        generated normally.
+        """
+        speculation = self._speculations.get(chat_id)
+        if speculation is None or speculation.timer_task is not asyncio.current_task():
+            return None
+        if speculation.prompt_text != prompt_text or speculation.system_prompt != system_prompt:
+            self._discard(speculation, "changed"); return None
+        if speculation.started_at is None:
+            self._discard(speculation, "not_started"); return None # Still queued behind foreground work
+        current_fingerprint = reactive_history_fingerprint(chat_id)
+        if (current_fingerprint[0] != speculation.history_fingerprint[0] or current_fingerprint[1] is not speculation.history_fingerprint[1]
+                or current_fingerprint[2] != speculation.history_fingerprint[2]):
+            self._discard(speculation, "changed"); return None
+
+        window_closed_at = time.monotonic()
+        outcome = "adopted_running" if speculation.finished_at is None else "adopted_finished"
+        speculation.claimed = True
+        if speculation.finished_at is not None:
+            self._commit(speculation)
+        try:
+            reply_text = await asyncio.shield(speculation.task) # Cancelling the timer must go through _discard
+        except asyncio.CancelledError:
+            self._discard(speculation, "unused")
+            raise
+        if not is_llm_reply_ok(reply_text):
+            self._discard(speculation, "error") # No-op if already preempted
+            return None
+        if self._speculations.get(chat_id) is speculation:
+            del self._speculations[chat_id]
+        self.stats["saved_seconds_total"] += max(0.0, min(speculation.finished_at, window_closed_at) - speculation.started_at)
+        self._count_outcome(outcome)
+        request_stats.update(speculation.request_stats)
+        logger.info("Speculative generation: Adopted reply for '%s' (%s, %.1fs of generation overlapped the window).",
+                    chat_id, outcome, max(0.0, min(speculation.finished_at, window_closed_at) - speculation.started_at))
+        return reply_text, speculation.finished_at - speculation.started_at
+
+    async def stop(self):
+        speculations = list(self._speculations.values())
+        for speculation in speculations:
+            self._discard(speculation, "unused")
+        await asyncio.gather(*(speculation.task for speculation in speculations if speculation.task), return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        adopted = self.outcome_counts.get("adopted_finished", 0) + self.outcome_counts.get("adopted_running", 0)
+        generation_seconds = self.stats["saved_seconds_total"] + self.stats["wasted_seconds_total"]
+        return {**self.stats, "active": len(self._speculations), "adopted": adopted, "outcomes": dict(self.outcome_counts),
+                "hit_rate": adopted / self.stats["started"] if self.stats["started"] else 0.0,
+                "waste_ratio": self.stats["wasted_seconds_total"] / generation_seconds if generation_seconds else 0.0}
+
+g_speculative_generation = SpeculativeGenerator()
+# --- END OF SPECULATIVE GENERATION (PART 27 NEW) ---
+
 # -----------------------------------------------------------------------------
 # Part 5: Admin Command Handler function
 # - Heavily revised for admin_config.json integration.
@@ -632,7 +5275,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
     # --- END DEBUG LOGGING ---
     
     reply_message = f"Admin command '{command}' acknowledged." # Default reply
-    config_changed = False # Flag to trigger saving admin_config.json
+    config_changed = False # Set by handlers that saved a config edit; triggers cache invalidation / warmup
 
     # --- Config Management Commands ---
     if command == "setconfig":
@@ -655,7 +5298,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
                     conf_ref[keys[-1]] = value
                     reply_message = f"Config '{key_path_str}' set to: {value_str}"
                     config_changed = True
-                    load_admin_config() 
+                    save_admin_config(); load_admin_config()
                 else:
                     reply_message = f"Error: Path '{'.'.join(keys[:-1])}' is not a dictionary in config."
             except Exception as e_setconf:
@@ -698,7 +5341,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
         if args_str:
             g_admin_config["base_system_prompt_arabic"] = args_str
             config_changed = True
-            load_admin_config() 
+            save_admin_config(); load_admin_config()
             reply_message = f"Base Reactive AI system prompt updated. Preview: '{g_system_prompt}...'"
         else: reply_message = f"Usage: {g_command_prefix}setprompt <new_prompt_text>"
     elif command == "getprompt": reply_message = f"Current Base Reactive AI System Prompt:\n{g_system_prompt}"
@@ -708,16 +5351,14 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
         if model_to_set:
             g_admin_config["ollama_model_name"] = model_to_set
             config_changed = True
-            load_admin_config()
+            save_admin_config(); load_admin_config()
             reply_message = f"Ollama model set to '{g_ollama_model_name}'. (Ollama server may need reload for new files)."
         else: reply_message = f"Usage: {g_command_prefix}setmodel <model_name_or_number_from_listmodels>"
     elif command == "getmodel": reply_message = f"Current Ollama model: {g_ollama_model_name}"
     
     elif command == "listmodels": 
         try:
-            response = requests.get(f"{g_ollama_api_base_url}/api/tags", timeout=10)
-            response.raise_for_status()
-            models_data = response.json()
+            models_data = await g_ollama_client.get_json(f"{g_ollama_api_base_url}/api/tags", 10)
             if models_data and "models" in models_data:
                 model_list_msgs = ["Available Ollama Models:"]
                 LAST_DISPLAYED_LISTS['available_models'] = {}
@@ -738,12 +5379,11 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
             history_lines = [f"In-Memory Interaction Log (last {len(INTERACTION_LOG)} of max {g_max_interaction_log_size}):"]
             log_copy = list(INTERACTION_LOG)
             for entry in log_copy:
-                chat_id_entry = entry.get("chat_id", "Unknown")
-                user_msg_short = entry.get('user_message', "N/A").replace('\n', ' ')[:70]
-                ai_reply_short = entry.get('ai_reply', "N/A").replace('\n', ' ')[:70]
-                outreach_tag = "(Outreach)" if entry.get("outreach_context") else ""
-                model_tag = f"(Model: {entry.get('model_used', 'N/A')})"
-                history_lines.append(f"[{entry.get('timestamp', 'N/A')}] From: {chat_id_entry} {outreach_tag} {model_tag}\n  U: {user_msg_short}...\n  A: {ai_reply_short}...")
+                user_msg_short = (entry.user_message or "N/A").replace('\n', ' ')[:70]
+                ai_reply_short = (entry.ai_reply or "N/A").replace('\n', ' ')[:70]
+                outreach_tag = "(Outreach)" if entry.outreach_context else ""
+                model_tag = f"(Model: {entry.model_used or 'N/A'})"
+                history_lines.append(f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.ts))}] From: {entry.chat_id} {outreach_tag} {model_tag}\n  U: {user_msg_short}...\n  A: {ai_reply_short}...")
             reply_message = "\n---\n".join(history_lines) + f"\n\n[Admin Note: In-memory log not cleared by this command. Use {g_command_prefix}clearhistory for that, or {g_command_prefix}viewlog for persistent logs.]"
     elif command == "clearhistory": INTERACTION_LOG.clear(); reply_message = "In-memory interaction log cleared."
 
@@ -752,7 +5392,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
             turns = int(args_str)
             if turns >= 0:
                 g_admin_config["max_chat_history_turns"] = turns
-                config_changed = True; load_admin_config()
+                config_changed = True; save_admin_config(); load_admin_config()
                 reply_message = f"Reactive AI max history turns set to {g_max_chat_history_turns}."
             else: reply_message = "Error: History turns must be non-negative."
         except ValueError: reply_message = f"Usage: {g_command_prefix}sethistoryturns <number>"
@@ -763,7 +5403,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
             ctx = int(args_str)
             if ctx > 0:
                 g_admin_config.setdefault("ollama_model_options", {})["num_ctx"] = ctx
-                config_changed = True; load_admin_config()
+                config_changed = True; save_admin_config(); load_admin_config()
                 reply_message = f"Ollama num_ctx set to {g_ollama_model_options.get('num_ctx')}."
             else: reply_message = "Error: num_ctx must be positive."
         except ValueError: reply_message = f"Usage: {g_command_prefix}setctx <number>"
@@ -774,7 +5414,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
             temp = float(args_str)
             if 0.0 <= temp <= 2.0:
                 g_admin_config.setdefault("ollama_model_options", {})["temperature"] = temp
-                config_changed = True; load_admin_config()
+                config_changed = True; save_admin_config(); load_admin_config()
                 reply_message = f"Ollama temperature set to {g_ollama_model_options.get('temperature'):.2f}."
             else: reply_message = "Error: Temperature typically 0.0-2.0."
         except ValueError: reply_message = f"Usage: {g_command_prefix}settemp <float>"
@@ -782,6 +5422,217 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
     
     elif command == "getoptions": reply_message = f"Current Ollama Options (from config):\n{json.dumps(g_ollama_model_options, indent=2)}"
 
+    elif command == "getsummary":
+        summary_chat_id = args_str.strip()
+        if summary_chat_id: await g_history_manager.ensure_resident(summary_chat_id)
+        if not summary_chat_id:
+            reply_message = (f"Usage: {g_command_prefix}getsummary <chat_id>\n"
+                             f"Summarizer: {g_conversation_summarizer.stats['folds']} folds, {g_conversation_summarizer.stats['turns_folded']} turns folded, "
+                             f"{g_conversation_summarizer.stats['errors']} errors. Summaries held: {len(CHAT_SUMMARIES)}.")
+        else:
+            summary_lines = [f"{key}:\n{CHAT_SUMMARIES[key]}" for key in (get_summary_key("reactive", summary_chat_id), get_summary_key("outreach", summary_chat_id)) if key in CHAT_SUMMARIES]
+            reply_message = "\n\n".join(summary_lines) if summary_lines else f"No conversation summary for '{summary_chat_id}'."
+
+    elif command == "cachestats":
+        reply_cache_stats = g_reply_cache.stats
+        reply_message = (f"Reply Cache: {'ENABLED' if g_reply_cache_settings.get('enabled') else 'DISABLED'} "
+                         f"(TTL {g_reply_cache_settings.get('ttl_seconds')}s, max {g_reply_cache_settings.get('max_entries')} entries, "
+                         f"first turn only: {g_reply_cache_settings.get('first_turn_only')}).\n"
+                         f"Entries: {len(g_reply_cache)}. Hits: {reply_cache_stats['hits']}, misses: {reply_cache_stats['misses']}, "
+                         f"hit rate: {g_reply_cache.hit_rate:.1%}.\n"
+                         f"Stored: {reply_cache_stats['stores']}, expired: {reply_cache_stats['expired']}, evicted: {reply_cache_stats['evicted']}, "
+                         f"invalidations: {reply_cache_stats['invalidations']}.")
+        if g_reply_cache_settings.get("semantic_enabled"):
+            semantic_stats = g_semantic_reply_cache.stats
+            semantic_lookups = semantic_stats["hits"] + semantic_stats["misses"]
+            reply_message += (f"\nSemantic layer{'' if np is not None else ' (numpy NOT installed)'}: threshold {g_reply_cache_settings.get('semantic_threshold')}, "
+                              f"entries {g_semantic_reply_cache.entry_count()}, hits {semantic_stats['hits']}/{semantic_lookups} "
+                              f"({semantic_stats['hits'] / semantic_lookups if semantic_lookups else 0.0:.1%}), "
+                              f"~{semantic_stats['seconds_saved']:.1f}s generation saved, evicted {semantic_stats['evicted']}, errors {semantic_stats['errors']}.")
+    elif command == "clearcache":
+        g_reply_cache.clear(f"{g_command_prefix}clearcache by admin")
+        reply_message = "Reply cache cleared."
+
+    elif command == "viewlog":
+        viewlog_args = args_str.split()
+        if len(viewlog_args) < 2 or viewlog_args[1].lower() not in ("outreach", "reactive"):
+            reply_message = f"Usage: {g_command_prefix}viewlog <chatID_or_num> <outreach/reactive> [last_N]"
+        else:
+            target_id = _get_item_from_numbered_list('active_outreaches', viewlog_args[0], pop_list=False) or viewlog_args[0]
+            log_type = viewlog_args[1].lower()
+            try: last_n = max(1, min(int(viewlog_args[2]), 200)) if len(viewlog_args) > 2 else 20
+            except ValueError: last_n = 20
+            try:
+                logged_turns = await read_recent_interaction_turns(target_id, log_type, last_n)
+                if not logged_turns:
+                    reply_message = f"No {log_type} log found for '{target_id}'."
+                else:
+                    log_lines = [f"{log_type.capitalize()} log for {target_id} (last {len(logged_turns)} turns):"]
+                    for turn in logged_turns:
+                        error_tag = " [ERROR]" if turn.get("is_error") else ""
+                        log_lines.append(f"[{turn.get('timestamp_iso', 'N/A')}] {turn.get('role', '??').upper()}{error_tag}: {str(turn.get('content', ''))[:300]}")
+                    reply_message = "\n".join(log_lines)
+            except Exception as e_viewlog:
+                reply_message = f"Error reading {log_type} log for '{target_id}': {e_viewlog}"
+
+    elif command == "searchlogs":
+        search_args = args_str.split()
+        search_type, since_iso = None, None
+        while len(search_args) > 1: # Optional trailing [since] [type], in either order
+            if search_args[-1].lower() in ("outreach", "reactive") and not search_type:
+                search_type = search_args.pop().lower()
+            elif parse_search_since(search_args[-1]) and not since_iso:
+                since_iso = parse_search_since(search_args.pop())
+            else:
+                break
+        search_query = " ".join(search_args)
+        if not search_query:
+            reply_message = f"Usage: {g_command_prefix}searchlogs <query> [since: 24h|7d|2w|YYYY-MM-DD] [outreach/reactive]"
+        elif g_log_search_index.unavailable_reason:
+            reply_message = f"Log search is unavailable: {g_log_search_index.unavailable_reason}"
+        else:
+            await g_interaction_log_writer.flush()
+            search_start = time.monotonic()
+            try:
+                search_hits = await asyncio.to_thread(g_log_search_index.search, search_query, since_iso, search_type, 20)
+                search_ms = (time.monotonic() - search_start) * 1000
+                if not search_hits:
+                    reply_message = f"No logged turns match '{search_query}' ({search_ms:.0f} ms)."
+                else:
+                    hit_lines = [f"{len(search_hits)} hit(s) for '{search_query}' ({search_ms:.0f} ms):"]
+                    for hit_num, hit in enumerate(search_hits, 1):
+                        hit_lines.append(f"{hit_num}. [{hit['timestamp_iso']}] {hit['chat_id']} ({hit['interaction_type']}) {hit['role'].upper()}: {hit['snippet']}")
+                    hit_lines.append(f"\nUse {g_command_prefix}viewlog <chatID> <outreach/reactive> [last_N] for context.")
+                    reply_message = "\n".join(hit_lines)
+            except Exception as e_search:
+                reply_message = f"Error searching logs: {e_search}"
+
+    elif command == "contactcache":
+        if args_str.strip().lower() == "clear":
+            g_contact_name_cache.clear()
+            reply_message = "Contact name cache cleared."
+        else:
+            contact_stats = g_contact_name_cache.stats
+            reply_message = (f"Contact Name Cache: {'ENABLED' if g_contact_cache_settings.get('enabled', True) else 'DISABLED'}, "
+                             f"{len(g_contact_name_cache)}/{g_contact_cache_settings.get('max_entries')} entries, TTL {g_contact_cache_settings.get('ttl_seconds')}s.\n"
+                             f"Hits: {contact_stats['hits']}, coalesced: {contact_stats['coalesced']}, getContact calls: {contact_stats['misses']} "
+                             f"(hit rate {g_contact_name_cache.hit_rate:.1%}). Errors: {contact_stats['errors']}, expired: {contact_stats['expired']}.")
+
+    elif command == "stats":
+        stats_args = args_str.split(maxsplit=1)
+        stats_period = stats_args.pop(0).lower() if stats_args and stats_args[0].lower() in ("day", "week", "all") else "week"
+        stats_campaign = stats_args[0].strip() if stats_args else ""
+        if not g_analytics_settings.get("enabled", True):
+            reply_message = "Log analytics are disabled (analytics.enabled)."
+        else:
+            await g_interaction_log_writer.flush()
+            try:
+                new_turns = await asyncio.to_thread(g_log_analytics.update)
+                analytics_report = await asyncio.to_thread(g_log_analytics.report, stats_period, stats_campaign or None)
+                reply_message = format_analytics_report(analytics_report)
+                if stats_campaign and not analytics_report["campaigns"]:
+                    reply_message += f"\nNo outreach campaign matches '{stats_campaign}'."
+                reply_message += f"\n({new_turns} new turn(s) aggregated in {g_log_analytics.stats['last_update_seconds'] * 1000:.0f} ms.)"
+            except Exception as e_stats:
+                reply_message = f"Error computing stats: {e_stats}"
+
+    elif command == "logstats":
+        log_writer_stats = g_interaction_log_writer.get_stats()
+        reply_message = (f"Log Writer: {'RUNNING' if log_writer_stats['running'] else 'NOT RUNNING (direct writes)'}, backend '{log_writer_stats['backend']}'. "
+                         f"Backlog: {log_writer_stats['backlog']} (max {log_writer_stats['max_backlog']}). Open files: {log_writer_stats['open_files']}.\n"
+                         f"Written: {log_writer_stats['written']} line(s) in {log_writer_stats['batches']} batch(es), "
+                         f"{log_writer_stats['write_errors']} error(s), {log_writer_stats['fsyncs']} fsync(s).\n"
+                         f"Batch write: avg {log_writer_stats['write_latency']['avg'] * 1000:.1f}ms / p95 {log_writer_stats['write_latency']['p95'] * 1000:.1f}ms / max {log_writer_stats['write_latency']['max'] * 1000:.1f}ms.\n"
+                         f"Queue-to-disk: avg {log_writer_stats['queue_latency']['avg'] * 1000:.1f}ms / p95 {log_writer_stats['queue_latency']['p95'] * 1000:.1f}ms / max {log_writer_stats['queue_latency']['max'] * 1000:.1f}ms.")
+        if isinstance(g_log_backend, JsonlLogBackend):
+            rotation_stats = g_log_backend.rotation_stats
+            reply_message += (f"\nRotation ({'on' if g_log_rotation_settings.get('enabled') else 'off'}): {rotation_stats['rotated']} rotated, "
+                              f"{rotation_stats['compressed']} compressed, {rotation_stats['deleted']} deleted. "
+                              f"Last maintenance: {rotation_stats['last_maintenance'] or 'never'}.")
+    elif command == "rotatelogs":
+        try: # Analytics first, as in log_maintenance_loop: segments must be caught up before they are compressed or deleted
+            await g_interaction_log_writer.flush()
+            await asyncio.to_thread(g_log_analytics.update)
+            pass_stats = await asyncio.to_thread(get_log_backend().maintain)
+            reply_message = f"Log maintenance done: {pass_stats['rotated']} rotated, {pass_stats['compressed']} compressed, {pass_stats['deleted']} deleted."
+        except Exception as e_rotate:
+            reply_message = f"Error during log maintenance: {e_rotate}"
+
+    elif command == "llmqueue":
+        sched_stats = g_llm_scheduler.get_stats()
+        queue_lines = [f"LLM Scheduler: {'RUNNING' if g_llm_scheduler.is_running else 'NOT RUNNING'}. "
+                       f"Workers: {sched_stats['workers']} (+{sched_stats['admin_reserved_workers']} admin-only). Busy chats: {sched_stats['busy_chats']}."]
+        for lane_name, lane_stats in sorted(sched_stats["lanes"].items()):
+            queue_lines.append(f"- {lane_name}: queued {lane_stats['queued']}, running {lane_stats['running']}, done {lane_stats['completed']}, "
+                               f"cancelled {lane_stats['cancelled']}, wait avg {lane_stats['avg_wait']:.2f}s / p95 {lane_stats['p95_wait']:.2f}s / max {lane_stats['max_wait']:.2f}s")
+        if not sched_stats["lanes"]: queue_lines.append("No LLM jobs submitted yet.")
+        reply_message = "\n".join(queue_lines)
+
+    elif command == "aggstats":
+        if args_str.strip():
+            reply_message = g_adaptive_aggregation.describe_chat(args_str.strip())
+        else:
+            aggregation_stats = g_adaptive_aggregation.get_stats()
+            reply_message = (f"Adaptive Aggregation: {'ENABLED' if g_adaptive_aggregation_settings.get('enabled', True) else f'DISABLED (fixed {g_message_aggregation_delay}s)'}, "
+                             f"window {g_adaptive_aggregation_settings.get('min_window_seconds')}-{g_adaptive_aggregation_settings.get('max_window_seconds')}s, "
+                             f"{aggregation_stats['tracked_chats']} chat(s) tracked.\n"
+                             f"Added latency (window): avg {aggregation_stats['window_avg']:.1f}s / p50 {aggregation_stats['window_p50']:.1f}s / p95 {aggregation_stats['window_p95']:.1f}s "
+                             f"over {aggregation_stats['windows']} message(s); {aggregation_stats['saved_seconds_total']:.0f}s saved vs the fixed {g_message_aggregation_delay}s.\n"
+                             f"Late fragments (window closed too early): {aggregation_stats['late_fragments']} of {aggregation_stats['fragments']} "
+                             f"({aggregation_stats['late_fragment_rate'] * 100:.1f}%).\n"
+                             "Window reasons: " + ", ".join(f"{reason} {count}" for reason, count in sorted(aggregation_stats['reasons'].items(), key=lambda item: -item[1])))
+
+    elif command == "specstats":
+        speculation_stats = g_speculative_generation.get_stats()
+        reply_message = (f"Speculative Generation: {'ENABLED' if g_speculative_generation_settings.get('enabled') else 'DISABLED'}, "
+                         f"budget {g_speculative_generation_settings.get('max_concurrent')} concurrent, {speculation_stats['active']} active.\n"
+                         f"Started {speculation_stats['started']}, adopted {speculation_stats['adopted']} ({speculation_stats['hit_rate'] * 100:.1f}%), "
+                         f"skipped for budget {speculation_stats['skipped_budget']}.\n"
+                         f"Generation time saved {speculation_stats['saved_seconds_total']:.1f}s vs wasted {speculation_stats['wasted_seconds_total']:.1f}s "
+                         f"({speculation_stats['waste_ratio'] * 100:.1f}% wasted).\n"
+                         "Outcomes: " + (", ".join(f"{outcome} {count}" for outcome, count in sorted(speculation_stats['outcomes'].items(), key=lambda item: -item[1])) or "none"))
+
+    elif command == "ingressstats":
+        ingress_stats = g_message_ingress.get_stats()
+        reply_message = (f"Message Ingress: {'RUNNING' if ingress_stats['running'] else 'NOT RUNNING'}, overflow '{g_message_ingress_settings.get('overflow_policy')}'. "
+                         f"Queued: {ingress_stats['queued']}/{g_message_ingress_settings.get('max_queue_size')} (max seen {ingress_stats['max_depth']}), "
+                         f"spilled waiting: {ingress_stats['spill_backlog']}.\n"
+                         f"Submitted: {ingress_stats['submitted']}, processed: {ingress_stats['processed']}, errors: {ingress_stats['errors']}, "
+                         f"dropped: {ingress_stats['dropped']}, spilled: {ingress_stats['spilled']} (replayed {ingress_stats['replayed']}).\n"
+                         f"Ingress lag: avg {ingress_stats['lag']['avg'] * 1000:.1f}ms / p95 {ingress_stats['lag']['p95'] * 1000:.1f}ms / max {ingress_stats['lag']['max'] * 1000:.1f}ms.")
+
+    elif command == "sendqueue":
+        send_stats = g_outbound_dispatcher.get_stats()
+        reply_message = (f"Send Dispatcher: {'RUNNING' if send_stats['running'] else 'NOT RUNNING (inline sends)'}, "
+                         f"{float(g_outbound_send_settings.get('rate_per_second') or 0):.2f} msg/s (burst {g_outbound_send_settings.get('burst')}).\n"
+                         f"Backlog: {send_stats['backlog']} message(s) in {send_stats['chats_queued']} chat(s) (max {send_stats['max_backlog']}), "
+                         f"{send_stats['chats_in_backoff']} chat(s) in retry backoff.\n"
+                         f"Queued: {send_stats['queued']}, sent: {send_stats['sent']}, failed: {send_stats['failed']}, unknown: {send_stats['unknown']}, retries: {send_stats['retries']}, "
+                         f"paced waits: {send_stats['paced_waits']}.\n"
+                         f"Queue-to-sent: avg {send_stats['queue_latency']['avg']:.2f}s / p95 {send_stats['queue_latency']['p95']:.2f}s / max {send_stats['queue_latency']['max']:.2f}s. "
+                         f"sendText: avg {send_stats['send_latency']['avg'] * 1000:.0f}ms / p95 {send_stats['send_latency']['p95'] * 1000:.0f}ms.")
+
+    elif command == "statestore":
+        state_stats = g_conversation_state_store.get_stats()
+        reply_message = (f"State Store: {'RUNNING' if state_stats['running'] else 'NOT RUNNING'} "
+                         f"(commit window {float(g_state_persistence_settings.get('commit_window_seconds', 0.5)):.2f}s, fsync {bool(g_state_persistence_settings.get('fsync', True))}).\n"
+                         f"Journal: {state_stats['records']} record(s) in {state_stats['commits']} commit(s), {state_stats['journal_bytes'] / 1024:.1f} KB since last snapshot, "
+                         f"{state_stats['pending_entries']} entry(ies) pending. Snapshots: {state_stats['snapshots']}. Errors: {state_stats['errors']}.\n"
+                         f"Commit latency: avg {state_stats['commit_latency_avg'] * 1000:.1f}ms / max {state_stats['commit_latency_max'] * 1000:.1f}ms.\n"
+                         f"Last startup: restored {state_stats['recovered_entries']} entry(ies), replayed {state_stats['recovered_journal_records']} journal record(s) "
+                         f"in {state_stats['recovery_seconds']:.3f}s" + (f", discarded {state_stats['torn_records']} torn record(s)." if state_stats['torn_records'] else "."))
+
+    elif command == "historystats":
+        history_stats = await g_history_manager.get_stats()
+        reply_message = (f"Chat State Memory: {history_stats['resident_reactive']} reactive + {history_stats['resident_outreach']} outreach chat(s) resident, "
+                         f"~{history_stats['resident_bytes'] / 1024 / 1024:.2f} MB (budget {g_history_eviction_settings.get('memory_budget_mb')} MB, "
+                         f"idle TTL {float(g_history_eviction_settings.get('idle_ttl_seconds', 0)) / 3600:.1f}h). Message buffers: {history_stats['buffers']}.\n"
+                         f"Cold store: {history_stats['cold_reactive']} reactive + {history_stats['cold_outreach']} outreach, {history_stats['cold_bytes'] / 1024:.1f} KB.\n"
+                         f"Evicted: {history_stats['evicted_idle']} idle, {history_stats['evicted_budget']} over budget, {history_stats['evicted_ended_outreach']} ended outreach. "
+                         f"Buffers purged: {history_stats['buffers_purged']}.\n"
+                         f"Rehydrated: {history_stats['rehydrated']} ({history_stats['rehydrate_errors']} errors), latency avg {history_stats['rehydrate_latency_avg'] * 1000:.1f}ms / "
+                         f"p95 {history_stats['rehydrate_latency_p95'] * 1000:.1f}ms / max {history_stats['rehydrate_latency_max'] * 1000:.1f}ms.")
+
     elif command == "addoutreachprompt":
         prompt_key_val = args_str.split(" ", 1)
         if len(prompt_key_val) == 2:
@@ -814,14 +5665,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
         else: reply_message = f"Error: Outreach prompt key '{key_to_del or args_str}' not found."
 
     elif command == "prepareoutreach":
-        outreach_args_list = [] 
-        temp_arg = ""; in_quote = False
-        for char_ in args_str:
-            if char_ == '"': in_quote = not in_quote
-            elif char_ == ' ' and not in_quote:
-                if temp_arg: outreach_args_list.append(temp_arg); temp_arg = ""
-            else: temp_arg += char_
-        if temp_arg: outreach_args_list.append(temp_arg)
+        outreach_args_list = split_quoted_args(args_str)
 
         if len(outreach_args_list) < 2:
             reply_message = f"Usage: {g_command_prefix}prepareoutreach <target_id> <prompt_key_or_\"initial_message\"> [\"custom_system_prompt\"]"
@@ -851,14 +5695,14 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
                                 target_chat_id, str(outreach_final_system_prompt_to_use))
                     initiator_prompt_for_ai_to_start = prompt_key_or_initial_msg
 
-                temp_outreach_history = deque(maxlen=g_max_chat_history_turns * 2 if g_max_chat_history_turns > 0 else None)
-                proposed_ai_message = query_ollama_chat(
+                temp_outreach_history = deque(maxlen=get_history_maxlen())
+                proposed_ai_message = await g_llm_scheduler.submit(LLM_LANE_ADMIN, admin_chat_id, lambda: query_ollama_chat(
                     target_chat_id, 
                     initiator_prompt_for_ai_to_start,
                     "", 
                     custom_system_prompt=outreach_final_system_prompt_to_use,
                     specific_chat_history_deque=temp_outreach_history
-                )
+                ))
 
                 if proposed_ai_message and not proposed_ai_message.startswith("خطأ:") and not proposed_ai_message.startswith("Error:"):
                     g_next_prepared_id_counter += 1
@@ -870,6 +5714,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
                         "task_description": task_description_for_log,
                         "timestamp": time.time()
                     }
+                    g_conversation_state_store.mark_dirty("prepared", prepared_id)
                     reply_message = (
                         f"Prepared outreach for {target_chat_id} (ID: {prepared_id}).\n"
                         f"Task: {task_description_for_log}\n"
@@ -885,6 +5730,67 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
                     reply_message = f"Error: Could not generate proposed AI message for outreach to {target_chat_id}. LLM response: {proposed_ai_message}"
                     logger.error("Admin cmd: Failed to get valid proposed AI message for '%s'. LLM response: %s", target_chat_id, proposed_ai_message)
 
+    elif command == "campaign":
+        campaign_args = split_quoted_args(args_str)
+        campaign_action = campaign_args[0].lower() if campaign_args else ""
+        campaign_name = campaign_args[1] if len(campaign_args) > 1 else ""
+        existing_campaign = await asyncio.to_thread(g_campaign_engine.get_store().get_campaign, campaign_name) if campaign_name and campaign_action != "create" else None
+        if campaign_action == "create":
+            if len(campaign_args) < 4:
+                reply_message = f"Usage: {g_command_prefix}campaign create <name> <targets.csv|.json> <prompt_key_or_\"initial_message\"> [\"custom_system_prompt\"]"
+            else:
+                prompt_key_or_message = _get_item_from_numbered_list("outreach_prompts", campaign_args[3], pop_list=False) or campaign_args[3]
+                reply_message = await g_campaign_engine.create(campaign_name, campaign_args[2], prompt_key_or_message,
+                                                               campaign_args[4] if len(campaign_args) > 4 else None)
+        elif campaign_action == "list":
+            campaigns = await asyncio.to_thread(g_campaign_engine.get_store().list_campaigns)
+            reply_message = "Campaigns:\n" + "\n".join(
+                f"- {campaign['name']}: {campaign['status']} (created {time.strftime('%Y-%m-%d %H:%M', time.localtime(campaign['created_at']))})"
+                for campaign in campaigns) if campaigns else "No campaigns yet."
+        elif campaign_action not in ("status", "sample", "approve", "pause", "resume", "cancel"):
+            reply_message = f"Usage: {g_command_prefix}campaign create|list|status|sample|approve|pause|resume|cancel ... (see {g_command_prefix}help)"
+        elif not existing_campaign:
+            reply_message = f"Error: No campaign named '{campaign_name}'."
+        elif campaign_action == "status":
+            reply_message = await g_campaign_engine.status_report(campaign_name)
+        elif campaign_action == "sample":
+            sample_size = int(campaign_args[2]) if len(campaign_args) > 2 and campaign_args[2].isdigit() else int(g_outreach_campaign_settings.get("sample_size", 5))
+            sampled_targets = await asyncio.to_thread(g_campaign_engine.get_store().fetch_targets, campaign_name, "generated", sample_size, -1, True)
+            reply_message = (f"Campaign '{campaign_name}': {len(sampled_targets)} random proposal(s):\n" + "\n".join(
+                f"#{target['idx']} {target['chat_id']} {target['variables'] or ''}: '{target['message']}'" for target in sampled_targets)
+                if sampled_targets else f"Campaign '{campaign_name}' has no generated proposals awaiting approval.")
+        elif campaign_action == "approve":
+            approve_mode = campaign_args[2].lower() if len(campaign_args) > 2 else ""
+            if existing_campaign["status"] in ("cancelled", "completed"):
+                reply_message = f"Error: Campaign '{campaign_name}' is {existing_campaign['status']}."
+            elif existing_campaign["status"] == "paused":
+                reply_message = f"Error: Campaign '{campaign_name}' is paused. Resume it first with {g_command_prefix}campaign resume {campaign_name}."
+            elif approve_mode == "all" or (approve_mode == "sample" and len(campaign_args) > 3 and campaign_args[3].isdigit()):
+                approved_count = await g_campaign_engine.approve(campaign_name, int(campaign_args[3]) if approve_mode == "sample" else None)
+                reply_message = ((f"Campaign '{campaign_name}': approved {approved_count} proposal(s); "
+                                  + ("they are sent once the remaining proposals are generated." if existing_campaign["status"] == "generating"
+                                     else "sending through the paced send queue."))
+                                 if approved_count else f"Campaign '{campaign_name}' has no generated proposals to approve.")
+            else:
+                reply_message = f"Usage: {g_command_prefix}campaign approve <name> all | {g_command_prefix}campaign approve <name> sample <n>"
+        elif campaign_action == "pause":
+            if existing_campaign["status"] not in CAMPAIGN_RUNNING_STATES or not await g_campaign_engine.pause(campaign_name):
+                current_campaign = await asyncio.to_thread(g_campaign_engine.get_store().get_campaign, campaign_name)
+                reply_message = f"Error: Campaign '{campaign_name}' is not generating or sending (status: {current_campaign['status']}); nothing to pause."
+            else:
+                reply_message = f"Campaign '{campaign_name}' paused (in-flight work finished). Resume with {g_command_prefix}campaign resume {campaign_name}."
+        elif campaign_action == "resume":
+            resumed_status = await g_campaign_engine.resume(campaign_name) if existing_campaign["status"] == "paused" else None
+            if resumed_status is None:
+                reply_message = f"Campaign '{campaign_name}' is not paused (status: {existing_campaign['status']})."
+            else:
+                reply_message = f"Campaign '{campaign_name}' resumed ({resumed_status})."
+        elif campaign_action == "cancel" and existing_campaign["status"] in ("cancelled", "completed"):
+            reply_message = f"Error: Campaign '{campaign_name}' is already {existing_campaign['status']}."
+        elif campaign_action == "cancel":
+            await g_campaign_engine.cancel(campaign_name)
+            reply_message = f"Campaign '{campaign_name}' cancelled. Messages already sent are unaffected."
+
     elif command == "listpreparedoutreach":
         if not PREPARED_OUTREACHES:
             reply_message = "No outreach proposals currently awaiting approval."
@@ -933,31 +5839,26 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
                         reply_message = f"Outreach '{prep_id}' approved with edits for {target_chat_id}. Sending your message."
                 elif action_num == 3: 
                     del PREPARED_OUTREACHES[prep_id]
+                    g_conversation_state_store.mark_dirty("prepared", prep_id)
                     reply_message = f"Prepared outreach '{prep_id}' for {target_chat_id} cancelled."
                     logger.info("Admin cmd: Prepared outreach '%s' cancelled.", prep_id)
-                    if wpp_client: wpp_client.sendText(admin_chat_id, reply_message) # REMOVED await
+                    g_outbound_dispatcher.send_text(admin_chat_id, reply_message)
                     return 
 
                 if final_message_to_send: 
                     if wpp_client:
                         try:
-                            wpp_client.sendText(target_chat_id, final_message_to_send) # REMOVED await
+                            delivered = await g_outbound_dispatcher.send_text(target_chat_id, final_message_to_send, "outreach",
+                                                                              {"outreach_campaign_key": details.get("task_description")})
+                            if delivered is None:
+                                raise ConnectionError("sendText failed mid-send, so it may have been delivered; not retried")
+                            if not delivered:
+                                raise ConnectionError(f"not delivered after {g_outbound_send_settings.get('max_attempts')} attempt(s)")
                             logger.info("Admin cmd: Outreach message sent to '%s' for approved task '%s'.", target_chat_id, prep_id)
-                            await log_interaction_turn(target_chat_id, "outreach", {
-                                "role": "assistant", "content": final_message_to_send,
-                                "outreach_campaign_key": details.get("task_description"), 
-                                "system_prompt_used": details["system_prompt"] + "..." 
-                            })
-                            ACTIVE_OUTREACH_CONVERSATIONS[target_chat_id] = {
-                                "system_prompt": details["system_prompt"],
-                                "task_description": details["task_description"],
-                                "history": deque([{"role": "assistant", "content": final_message_to_send}],
-                                                 maxlen=g_max_chat_history_turns * 2 if g_max_chat_history_turns > 0 else None),
-                                "is_active": True,
-                                "start_time": time.time(),
-                                "prepared_id_source": prep_id
-                            }
+                            await start_outreach_conversation(target_chat_id, final_message_to_send, details["system_prompt"],
+                                                              details["task_description"], prep_id)
                             del PREPARED_OUTREACHES[prep_id] 
+                            g_conversation_state_store.mark_dirty("prepared", prep_id)
                             reply_message += f"\nOutreach to {target_chat_id} is now active."
                             logger.info("Admin cmd: Outreach state for '%s' (from prep_id '%s') activated. Task: %s", target_chat_id, prep_id, details["task_description"])
                         except Exception as e_send_outreach:
@@ -971,11 +5872,13 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
         prep_id = _get_item_from_numbered_list('prepared_outreaches', prep_id_arg)
         if prep_id and prep_id in PREPARED_OUTREACHES:
             del PREPARED_OUTREACHES[prep_id]
+            g_conversation_state_store.mark_dirty("prepared", prep_id)
             reply_message = f"Prepared outreach '{prep_id}' cancelled."
         else: reply_message = f"Error: Prepared outreach ID '{prep_id_arg}' not found."
                 
     elif command == "listactiveoutreach":
-        if not ACTIVE_OUTREACH_CONVERSATIONS:
+        cold_active_ids = g_history_manager.cold_chat_ids("outreach", active_only=True)
+        if not ACTIVE_OUTREACH_CONVERSATIONS and not cold_active_ids:
             reply_message = "No outreach conversations currently marked active."
         else:
             active_list_msgs = ["Currently Active Outreach Conversations:"]
@@ -989,6 +5892,11 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
                     active_list_msgs.append(f"{idx}. Target: {cid}, Task: {task_desc}...")
                     LAST_DISPLAYED_LISTS['active_outreaches'][idx] = cid
                     idx += 1
+            for cid in cold_active_ids: # Evicted while idle; task details are loaded on demand
+                active_found = True
+                active_list_msgs.append(f"{idx}. Target: {cid} (idle, in cold storage)")
+                LAST_DISPLAYED_LISTS['active_outreaches'][idx] = cid
+                idx += 1
             if not active_found:
                  reply_message = "No outreach conversations currently marked active."
             else:
@@ -999,6 +5907,8 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
         target_id_arg = args_str.strip()
         target_id = _get_item_from_numbered_list('active_outreaches', target_id_arg) or \
                     _get_item_from_numbered_list('prepared_outreaches', target_id_arg, pop_list=False) 
+        if target_id and target_id not in PREPARED_OUTREACHES:
+            await g_history_manager.ensure_resident(target_id, include_inactive_outreach=True)
 
         details_to_show = None
         source = ""
@@ -1022,31 +5932,18 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
                 history_msgs.append("\n--- Conversation History (In-Memory) ---")
 
             if source == "Active Outreach": 
-                log_path = pathlib.Path(INTERACTION_LOGS_DIR) / sanitize_filename(target_id) / "outreach_history.jsonl"
-                # Use await asyncio.to_thread for os.path.exists or pathlib.exists()
-                if await asyncio.to_thread(log_path.exists):
-                    history_msgs.append(f"\n--- Conversation History (Persistent Log: {log_path.name}) ---")
-                    try:
-                        async with aiofiles.open(log_path, 'r', encoding='utf-8') as f:
-                            lines_read = 0
-                            async for line in f: 
-                                if lines_read >= 50: 
-                                    history_msgs.append("... (log truncated for display, more in file)")
-                                    break
-                                try:
-                                    turn = json.loads(line)
-                                    role = turn.get("role", "??").upper()
-                                    content = turn.get("content", "") 
-                                    history_msgs.append(f"[{turn.get('timestamp_iso', 'N/A')}] {role}: {content}")
-                                    lines_read += 1
-                                except json.JSONDecodeError:
-                                    history_msgs.append(f"[RAW_LOG_LINE_ERROR]: {line}")
-                        if not lines_read and not conversation_turns: 
-                             history_msgs.append("No conversation turns found in persistent log yet.")
-                    except Exception as e_readlog:
-                        history_msgs.append(f"Error reading persistent log: {e_readlog}")
-                elif not conversation_turns : 
-                     history_msgs.append("No conversation turns found (in-memory or persistent log).")
+                try:
+                    logged_turns = await read_recent_interaction_turns(target_id, "outreach", 50)
+                    if logged_turns:
+                        history_msgs.append(f"\n--- Conversation History (Persistent Log, latest {len(logged_turns)} turns) ---")
+                        for turn in logged_turns:
+                            role = turn.get("role", "??").upper()
+                            content = turn.get("content", "") 
+                            history_msgs.append(f"[{turn.get('timestamp_iso', 'N/A')}] {role}: {content}")
+                    elif not conversation_turns: 
+                        history_msgs.append("No conversation turns found (in-memory or persistent log).")
+                except Exception as e_readlog:
+                    history_msgs.append(f"Error reading persistent log: {e_readlog}")
 
             elif conversation_turns: 
                 for turn in conversation_turns:
@@ -1060,8 +5957,11 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
     elif command == "endoutreach":
         target_id_arg = args_str.strip()
         target_id = _get_item_from_numbered_list('active_outreaches', target_id_arg)
-        if target_id and target_id in ACTIVE_OUTREACH_CONVERSATIONS:
+        if target_id:
+            await g_history_manager.ensure_resident(target_id) # An idle active outreach may be in the cold store
+        if target_id and target_id in ACTIVE_OUTREACH_CONVERSATIONS and ACTIVE_OUTREACH_CONVERSATIONS[target_id].get("is_active"):
             ACTIVE_OUTREACH_CONVERSATIONS[target_id]["is_active"] = False
+            g_conversation_state_store.mark_dirty("outreach", target_id)
             await log_interaction_turn(target_id, "outreach", {
                 "role": "system_event", "content": f"Admin ended outreach. Task: {ACTIVE_OUTREACH_CONVERSATIONS[target_id].get('task_description')}"
             })
@@ -1073,7 +5973,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
         if sys.platform == "win32":
             logger.info("Admin cmd: Attempting to put system to sleep.")
             reply_message = "Attempting to put the system to sleep. Connection will be lost."
-            if wpp_client: wpp_client.sendText(admin_chat_id, reply_message) # REMOVED await
+            await g_outbound_dispatcher.send_text(admin_chat_id, reply_message)
             await asyncio.sleep(1) 
             os.system("rundll32.exe powrprof.dll,SetSuspendState 0,1,0")
         else: reply_message = "System sleep command is only configured for Windows."
@@ -1082,7 +5982,7 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
         if sys.platform == "win32":
             logger.info("Admin cmd: Attempting to put system to hibernate.")
             reply_message = "Attempting to put the system to hibernate. Connection will be lost."
-            if wpp_client: wpp_client.sendText(admin_chat_id, reply_message) # REMOVED await
+            await g_outbound_dispatcher.send_text(admin_chat_id, reply_message)
             await asyncio.sleep(1)
             os.system("rundll32.exe powrprof.dll,SetSuspendState Hibernate") 
         else: reply_message = "System hibernate command is only configured for Windows."
@@ -1097,10 +5997,23 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
             f"- setmodel <name_or_num> | getmodel | listmodels\n"
             f"--- History & Logging ---\n"
             f"- gethistory | clearhistory (in-memory)\n"
-            f"- viewlog <chatID_or_num> <outreach/reactive> [last_N]\n" # To be added later
+            f"- getsummary [chat_id] (rolling conversation summary)\n"
+            f"- cachestats | clearcache (reactive reply cache)\n"
+            f"- contactcache [clear] (display-name cache stats)\n"
+            f"- logstats (interaction log writer backlog/latency) | rotatelogs (run rotation/retention now)\n"
+            f"- viewlog <chatID_or_num> <outreach/reactive> [last_N]\n"
+            f"- searchlogs <query> [24h|7d|YYYY-MM-DD] [outreach/reactive]\n"
+            f"- stats [day|week|all] [campaign] (turn counters, busiest hours, campaign reply rates)\n"
             f"--- LLM Params ---\n"
             f"- sethistoryturns <num> | gethistoryturns\n"
             f"- setctx <num> | getctx | settemp <float> | gettemp | getoptions\n"
+            f"- llmqueue (scheduler queue depth & wait times)\n"
+            f"- ingressstats (incoming message queue depth, lag, drops/spills)\n"
+            f"- aggstats [chat_id] (adaptive aggregation windows: added latency, late fragments)\n"
+            f"- specstats (speculative generation: adopted vs discarded, generation time saved vs wasted)\n"
+            f"- sendqueue (outbound send backlog, pacing, retries)\n"
+            f"- statestore (conversation state journal/snapshot stats)\n"
+            f"- historystats (resident vs cold chats, memory estimate, rehydration latency)\n"
             f"--- Outreach Prompts (outreach_prompts.json) ---\n"
             f"- addoutreachprompt <key> <text>\n"
             f"- listoutreachprompts | getoutreachprompt <key_or_num> | deloutreachprompt <key_or_num>\n"
@@ -1112,6 +6025,10 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
             f"- cancelprepared <prepID_or_num>\n"
             f"- listactiveoutreach | getoutreachdetails <targetID_or_num>\n"
             f"- endoutreach <targetID_or_num>\n"
+            f"--- Bulk Campaigns ---\n"
+            f"- campaign create <name> <targets.csv|.json> <prompt_key_or_\"msg\"> [\"sys_prompt\"]\n"
+            f"- campaign list | status <name> | sample <name> [n]\n"
+            f"- campaign approve <name> all|sample <n> | pause <name> | resume <name> | cancel <name>\n"
             f"--- System Power (Windows Only) ---\n"
             f"- systemsleep | systemhibernate\n"
             f"- help [command_name_for_details]"
@@ -1119,16 +6036,16 @@ async def handle_admin_command(admin_chat_id: str, command_text: str):
     else:
         reply_message = f"Unknown admin command: '{command}'. Try {g_command_prefix}help."
 
-    if config_changed:
-        save_admin_config()
+    if config_changed: # Already saved by the handler (save before reload, or load_admin_config() would discard the edit)
+        if command in ("setprompt", "setmodel", "settemp", "setctx", "setconfig"):
+            g_reply_cache.clear(f"after {command}")
+        if g_prompt_cache_settings.get("warmup_on_startup", True) and command in ("setmodel", "setprompt", "setctx", "setconfig"):
+            asyncio.get_running_loop().create_task(warmup_ollama_model(f"after {command}"))
 
-    try:
-        if wpp_client and reply_message: 
-             wpp_client.sendText(admin_chat_id, reply_message) # REMOVED await
-        elif not wpp_client:
-             logger.error("Admin cmd handler: wpp_client None, cannot send reply to admin '%s'.", admin_chat_id)
-    except Exception as e_admin_reply:
-        logger.error("Admin cmd handler: Exception sending reply to admin '%s': %s", admin_chat_id, e_admin_reply, exc_info=True)# --- END OF ADMIN COMMAND HANDLER (PART 5 HEAVILY MODIFIED) ---
+    if wpp_client and reply_message:
+        g_outbound_dispatcher.send_text(admin_chat_id, reply_message) # Not awaited: queued, retried by the dispatcher
+    elif not wpp_client:
+        logger.error("Admin cmd handler: wpp_client None, cannot send reply to admin '%s'.", admin_chat_id)# --- END OF ADMIN COMMAND HANDLER (PART 5 HEAVILY MODIFIED) ---
 # -----------------------------------------------------------------------------
         
 
@@ -1143,6 +6060,68 @@ print("WPP_Ollama_Chat_Assistant_V_ROADMAP_Outreach_Part6_Integrate: Defining me
 
 # (Located in what was originally Part 6 of the script)
 
+class StreamingReplyDelivery:
+    """
+    Buffers streamed LLM text for one chat and sends each completed sentence (or paragraph)
+    through the outbound send dispatcher as soon as it is available.
+    The first message carries the fixed pre-message and persona prefix, and finish() appends
+    the fixed post-message, so the customer sees the same framing as a non-streamed reply.
+    """
+    SENTENCE_BOUNDARY_RE = re.compile(r'[.!?؟…]+\s+|\n+')
+    PARAGRAPH_BOUNDARY_RE = re.compile(r'\n\s*\n')
+
+    def __init__(self, chat_id: str, pre_message: str = "", persona_prefix: str = "", post_message: str = "",
+                 flush_on: str = "sentence", min_chunk_chars: int = 60, interaction_type: str = None):
+        self.chat_id = chat_id
+        self.interaction_type = interaction_type
+        self.pre_message = pre_message
+        self.persona_prefix = persona_prefix
+        self.post_message = post_message
+        self.boundary_re = self.PARAGRAPH_BOUNDARY_RE if flush_on == "paragraph" else self.SENTENCE_BOUNDARY_RE
+        self.min_chunk_chars = min_chunk_chars
+        self.sent_messages: list[str] = []
+        self._pending_text = ""
+
+    async def feed(self, text_piece: str):
+        """on_text_chunk callback for query_ollama_chat."""
+        self._pending_text += text_piece
+        flush_point = 0
+        for boundary_match in self.boundary_re.finditer(self._pending_text):
+            flush_point = boundary_match.end()
+        if flush_point and len(self._pending_text[:flush_point].strip()) >= self.min_chunk_chars:
+            segment, self._pending_text = self._pending_text[:flush_point], self._pending_text[flush_point:]
+            await self._send(segment)
+
+    async def finish(self, error_text: str = None):
+        """Flushes the remaining text (or error_text instead, if the generation failed) plus the post-message."""
+        remaining_text = error_text if error_text is not None else self._pending_text
+        self._pending_text = ""
+        await self._send(remaining_text, is_final=True)
+
+    @property
+    def delivered_text(self) -> str:
+        return "\n".join(self.sent_messages)
+
+    async def _send(self, segment: str, is_final: bool = False):
+        segment = segment.strip()
+        message_parts = []
+        if not self.sent_messages:
+            if self.pre_message: message_parts.append(self.pre_message)
+            if segment and self.persona_prefix: segment = self.persona_prefix + segment
+        if segment: message_parts.append(segment)
+        if is_final and self.post_message: message_parts.append(self.post_message)
+        message_to_send = "\n".join(message_parts).strip()
+        if not message_to_send:
+            return
+        if not wpp_client:
+            logger.error("Streaming delivery: wpp_client None. Cannot send segment to '%s'.", self.chat_id)
+            return
+        # Queued, not awaited: the dispatcher keeps this chat's segments in order while generation continues
+        g_outbound_dispatcher.send_text(self.chat_id, message_to_send, self.interaction_type, {"streamed_segment": len(self.sent_messages) + 1})
+        self.sent_messages.append(message_to_send)
+        logger.debug("Streaming delivery: Queued segment #%d (%d chars) for '%s'.", len(self.sent_messages), len(message_to_send), self.chat_id)
+
+
 async def process_aggregated_messages(chat_id: str, sender_display_name: str):
     """
     Processes aggregated messages. Routes to admin, active outreach, or reactive AI.
@@ -1154,9 +6133,15 @@ async def process_aggregated_messages(chat_id: str, sender_display_name: str):
     if chat_id not in USER_MESSAGE_BUFFERS or not USER_MESSAGE_BUFFERS[chat_id]:
         logger.debug("Process aggregated: No messages in buffer for chat_id '%s'. Nothing to process.", chat_id)
         return
-
+    # Taken before any await: fragments arriving from here on belong to the next message (and its timer)
     aggregated_prompt = "\n".join(USER_MESSAGE_BUFFERS[chat_id]).strip()
     USER_MESSAGE_BUFFERS[chat_id] = [] 
+
+    earlier_replies = g_adaptive_aggregation.earlier_processing_tasks(chat_id)
+    if earlier_replies: # The previous message's reply must reach history (and the customer) first
+        logger.info("Process aggregated: Waiting for %d earlier reply(ies) to '%s' before processing.", len(earlier_replies), chat_id)
+        await asyncio.wait(earlier_replies)
+    await g_history_manager.ensure_resident(chat_id) # Evicted history/outreach state is loaded back before it is used
     
     logger.info("Process aggregated: Processing for '%s' (chat_id: '%s'). Aggregated prompt (first 100 chars): '%s...'", 
                 sender_display_name, chat_id, aggregated_prompt)
@@ -1194,9 +6179,7 @@ async def process_aggregated_messages(chat_id: str, sender_display_name: str):
         status_reply_msg = f"المساعد الآلي الآن {'يعمل (نشط)' if AI_IS_ACTIVE else 'متوقف (غير نشط)'}."
         logger.info("Process aggregated: AI state toggled by '%s' (ID: '%s') via passphrase. New state: %s",
                     sender_display_name, chat_id, 'ACTIVE' if AI_IS_ACTIVE else 'INACTIVE')
-        if wpp_client:
-            try: wpp_client.sendText(chat_id, status_reply_msg) # REMOVED await
-            except Exception as e_send_status: logger.error("Process aggregated: Error sending AI toggle status: %s", e_send_status)
+        g_outbound_dispatcher.send_text(chat_id, status_reply_msg, "reactive")
         
         await log_interaction_turn(chat_id, "reactive", { 
             "role": "system_event", "content": f"AI Toggled to {AI_IS_ACTIVE} by user passphrase.",
@@ -1210,61 +6193,82 @@ async def process_aggregated_messages(chat_id: str, sender_display_name: str):
         llm_response = "" 
 
         outreach_approval_mode = g_admin_config.get("outreach_settings", {}).get("approval_mode", "FIRST_ONLY")
+        outreach_streaming_delivery = None
+        outreach_request_stats = {}
         
         if outreach_approval_mode == "ALL_REPLIES" and not outreach_data.get("prepared_id_source"): # Only if NOT the very first message
             # This logic for ALL_REPLIES approval for ongoing chats needs to be more robust
             # and tied into a system similar to PREPARED_OUTREACHES or a new command like $sendnextreply.
             # For now, this just generates and notifies admin.
-            proposed_ai_reply = query_ollama_chat(
+            proposed_ai_reply = await g_llm_scheduler.submit(LLM_LANE_OUTREACH, chat_id, lambda: query_ollama_chat(
                 chat_id=chat_id, user_prompt_text=aggregated_prompt, knowledge_content="",
                 custom_system_prompt=outreach_data["system_prompt"],
                 specific_chat_history_deque=outreach_data["history"]
-            )
+            ))
             if proposed_ai_reply and not proposed_ai_reply.startswith("خطأ:"):
                 admin_notification = (
                     f"Outreach Target '{sender_display_name}' ({chat_id}) replied: '{aggregated_prompt}...'\n"
                     f"AI proposes reply (ALL_REPLIES mode): '{proposed_ai_reply}...'\n"
                     f"(Admin action required to send - TBD command)"
                 )
-                if wpp_client: wpp_client.sendText(ADMIN_CHAT_ID, admin_notification) # REMOVED await
+                g_outbound_dispatcher.send_text(ADMIN_CHAT_ID, admin_notification)
                 logger.info("Process aggregated (Outreach ALL_REPLIES): Proposed AI reply sent to admin for approval.")
                 return 
             else:
                 llm_response = proposed_ai_reply 
         else: 
-            llm_response = query_ollama_chat(
+            if g_ollama_streaming_settings.get("enabled"):
+                outreach_streaming_delivery = StreamingReplyDelivery(
+                    chat_id, flush_on=g_ollama_streaming_settings.get("flush_on", "sentence"),
+                    min_chunk_chars=g_ollama_streaming_settings.get("min_chunk_chars", 60), interaction_type="outreach")
+            llm_response = await g_llm_scheduler.submit(LLM_LANE_OUTREACH, chat_id, lambda: query_ollama_chat(
                 chat_id=chat_id, user_prompt_text=aggregated_prompt, knowledge_content="",
                 custom_system_prompt=outreach_data["system_prompt"],
-                specific_chat_history_deque=outreach_data["history"]
-            )
+                specific_chat_history_deque=outreach_data["history"],
+                on_text_chunk=outreach_streaming_delivery.feed if outreach_streaming_delivery else None,
+                request_stats=outreach_request_stats
+            ))
 
         outreach_data["last_interaction_time"] = time.time()
         # Clear the prepared_id_source after the first user reply has been processed to enable ALL_REPLIES for subsequent messages.
         if "prepared_id_source" in outreach_data:
             del outreach_data["prepared_id_source"]
-
-
-        if llm_response and not llm_response.startswith("خطأ:") and not llm_response.startswith("Error:"):
+        g_conversation_state_store.mark_dirty("outreach", chat_id)
+
+        outreach_llm_ok = bool(llm_response) and not llm_response.startswith("خطأ:") and not llm_response.startswith("Error:")
+        if outreach_streaming_delivery and (outreach_streaming_delivery.sent_messages or outreach_llm_ok):
+            # Streamed: part of the reply may already be with the customer, so finish that stream instead of resending.
+            await outreach_streaming_delivery.finish(error_text=None if outreach_llm_ok else (llm_response or "Error: No response from LLM"))
+            logger.info("Process aggregated (Outreach Context): Streamed AI reply to '%s' in %d message(s).", chat_id, len(outreach_streaming_delivery.sent_messages))
+            await log_interaction_turn(chat_id, "outreach", {
+                "role": "assistant", "content": outreach_streaming_delivery.delivered_text if outreach_llm_ok else llm_response,
+                "llm_raw_response": llm_response, "streamed_messages": len(outreach_streaming_delivery.sent_messages),
+                "outreach_campaign_key": outreach_campaign_key_for_log, "is_error": not outreach_llm_ok,
+                "system_prompt_used": outreach_data["system_prompt"]+"...",
+                "token_usage": outreach_request_stats.get("token_usage")
+            })
+        elif outreach_llm_ok:
             if wpp_client:
                 try:
-                    wpp_client.sendText(chat_id, llm_response) # REMOVED await
-                    logger.info("Process aggregated (Outreach Context): AI Reply sent to '%s'.", chat_id)
+                    g_outbound_dispatcher.send_text(chat_id, llm_response, "outreach", {"outreach_campaign_key": outreach_campaign_key_for_log})
+                    logger.info("Process aggregated (Outreach Context): AI Reply queued for '%s'.", chat_id)
                     await log_interaction_turn(chat_id, "outreach", { 
                         "role": "assistant", "content": llm_response,
                         "outreach_campaign_key": outreach_campaign_key_for_log, # Already defined
-                        "system_prompt_used": outreach_data["system_prompt"]+"..."
+                        "system_prompt_used": outreach_data["system_prompt"]+"...",
+                        "token_usage": outreach_request_stats.get("token_usage")
                     })
                 except Exception as e_outreach_reply:
                     logger.error("Process aggregated (Outreach Context): Error sending AI reply to '%s': %s", chat_id, e_outreach_reply)
         else: 
             logger.warning("Process aggregated (Outreach Context): LLM error/no valid response for '%s'. LLM output: %s", chat_id, llm_response)
             if wpp_client and llm_response: 
-                 try: wpp_client.sendText(chat_id, llm_response) # REMOVED await
-                 except Exception: pass
+                 g_outbound_dispatcher.send_text(chat_id, llm_response, "outreach", {"outreach_campaign_key": outreach_campaign_key_for_log})
             await log_interaction_turn(chat_id, "outreach", { 
                 "role": "assistant", "content": llm_response or "Error: No response from LLM",
                 "outreach_campaign_key": outreach_campaign_key_for_log, "is_error": True, # Already defined
-                "system_prompt_used": outreach_data["system_prompt"]+"..."
+                "system_prompt_used": outreach_data["system_prompt"]+"...",
+                "token_usage": outreach_request_stats.get("token_usage")
             })
         return
 
@@ -1272,42 +6276,65 @@ async def process_aggregated_messages(chat_id: str, sender_display_name: str):
         logger.info("Process aggregated (Reactive Context): AI IS ACTIVE. Querying LLM for '%s' (chat_id: '%s').", 
                     sender_display_name, chat_id)
         
-        current_knowledge = load_knowledge_from_file(KNOWLEDGE_FILE_PATH)
-        
-        active_role_key = g_admin_config.get("active_reactive_role", "default_assistant")
-        role_prompt_fragment = g_admin_config.get("reactive_roles", {}).get(active_role_key, "")
-        effective_reactive_system_prompt = g_admin_config.get("base_system_prompt_arabic", DEFAULT_AI_SYSTEM_PROMPT_ARABIC)
-        if role_prompt_fragment and role_prompt_fragment != effective_reactive_system_prompt:
-            effective_reactive_system_prompt += f"\n\nتعليمات الدور الإضافية ({active_role_key}):\n{role_prompt_fragment}"
-
-        active_goal_keys = g_admin_config.get("active_goals", [])
-        if active_goal_keys:
-            goal_instructions = []
-            for goal_key in active_goal_keys:
-                goal_desc = g_admin_config.get("ai_goals", {}).get(goal_key)
-                if goal_desc: goal_instructions.append(f"- {goal_desc} ({goal_key})")
-            if goal_instructions:
-                effective_reactive_system_prompt += "\n\nالأهداف النشطة حاليًا:\n" + "\n".join(goal_instructions)
-        
-        style_desc = g_admin_config.get("ai_interaction_style", "")
-        if style_desc:
-            effective_reactive_system_prompt += f"\n\nأسلوب التفاعل المطلوب: {style_desc}"
-
-        llm_response = query_ollama_chat(
-                            chat_id, 
-                            aggregated_prompt, 
-                            current_knowledge,
-                            custom_system_prompt=effective_reactive_system_prompt
-                        )
+        effective_reactive_system_prompt = get_reactive_system_prompt()
+
+        reactive_request_stats = {}
+        reactive_streaming_delivery = None
+        cached_llm_response, reply_cache_lookup = await lookup_reply_cache(chat_id, aggregated_prompt, effective_reactive_system_prompt)
+        speculative_reply = None
+        if cached_llm_response is None:
+            speculative_reply = await g_speculative_generation.take_reply(chat_id, aggregated_prompt, effective_reactive_system_prompt, reactive_request_stats)
+        generation_seconds = 0.0
+
+        if cached_llm_response is not None:
+            logger.info("Process aggregated (Reactive Context): Reply cache %s for '%s'. Skipping LLM.", reply_cache_lookup["status"], chat_id)
+            llm_response = cached_llm_response
+            record_cached_reply_turn(chat_id, aggregated_prompt, llm_response)
+        elif speculative_reply is not None:
+            llm_response, generation_seconds = speculative_reply # Generated while the window was open; already in history
+        else:
+            generation_start_time = time.monotonic()
+            current_knowledge = await get_knowledge_for_query(aggregated_prompt)
+            if g_ollama_streaming_settings.get("enabled"):
+                reactive_streaming_delivery = StreamingReplyDelivery(
+                    chat_id, pre_message=g_fixed_pre_ai_response_message, persona_prefix=g_ai_persona_prefix_message,
+                    post_message=g_fixed_post_ai_response_message,
+                    flush_on=g_ollama_streaming_settings.get("flush_on", "sentence"),
+                    min_chunk_chars=g_ollama_streaming_settings.get("min_chunk_chars", 60), interaction_type="reactive")
+
+            llm_response = await g_llm_scheduler.submit(LLM_LANE_REACTIVE, chat_id, lambda: query_ollama_chat(
+                                chat_id, 
+                                aggregated_prompt, 
+                                current_knowledge,
+                                custom_system_prompt=effective_reactive_system_prompt,
+                                on_text_chunk=reactive_streaming_delivery.feed if reactive_streaming_delivery else None,
+                                request_stats=reactive_request_stats
+                            ))
+            generation_seconds = time.monotonic() - generation_start_time
         
         current_system_prompt_for_log = effective_reactive_system_prompt[:200]+"..."
-
+        llm_response_ok = bool(llm_response) and not llm_response.startswith("خطأ:") and not llm_response.startswith("Error:")
+        if llm_response_ok:
+            store_reply_in_cache(reply_cache_lookup, aggregated_prompt, llm_response, generation_seconds)
+
+        if reactive_streaming_delivery and (reactive_streaming_delivery.sent_messages or llm_response_ok):
+            # Streamed: pre-message/persona went out with the first segment; finish() adds the post-message.
+            await reactive_streaming_delivery.finish(error_text=None if llm_response_ok else (llm_response or "لم أتمكن من معالجة طلبك في الوقت الحالي."))
+            logger.info("Process aggregated (Reactive Context): Streamed reply to '%s' in %d message(s).", chat_id, len(reactive_streaming_delivery.sent_messages))
+            await log_interaction_turn(chat_id, "reactive", {
+                "role": "assistant", "content": reactive_streaming_delivery.delivered_text,
+                "llm_raw_response": llm_response, "streamed_messages": len(reactive_streaming_delivery.sent_messages),
+                "is_error": not llm_response_ok,
+                "system_prompt_used": current_system_prompt_for_log,
+                "token_usage": reactive_request_stats.get("token_usage"), "reply_cache": reply_cache_log_fields(reply_cache_lookup)
+            })
+            return
 
         final_reply_parts = []
         if g_fixed_pre_ai_response_message: final_reply_parts.append(g_fixed_pre_ai_response_message)
         
         actual_llm_content = ""
-        if llm_response and not llm_response.startswith("خطأ:") and not llm_response.startswith("Error:"):
+        if llm_response_ok:
              actual_llm_content = llm_response
              if g_ai_persona_prefix_message: final_reply_parts.append(g_ai_persona_prefix_message + actual_llm_content)
              else: final_reply_parts.append(actual_llm_content)
@@ -1323,12 +6350,13 @@ async def process_aggregated_messages(chat_id: str, sender_display_name: str):
         if final_reply_to_send:
             if wpp_client:
                 try:
-                    wpp_client.sendText(chat_id, final_reply_to_send) # REMOVED await
-                    logger.info("Process aggregated (Reactive Context): Final reply sent to '%s'.", chat_id)
+                    g_outbound_dispatcher.send_text(chat_id, final_reply_to_send, "reactive")
+                    logger.info("Process aggregated (Reactive Context): Final reply queued for '%s'.", chat_id)
                     await log_interaction_turn(chat_id, "reactive", { 
                         "role": "assistant", "content": final_reply_to_send, 
                         "llm_raw_response": llm_response, 
-                        "system_prompt_used": current_system_prompt_for_log
+                        "system_prompt_used": current_system_prompt_for_log,
+                        "token_usage": reactive_request_stats.get("token_usage"), "reply_cache": reply_cache_log_fields(reply_cache_lookup)
                     })
                 except Exception as e_send_reply:
                     logger.error("Process aggregated (Reactive Context): EXCEPTION sending reply to '%s': %s", sender_display_name, chat_id, e_send_reply)
@@ -1339,7 +6367,8 @@ async def process_aggregated_messages(chat_id: str, sender_display_name: str):
             await log_interaction_turn(chat_id, "reactive", { 
                 "role": "assistant", "content": "[No Reply Sent / LLM Error Handled]",
                 "llm_raw_response": llm_response, "is_error": True if llm_response and llm_response.startswith("خطأ:") else False,
-                "system_prompt_used": current_system_prompt_for_log
+                "system_prompt_used": current_system_prompt_for_log,
+                "token_usage": reactive_request_stats.get("token_usage")
             })
             
     else: 
@@ -1355,8 +6384,18 @@ async def delayed_message_processor(chat_id: str, sender_display_name: str, dela
     """
     Waits for a specified delay, then calls process_aggregated_messages.
     """
+    window_closed = False
     try:
-        await asyncio.sleep(delay)
+        pre_window_seconds = g_speculative_generation.pre_window_seconds(delay)
+        if pre_window_seconds is not None:
+            await asyncio.sleep(pre_window_seconds)
+            g_speculative_generation.maybe_start(chat_id) # Quiet long enough: start generating the reply in the background
+            await asyncio.sleep(delay - pre_window_seconds)
+        else:
+            await asyncio.sleep(delay)
+        g_adaptive_aggregation.on_window_closed(chat_id, delay)
+        window_closed = True
+        sender_display_name = await g_contact_name_cache.get_display_name(chat_id, fallback=sender_display_name)
         # CORRECTED LOG LINE: Added chat_id to the format string
         logger.info("Delayed processor: Timer of %.1fs expired for '%s' (chat_id: '%s'). Processing buffered messages.", delay, sender_display_name, chat_id)
         await process_aggregated_messages(chat_id, sender_display_name)
@@ -1367,7 +6406,10 @@ async def delayed_message_processor(chat_id: str, sender_display_name: str, dela
         logger.error("Delayed processor: Unexpected error for '%s' (chat_id: '%s'): %s", 
                      sender_display_name, chat_id, e_delayed_proc, exc_info=True) # Added chat_id here too for consistency
     finally:
-        if chat_id in USER_MESSAGE_TIMERS:
+        g_speculative_generation.release(chat_id)
+        if window_closed:
+            g_adaptive_aggregation.on_processing_done(chat_id)
+        if USER_MESSAGE_TIMERS.get(chat_id) is asyncio.current_task(): # A later fragment may already own the slot
             del USER_MESSAGE_TIMERS[chat_id]# --- END OF MESSAGE PROCESSING AND AGGREGATION LOGIC (PART 6 MODIFIED) ---
 
 # -----------------------------------------------------------------------------
@@ -1396,18 +6438,8 @@ async def on_new_message_received(message: dict):
     is_group_msg = message.get("isGroupMsg", False)
     is_from_me = message.get("fromMe", False)
 
-    sender_display_name = chat_id 
-    if wpp_client and chat_id: 
-        try:
-            contact_info = await asyncio.to_thread(wpp_client.getContact, chat_id) 
-            if contact_info and isinstance(contact_info, dict):
-                name_from_contact = contact_info.get("name") or \
-                                    contact_info.get("formattedName") or \
-                                    contact_info.get("pushname") or \
-                                    contact_info.get("shortName")
-                if name_from_contact: sender_display_name = name_from_contact
-        except Exception as e_get_contact:
-            logger.warning("Callback new_msg: Could not get contact name for '%s': %s. Using chat_id.", chat_id, e_get_contact)
+    # Cached name only: a missing name is looked up in the background once the fragment is buffered
+    sender_display_name = (g_contact_name_cache.get_cached(chat_id) if chat_id else None) or chat_id
 
     logger.info("Callback new_msg: From '%s' (ID: '%s'). Type: '%s'. Group: %s. FromMe: %s. Body: '%.50s...'",
                 sender_display_name, chat_id, message_type, is_group_msg, is_from_me, str(body_content))
@@ -1424,9 +6456,7 @@ async def on_new_message_received(message: dict):
         status_reply_msg = f"المساعد الآلي الآن {'يعمل (نشط)' if AI_IS_ACTIVE else 'متوقف (غير نشط)'}."
         logger.info("Callback new_msg: AI state toggled by '%s'. New state: %s. Persisted.",
                     sender_display_name, 'ACTIVE' if AI_IS_ACTIVE else 'INACTIVE')
-        if wpp_client:
-            try: wpp_client.sendText(chat_id, status_reply_msg) # REMOVED await
-            except Exception as e_send_status: logger.error("Callback new_msg: Error sending AI toggle status: %s", e_send_status)
+        g_outbound_dispatcher.send_text(chat_id, status_reply_msg, "reactive")
         
         await log_interaction_turn(chat_id, "reactive", {
             "role": "system_event", "content": f"AI Toggled to {AI_IS_ACTIVE} by user passphrase in on_new_message.",
@@ -1452,16 +6482,21 @@ async def on_new_message_received(message: dict):
             logger.info("Callback new_msg: Ignoring empty/non-string body from '%s'.", chat_id)
             return
 
+    if wpp_client:
+        g_contact_name_cache.prefetch(chat_id) # Single-flight; awaited (bounded) when the aggregation timer fires
     if chat_id not in USER_MESSAGE_BUFFERS: USER_MESSAGE_BUFFERS[chat_id] = []
     current_message_part_to_buffer = body_content if isinstance(body_content, str) else str(body_content) 
     USER_MESSAGE_BUFFERS[chat_id].append(current_message_part_to_buffer)
 
-    if chat_id in USER_MESSAGE_TIMERS and USER_MESSAGE_TIMERS[chat_id] and not USER_MESSAGE_TIMERS[chat_id].done():
-        USER_MESSAGE_TIMERS[chat_id].cancel()
+    pending_timer_task = USER_MESSAGE_TIMERS.get(chat_id)
+    if pending_timer_task and not pending_timer_task.done() and not g_adaptive_aggregation.is_processing(pending_timer_task):
+        g_speculative_generation.on_new_fragment(chat_id)
+        pending_timer_task.cancel() # Still aggregating: restart the window. A reply already in progress is left to finish.
 
     if MAIN_EVENT_LOOP:
+        aggregation_window_seconds = g_adaptive_aggregation.on_fragment(chat_id, current_message_part_to_buffer, is_admin_command_from_self_or_admin)
         USER_MESSAGE_TIMERS[chat_id] = MAIN_EVENT_LOOP.create_task(
-            delayed_message_processor(chat_id, sender_display_name, g_message_aggregation_delay) 
+            delayed_message_processor(chat_id, sender_display_name, aggregation_window_seconds) 
         )
     else:
         logger.critical("Callback new_msg: MAIN_EVENT_LOOP is None! Cannot schedule delayed processor for '%s'.", chat_id)
@@ -1508,11 +6543,24 @@ async def main_async_logic():
     if not MAIN_EVENT_LOOP:
         logger.critical("Main async: CRITICAL - Failed to get running asyncio event loop! Cannot proceed."); return
     logger.info("Main async: Main asyncio event loop captured: %s", MAIN_EVENT_LOOP)
-
-    startup_knowledge = load_knowledge_from_file(KNOWLEDGE_FILE_PATH) # Check knowledge file
-    if KNOWLEDGE_FILE_PATH and not startup_knowledge:
+    g_llm_scheduler.start(g_llm_scheduler_settings)
+    g_interaction_log_writer.start(g_log_writer_settings)
+    g_conversation_state_store.restore() # Before any message can touch histories/outreach state
+    g_conversation_state_store.start()
+    g_history_manager.start()
+    g_contact_name_cache.start()
+    g_message_ingress.start(MAIN_EVENT_LOOP)
+    g_outbound_dispatcher.start()
+    MAIN_EVENT_LOOP.create_task(g_campaign_engine.resume_all()) # Campaigns interrupted by the last shutdown/crash
+    log_maintenance_task = MAIN_EVENT_LOOP.create_task(log_maintenance_loop())
+
+    await asyncio.to_thread(g_knowledge_index.refresh_if_changed) # Check knowledge file and build the index
+    if KNOWLEDGE_FILE_PATH and not g_knowledge_index.full_text:
         logger.warning("Main async: Knowledge file '%s' configured but empty/unreadable.", KNOWLEDGE_FILE_PATH)
 
+    if g_prompt_cache_settings.get("warmup_on_startup", True):
+        MAIN_EVENT_LOOP.create_task(warmup_ollama_model("startup"))
+
     logger.info("Main async: Initialized/Loaded %d custom outreach prompts (from file).", len(g_outreach_prompts))
     logger.info("Main async: Admin config loaded. Current AI Active State: %s", AI_IS_ACTIVE)
 
@@ -1558,10 +6606,8 @@ async def main_async_logic():
                 
                 if MAIN_EVENT_LOOP and wpp_client:
                     def message_handler_wrapper(msg_dict_from_wpp):
-                        # This wrapper ensures on_new_message_received runs in the main event loop
-                        future = asyncio.run_coroutine_threadsafe(on_new_message_received(msg_dict_from_wpp), MAIN_EVENT_LOOP)
-                        try: future.result(timeout=30) # Optional: Add a timeout for the callback processing itself
-                        except Exception as e_future_exc: logger.error("Main Loop Callback: EXCEPTION in on_new_message_received: %s", e_future_exc, exc_info=True)
+                        # Runs on the WPP callback thread: only enqueue; on_new_message_received runs on the main event loop
+                        g_message_ingress.submit(msg_dict_from_wpp)
                     
                     wpp_client.onMessage(message_handler_wrapper)
                     logger.info("--- Main async: Ollama Outreach Assistant IS LIVE! Listening for messages... ---")
@@ -1573,6 +6619,9 @@ async def main_async_logic():
                     await asyncio.sleep(30)
                     current_wpp_state_monitoring = creator_instance.state if creator_instance else "N/A_NO_CREATOR"
                     logger.debug("Main async: Keep-alive. AI Active: %s. WPP State: '%s'. Model: '%s'.", AI_IS_ACTIVE, current_wpp_state_monitoring, g_ollama_model_name)
+                    rewarm_idle_seconds = float(g_prompt_cache_settings.get("rewarm_idle_seconds", 0) or 0)
+                    if rewarm_idle_seconds > 0 and (time.monotonic() - g_last_ollama_activity_time) >= rewarm_idle_seconds:
+                        MAIN_EVENT_LOOP.create_task(warmup_ollama_model("idle re-warm"))
                     if not creator_instance or current_wpp_state_monitoring != 'CONNECTED':
                         logger.warning("Main async: WhatsApp connection lost or creator invalid! State: '%s'. Reconnecting.", current_wpp_state_monitoring)
                         raise ConnectionAbortedError("WhatsApp connection lost during operation.")
@@ -1603,7 +6652,7 @@ async def main_async_logic():
     finally:
         logger.info("Main async: Final cleanup process initiated...")
         # ... (Timer cancellation logic from original Part 8) ...
-        active_timer_tasks_to_cancel = [task for task in USER_MESSAGE_TIMERS.values() if task and not task.done()]
+        active_timer_tasks_to_cancel = [task for task in {*USER_MESSAGE_TIMERS.values(), *g_adaptive_aggregation.processing_tasks()} if task and not task.done()]
         if active_timer_tasks_to_cancel:
             logger.info("Main async: Cancelling %d outstanding message timers...", len(active_timer_tasks_to_cancel))
             for task in active_timer_tasks_to_cancel: task.cancel()
@@ -1613,6 +6662,22 @@ async def main_async_logic():
         if 'creator_instance' in locals() and creator_instance:
             logger.info("Main async: Final attempt to close WPP creator instance...")
             await close_creator_async(creator_instance)
+
+        await g_message_ingress.stop() # Undrained messages are spilled for the next start
+        await g_campaign_engine.stop() # Before the scheduler and dispatcher its runners depend on
+        await g_speculative_generation.stop()
+        await g_conversation_summarizer.stop()
+        await g_llm_scheduler.stop()
+        await g_outbound_dispatcher.stop() # After the scheduler: replies still being generated are queued first
+        if 'log_maintenance_task' in locals():
+            log_maintenance_task.cancel()
+            await asyncio.gather(log_maintenance_task, return_exceptions=True)
+        await g_contact_name_cache.stop() # Persists resolved names
+        await g_history_manager.stop()
+        await g_conversation_state_store.stop() # Final commit + snapshot
+        await g_interaction_log_writer.stop() # Drains queued log lines to disk
+        await asyncio.to_thread(g_log_search_index.close)
+        await g_ollama_client.close()
         logger.info("--- Main async: Ollama Outreach Assistant Terminated ---")
 # -----------------------------------------------------------------------------
 # --- END OF MAIN ASYNCHRONOUS APPLICATION LOGIC (PART 8 MODIFIED) ---
@@ -1629,7 +6694,16 @@ if __name__ == "__main__":
         # Ensure INTERACTION_LOGS_DIR exists before asyncio.run, as logging might happen early
         # Though main_async_logic also checks, this is an earlier check.
         pathlib.Path(INTERACTION_LOGS_DIR).mkdir(parents=True, exist_ok=True)
-        asyncio.run(main_async_logic())
+        if "--import-jsonl-logs" in sys.argv[1:]:
+            import_jsonl_logs_to_sqlite_cli()
+        elif "--rebuild-search-index" in sys.argv[1:]:
+            rebuild_log_search_index_cli()
+        elif "--stats-csv" in sys.argv[1:]:
+            dump_analytics_csv_cli()
+        elif "--bench-memory" in sys.argv[1:]:
+            bench_memory_cli()
+        else:
+            asyncio.run(main_async_logic())
     except KeyboardInterrupt:
         print(f"{current_script_name}: Application terminated by user (KeyboardInterrupt in __main__) at {time.ctime()}.")
     except Exception as e_fatal_top_level:
@@ -0,0 +1,126 @@
+"""
+Shared fixtures for the AIaspects behaviour tests.
+- AIaspects needs WPP_Whatsapp at import time; the whole suite is skipped when it is not installed.
+- Every test runs in its own temporary working directory with a freshly loaded default admin config,
+  so the relative data paths (admin_config.json, interaction_logs/, state files) never touch the checkout.
+- StubOllama serves /api/chat and /api/embeddings on a free local port; use it as `async with stub_ollama:`.
+"""
+import asyncio, json, logging, pathlib, sys, time
+import pytest
+
+pytest.importorskip("WPP_Whatsapp")
+from aiohttp import web
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import AIaspects  # noqa: E402
+
+
+class FakeWppClient:
+    """Records sendText calls instead of talking to WhatsApp."""
+    def __init__(self):
+        self.sent: list[tuple[str, str]] = []
+
+    def sendText(self, chat_id, text):
+        self.sent.append((chat_id, text))
+        return {"id": len(self.sent)}
+
+    def getContact(self, chat_id):
+        return {"name": f"Name-{chat_id}"}
+
+
+class StubOllama:
+    """Minimal Ollama API: /api/chat echoes the last message, /api/embeddings hashes characters into 8 buckets."""
+    def __init__(self, reply_delay_seconds: float = 0.0):
+        self.reply_delay_seconds = reply_delay_seconds
+        self.chat_calls: list[dict] = []
+        self.embedding_calls: list[dict] = []
+        self.base_url = ""
+        self._runner = None
+
+    async def _chat(self, request):
+        body = await request.json()
+        self.chat_calls.append(body)
+        await asyncio.sleep(self.reply_delay_seconds)
+        last_content = body["messages"][-1]["content"] if body.get("messages") else ""
+        reply = {"message": {"role": "assistant", "content": f"جواب: {last_content}"}, "done": True,
+                 "prompt_eval_count": 100, "eval_count": 20}
+        if not body.get("stream"):
+            return web.json_response(reply)
+        response = web.StreamResponse()
+        response.content_type = "application/x-ndjson"
+        await response.prepare(request)
+        await response.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+        return response
+
+    async def _embeddings(self, request):
+        body = await request.json()
+        self.embedding_calls.append(body)
+        vector = [0.0] * 8
+        for ch in body.get("prompt", ""):
+            vector[ord(ch) % 8] += 1.0
+        return web.json_response({"embedding": vector})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/api/chat", self._chat)
+        app.router.add_post("/api/embeddings", self._embeddings)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.base_url = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+        AIaspects.g_ollama_api_base_url = self.base_url
+        AIaspects.g_ollama_chat_endpoint = f"{self.base_url}/api/chat"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await AIaspects.g_ollama_client.close()
+        await self._runner.cleanup()
+
+
+STATEFUL_SINGLETONS = (
+    "g_ollama_client", "g_llm_scheduler", "g_knowledge_embedding_index", "g_conversation_summarizer", "g_reply_cache",
+    "g_semantic_reply_cache", "g_interaction_log_writer", "g_log_search_index", "g_log_analytics", "g_contact_name_cache",
+    "g_message_ingress", "g_outbound_dispatcher", "g_campaign_engine", "g_conversation_state_store", "g_history_manager",
+    "g_adaptive_aggregation", "g_speculative_generation",
+)
+IN_MEMORY_STATE = ("CHAT_HISTORIES", "CHAT_SUMMARIES", "USER_MESSAGE_BUFFERS", "USER_MESSAGE_TIMERS",
+                   "ACTIVE_OUTREACH_CONVERSATIONS", "PREPARED_OUTREACHES", "LAST_DISPLAYED_LISTS")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    The AIaspects module, running in tmp_path with default settings, fresh service singletons,
+    empty in-memory chat state and a fake WhatsApp client (all restored after the test).
+    """
+    monkeypatch.chdir(tmp_path)
+    AIaspects.logger.setLevel(logging.WARNING)
+    for name in STATEFUL_SINGLETONS:
+        monkeypatch.setattr(AIaspects, name, type(getattr(AIaspects, name))())
+    for name in IN_MEMORY_STATE:
+        monkeypatch.setattr(AIaspects, name, type(getattr(AIaspects, name))())
+    monkeypatch.setattr(AIaspects, "g_log_backend", None)
+    monkeypatch.setattr(AIaspects, "g_knowledge_index", AIaspects.KnowledgeIndex(""))
+    monkeypatch.setattr(AIaspects, "wpp_client", FakeWppClient())
+    AIaspects.load_admin_config()
+    return AIaspects
+
+
+@pytest.fixture
+def stub_ollama(app):
+    return StubOllama()
+
+
+async def _wait_until(predicate, timeout_seconds: float = 5.0):
+    deadline = time.monotonic() + timeout_seconds
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def wait_until():
+    """`await wait_until(predicate)` polls predicate() until it is truthy (fails after timeout_seconds)."""
+    return _wait_until
@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+
+def log_old_turns(app, chat_id, count):
+    """Turns dated 2020, so the next maintenance pass rotates the file by age and compresses the segment."""
+    for turn_number in range(count):
+        turn_data = {"timestamp_iso": f"2020-01-01T10:00:0{turn_number}Z", "role": "user", "content": f"رسالة {turn_number}"}
+        app.store_log_records([(chat_id, "reactive", turn_data, json.dumps(turn_data, ensure_ascii=False))], False)
+
+
+def admin(app, command):
+    asyncio.run(app.handle_admin_command(app.ADMIN_CHAT_ID, f"{app.g_command_prefix}{command}"))
+    return app.wpp_client.sent[-1][1]
+
+
+def test_rotate_and_compress_between_stats_does_not_recount(app, tmp_path):
+    log_old_turns(app, "111@c.us", 3)
+
+    assert "3 new turn(s)" in admin(app, "stats all")
+    rotate_reply = admin(app, "rotatelogs")
+    assert "1 rotated, 1 compressed" in rotate_reply
+    assert list((tmp_path / "interaction_logs" / "111_c.us").glob("reactive_history.*.jsonl.gz"))
+    assert "0 new turn(s)" in admin(app, "stats all")
+    assert app.g_log_analytics.report("all")["totals"]["turns"] == 3
+
+
+def test_segment_compressed_before_analytics_caught_up_reads_only_the_rest(app):
+    log_old_turns(app, "111@c.us", 2)
+    assert app.g_log_analytics.update() == 2
+    log_old_turns(app, "111@c.us", 1) # Logged after the last pass...
+    app.get_log_backend().maintain() # ...then rotated and compressed before analytics saw it
+
+    assert app.g_log_analytics.update() == 1
+    assert app.g_log_analytics.report("all")["totals"]["turns"] == 3
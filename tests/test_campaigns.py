@@ -0,0 +1,86 @@
+import asyncio
+
+
+def create_sending_campaign(app, name, target_count):
+    """A campaign whose targets are all approved, as after `$campaign approve <name> all`."""
+    store = app.g_campaign_engine.get_store()
+    store.create_campaign(name, "system", "initiator", f"campaign:{name}", [(f"2010000000{n}@c.us", {}) for n in range(target_count)])
+    for idx in range(target_count):
+        store.update_target(name, idx, "approved", f"offer {idx}")
+    store.set_campaign_status(name, "sending")
+    return store
+
+
+def target_states(store, name):
+    return {state: count for state, count in store.state_counts(name).items() if count}
+
+
+def campaign_sends(app):
+    return [text for chat_id, text in app.wpp_client.sent if chat_id != app.ADMIN_CHAT_ID]
+
+
+def test_pausing_twice_is_rejected_and_keeps_the_resume_status(app, wait_until):
+    app.g_outbound_send_settings.update({"rate_per_second": 5.0, "burst": 1})
+    app.g_outreach_campaign_settings["send_window"] = 1
+    store = create_sending_campaign(app, "spring", 3)
+    engine = app.g_campaign_engine
+
+    async def scenario():
+        app.g_outbound_dispatcher.start()
+        engine.start_runner("spring")
+        await wait_until(lambda: len(campaign_sends(app)) == 1)
+        first_pause = await engine.pause("spring")
+        second_pause = await engine.pause("spring")
+        await app.handle_admin_command(app.ADMIN_CHAT_ID, f"{app.g_command_prefix}campaign pause spring")
+        paused_campaign = store.get_campaign("spring")
+        resumed_status = await engine.resume("spring")
+        await wait_until(lambda: store.get_campaign("spring")["status"] == "completed")
+        await app.g_outbound_dispatcher.stop()
+        return first_pause, second_pause, paused_campaign, resumed_status
+
+    first_pause, second_pause, paused_campaign, resumed_status = asyncio.run(scenario())
+    assert (first_pause, second_pause) == (True, False)
+    assert (paused_campaign["status"], paused_campaign["resume_status"]) == ("paused", "sending")
+    assert any("nothing to pause" in text for chat_id, text in app.wpp_client.sent if chat_id == app.ADMIN_CHAT_ID)
+    assert resumed_status == "sending"
+    assert target_states(store, "spring") == {"sent": 3}
+
+
+def test_cancel_withdraws_the_campaigns_queued_sends(app, wait_until):
+    app.g_outbound_send_settings.update({"rate_per_second": 0.2, "burst": 1})
+    app.g_outreach_campaign_settings["send_window"] = 3
+    store = create_sending_campaign(app, "spring", 3)
+    dispatcher = app.g_outbound_dispatcher
+
+    async def scenario():
+        dispatcher.start()
+        app.g_campaign_engine.start_runner("spring")
+        await wait_until(lambda: len(campaign_sends(app)) == 1 and dispatcher.backlog == 2) # The other two wait ~5s for pacing
+        await asyncio.wait_for(app.g_campaign_engine.cancel("spring"), 2.0)
+        backlog_after_cancel = dispatcher.backlog
+        await dispatcher.stop()
+        return backlog_after_cancel
+
+    assert asyncio.run(scenario()) == 0
+    assert campaign_sends(app) == ["offer 0"]
+    assert store.get_campaign("spring")["status"] == "cancelled"
+    assert target_states(store, "spring") == {"sent": 1, "skipped": 2}
+
+
+def test_torn_down_runner_marks_its_in_flight_sends_unknown(app, wait_until):
+    app.g_outbound_send_settings.update({"rate_per_second": 0.2, "burst": 1})
+    app.g_outreach_campaign_settings["send_window"] = 2
+    store = create_sending_campaign(app, "spring", 3)
+    engine = app.g_campaign_engine
+
+    async def scenario():
+        app.g_outbound_dispatcher.start()
+        engine.start_runner("spring")
+        await wait_until(lambda: len(campaign_sends(app)) == 1 and app.g_outbound_dispatcher.backlog == 2) # Offers 1 and 2 wait for pacing
+        await engine._stop_runner("spring", timeout_seconds=0.1) # As at shutdown when a paced send outlasts the timeout
+        states = target_states(store, "spring")
+        await app.g_outbound_dispatcher.stop(drain_timeout_seconds=0)
+        return states
+
+    assert asyncio.run(scenario()) == {"sent": 1, "send_unknown": 2}
+    assert store.get_campaign("spring")["status"] == "sending" # resume_all() continues it at the next start
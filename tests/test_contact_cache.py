@@ -0,0 +1,22 @@
+import asyncio
+import threading
+
+
+def test_cancelled_lookup_releases_waiters_and_inflight_entry(app, monkeypatch, wait_until):
+    release_lookup = threading.Event()
+    monkeypatch.setattr(app.wpp_client, "getContact", lambda chat_id: release_lookup.wait(5) and {"name": "Late"}, raising=False)
+
+    async def scenario():
+        cache = app.g_contact_name_cache
+        waiter = asyncio.ensure_future(cache.get_display_name("111@c.us", "fallback"))
+        await wait_until(lambda: "111@c.us" in cache._inflight)
+        for task in asyncio.all_tasks():
+            if task not in (asyncio.current_task(), waiter): task.cancel() # The lookup task, as at shutdown
+        display_name = await waiter
+        release_lookup.set()
+        return display_name, dict(cache._inflight), cache.get_cached("111@c.us")
+
+    display_name, inflight, cached_name = asyncio.run(scenario())
+    assert display_name == "fallback"
+    assert inflight == {}
+    assert cached_name is None # Not cached as "no name": the next message retries the lookup
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+
+def use_recording_processor(app, monkeypatch, processed, block_on=None):
+    """on_new_message_received that records message ids and hangs (until cancelled) on the first `block_on` message."""
+    blocked = []
+
+    async def process(message):
+        processed.append(message["id"])
+        if message["id"] == block_on and not blocked:
+            blocked.append(message["id"])
+            await asyncio.Event().wait()
+
+    monkeypatch.setattr(app, "on_new_message_received", process)
+
+
+def test_stop_during_spill_replay_keeps_unprocessed_messages_for_next_start(app, monkeypatch, tmp_path, wait_until):
+    app.g_message_ingress_settings.update({"max_queue_size": 1, "overflow_policy": "spill"})
+    processed = []
+    use_recording_processor(app, monkeypatch, processed, block_on="m3")
+    ingress = app.g_message_ingress
+
+    async def first_run():
+        ingress.start(asyncio.get_running_loop())
+        for message_number in range(5): # m0 fits in memory, m1-m4 overflow to the spill file
+            ingress.submit({"id": f"m{message_number}"})
+        await wait_until(lambda: "m3" in processed) # Replay of m1..m4 is stuck on m3
+        await ingress.stop(drain_timeout_seconds=0)
+
+    asyncio.run(first_run())
+    replay_path = tmp_path / "ingress_spill.jsonl.replay"
+    assert [json.loads(line)["message"]["id"] for line in replay_path.read_text(encoding="utf-8").splitlines()] == ["m3", "m4"]
+
+    async def second_run():
+        ingress.start(asyncio.get_running_loop())
+        await wait_until(lambda: processed.count("m3") == 2 and "m4" in processed)
+        await ingress.stop()
+
+    asyncio.run(second_run())
+    assert processed == ["m0", "m1", "m2", "m3", "m3", "m4"] # m3 was interrupted, so it is replayed again
+    assert not replay_path.exists()
+    assert not (tmp_path / "ingress_spill.jsonl").exists()
+
+
+def test_start_resumes_a_replay_file_left_by_a_crash_before_the_spill_file(app, monkeypatch, tmp_path, wait_until):
+    (tmp_path / "ingress_spill.jsonl.replay").write_text(json.dumps({"submitted_at": 0, "message": {"id": "older"}}) + "\n", encoding="utf-8")
+    (tmp_path / "ingress_spill.jsonl").write_text(json.dumps({"submitted_at": 0, "message": {"id": "newer"}}) + "\n", encoding="utf-8")
+    processed = []
+    use_recording_processor(app, monkeypatch, processed)
+
+    async def scenario():
+        app.g_message_ingress.start(asyncio.get_running_loop())
+        await wait_until(lambda: len(processed) == 2)
+        await app.g_message_ingress.stop()
+
+    asyncio.run(scenario())
+    assert processed == ["older", "newer"]
+    assert not list(tmp_path.glob("ingress_spill*"))
@@ -0,0 +1,74 @@
+import asyncio
+import json
+import threading
+import time
+
+
+def turn(content, role="user"):
+    return {"role": role, "content": content}
+
+
+def test_flush_waits_for_the_batch_being_written(app, monkeypatch, wait_until):
+    release_write = threading.Event()
+    original_store = app.store_log_records
+
+    def slow_store(log_records, do_fsync):
+        release_write.wait(5)
+        return original_store(log_records, do_fsync)
+
+    monkeypatch.setattr(app, "store_log_records", slow_store)
+
+    async def scenario():
+        writer = app.g_interaction_log_writer
+        writer.start({"batch_max_delay_seconds": 0.01})
+        await app.log_interaction_turn("111@c.us", "reactive", turn("مرحبا"))
+        await wait_until(lambda: writer._batch_in_flight and not writer.backlog)
+        flush_task = asyncio.ensure_future(writer.flush())
+        await asyncio.sleep(0.05)
+        flushed_early = flush_task.done()
+        release_write.set()
+        await flush_task
+        stored = await asyncio.to_thread(app.get_log_backend().read_recent_turns, "111@c.us", "reactive", 10)
+        await writer.stop()
+        return flushed_early, stored
+
+    flushed_early, stored = asyncio.run(scenario())
+    assert not flushed_early
+    assert [t["content"] for t in stored] == ["مرحبا"]
+
+
+def log_record(chat_id, content, timestamp_iso, interaction_type="reactive"):
+    turn_data = {"timestamp_iso": timestamp_iso, "role": "user", "content": content}
+    return (chat_id, interaction_type, turn_data, json.dumps(turn_data, ensure_ascii=False))
+
+
+def test_jsonl_retention_prunes_search_hits_of_deleted_segments(app):
+    app.g_log_rotation_settings.update({"max_file_bytes": 1, "max_file_age_days": 0, "retention_days": 0, "max_segments_per_file": 2})
+    for content, day in (("برتقال", 1), ("تفاح", 2), ("موز", 3)): # Every write rotates into its own segment
+        app.store_log_records([log_record("111@c.us", content, f"2020-01-0{day}T10:00:00Z")], False)
+
+    pass_stats = app.get_log_backend().maintain()
+
+    assert pass_stats["deleted"] == 1
+    assert app.g_log_search_index.search("برتقال") == []
+    assert [hit["snippet"] for hit in app.g_log_search_index.search("تفاح")] == ["تفاح"]
+    assert [hit["snippet"] for hit in app.g_log_search_index.search("موز")] == ["موز"]
+
+
+def test_sqlite_retention_prunes_search_hits_and_rebuild_reads_sqlite(app, capsys):
+    app.g_admin_config["log_storage"]["backend"] = "sqlite"
+    app.save_admin_config(); app.load_admin_config()
+    app.g_log_rotation_settings["retention_days"] = 30
+    recent_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    app.store_log_records([log_record("111@c.us", "برتقال", "2020-01-01T10:00:00Z"),
+                           log_record("111@c.us", "تفاح", recent_iso)], False)
+
+    assert app.get_log_backend().maintain()["deleted"] == 1
+    assert app.g_log_search_index.search("برتقال") == []
+    assert len(app.g_log_search_index.search("تفاح")) == 1
+
+    app.get_log_backend().close(); app.g_log_search_index.close()
+    app.g_log_backend = None
+    app.rebuild_log_search_index_cli()
+    assert "Indexed 1 logged turn(s) from './interaction_logs/interaction_logs.sqlite3'" in capsys.readouterr().out
+    assert len(app.g_log_search_index.search("تفاح")) == 1
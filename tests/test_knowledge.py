@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+
+
+KNOWLEDGE_TEXT = (
+    "خدمة تصميم الشعار: السعر 500 ريال.\n\n"
+    "خدمة إدارة حسابات التواصل الاجتماعي: 1500 ريال شهريًا.\n\n"
+    "ساعات العمل من التاسعة صباحاً حتى الخامسة مساءً."
+)
+
+
+def write_knowledge(tmp_path, text=KNOWLEDGE_TEXT):
+    knowledge_path = tmp_path / "knowledge.txt"
+    knowledge_path.write_text(text, encoding="utf-8")
+    return str(knowledge_path)
+
+
+def test_concurrent_refreshes_build_the_index_once(app, tmp_path, monkeypatch):
+    index = app.KnowledgeIndex(write_knowledge(tmp_path))
+    rebuilds = []
+    original_rebuild = index._rebuild
+    monkeypatch.setattr(index, "_rebuild", lambda *args: (rebuilds.append(args), original_rebuild(*args)))
+
+    async def scenario():
+        await asyncio.gather(*(index.refresh_if_due(0.0) for _ in range(8)))
+
+    asyncio.run(scenario())
+    assert len(rebuilds) == 1
+    assert index.version == 1
+
+
+def test_changing_chunk_max_chars_rebuilds_the_index(app, tmp_path):
+    app.g_knowledge_settings["chunk_max_chars"] = 1000
+    index = app.KnowledgeIndex(write_knowledge(tmp_path))
+    assert index.refresh_if_changed()
+    assert len(index.chunks) == 1
+    assert not index.refresh_if_changed()
+
+    app.g_knowledge_settings["chunk_max_chars"] = 60
+    assert index.refresh_if_changed()
+    assert len(index.chunks) == 3
+
+
+def use_embedding_mode(app, monkeypatch, knowledge_path):
+    app.g_knowledge_settings.update({"mode": "embedding", "chunk_max_chars": 60, "embedding_base_url": ""})
+    monkeypatch.setattr(app, "g_knowledge_index", app.KnowledgeIndex(knowledge_path))
+    monkeypatch.setattr(app, "g_knowledge_embedding_index", app.KnowledgeEmbeddingIndex())
+
+
+def test_embedding_mode_reuses_persisted_vectors_after_restart(app, tmp_path, monkeypatch, stub_ollama):
+    pytest.importorskip("numpy")
+    knowledge_path = write_knowledge(tmp_path)
+
+    async def scenario():
+        async with stub_ollama:
+            use_embedding_mode(app, monkeypatch, knowledge_path)
+            first_knowledge = await app.get_knowledge_for_query("ساعات العمل")
+            first_calls = len(stub_ollama.embedding_calls)
+
+            use_embedding_mode(app, monkeypatch, knowledge_path) # Simulated restart: index reloaded from disk
+            with open(knowledge_path, "a", encoding="utf-8") as f: f.write("\n\nجديد: خدمة الطباعة.")
+            second_knowledge = await app.get_knowledge_for_query("الطباعة")
+            return first_knowledge, first_calls, second_knowledge, len(stub_ollama.embedding_calls) - first_calls
+
+    first_knowledge, first_calls, second_knowledge, second_calls = asyncio.run(scenario())
+    assert first_knowledge and first_calls == 4 # 3 chunks + the query
+    assert "الطباعة" in second_knowledge
+    assert second_calls == 2 # Only the new chunk + the query
+    assert sorted(p.name for p in (tmp_path / "knowledge_index").iterdir()) == [
+        "knowledge_embeddings.npy", "knowledge_embeddings_manifest.json"]
+
+
+def test_embedding_search_survives_a_rebuild_while_embedding_the_query(app, tmp_path, monkeypatch, stub_ollama):
+    pytest.importorskip("numpy")
+    knowledge_path = write_knowledge(tmp_path)
+
+    async def scenario():
+        async with stub_ollama:
+            use_embedding_mode(app, monkeypatch, knowledge_path)
+            await app.get_knowledge_for_query("ساعات العمل")
+            embedding_index = app.g_knowledge_embedding_index
+            original_embed_text = embedding_index.embed_text
+
+            async def embed_and_shrink_knowledge(text):
+                with open(knowledge_path, "w", encoding="utf-8") as f: f.write("نص قصير.")
+                await asyncio.to_thread(app.g_knowledge_index.refresh_if_changed)
+                return await original_embed_text(text)
+
+            monkeypatch.setattr(embedding_index, "embed_text", embed_and_shrink_knowledge)
+            return await embedding_index.search("ساعات العمل", 3)
+
+    ranked_chunks = asyncio.run(scenario())
+    assert len(ranked_chunks) == 3
+    assert all(chunk in KNOWLEDGE_TEXT for _, chunk in ranked_chunks)
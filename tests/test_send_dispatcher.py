@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+
+def test_admin_message_is_not_held_behind_pacing(app, wait_until):
+    app.g_outbound_send_settings.update({"rate_per_second": 1.0, "burst": 1})
+    dispatcher, sent = app.g_outbound_dispatcher, app.wpp_client.sent
+
+    async def scenario():
+        dispatcher.start()
+        customer_futures = [dispatcher.send_text("111@c.us", f"customer {n}") for n in range(3)]
+        await wait_until(lambda: len(sent) == 1) # The burst token is used; the next customer send waits ~1s
+        admin_queued_at = time.monotonic()
+        admin_future = dispatcher.send_text(app.ADMIN_CHAT_ID, "admin reply")
+        await admin_future
+        admin_latency = time.monotonic() - admin_queued_at
+        await asyncio.gather(*customer_futures)
+        await dispatcher.stop()
+        return admin_latency
+
+    admin_latency = asyncio.run(scenario())
+    assert admin_latency < 0.3
+    assert [text for _, text in sent] == ["customer 0", "admin reply", "customer 1", "customer 2"]
+
+
+def test_failure_inside_send_text_is_unknown_and_not_retried(app, monkeypatch):
+    attempts = []
+
+    def timing_out_send(chat_id, text):
+        attempts.append(text)
+        raise TimeoutError("page.evaluate timed out")
+
+    monkeypatch.setattr(app.wpp_client, "sendText", timing_out_send)
+    dispatcher = app.g_outbound_dispatcher
+
+    async def scenario():
+        dispatcher.start()
+        delivered = await dispatcher.send_text("111@c.us", "hello", "reactive")
+        await dispatcher.stop()
+        await app.g_interaction_log_writer.flush()
+        return delivered
+
+    assert asyncio.run(scenario()) is None
+    assert attempts == ["hello"]
+    assert dispatcher.stats["unknown"] == 1 and dispatcher.stats["retries"] == 0
+    logged = app.get_log_backend().read_recent_turns("111@c.us", "reactive", 5)
+    assert logged[-1]["delivery_status"] == "unknown"
+
+
+def test_send_before_the_client_connects_is_retried(app, monkeypatch, wait_until):
+    app.g_outbound_send_settings.update({"retry_base_delay_seconds": 0.05})
+    fake_client = app.wpp_client
+    monkeypatch.setattr(app, "wpp_client", None)
+    dispatcher = app.g_outbound_dispatcher
+
+    async def scenario():
+        dispatcher.start()
+        send_future = dispatcher.send_text("111@c.us", "hello")
+        await wait_until(lambda: dispatcher.stats["retries"] >= 1)
+        app.wpp_client = fake_client # Reconnected
+        delivered = await send_future
+        await dispatcher.stop()
+        return delivered
+
+    assert asyncio.run(scenario()) is True
+    assert fake_client.sent == [("111@c.us", "hello")]
@@ -0,0 +1,26 @@
+import asyncio
+
+from conftest import StubOllama
+
+
+def test_adopted_reply_is_cached_with_its_own_generation_time(app, monkeypatch):
+    monkeypatch.setattr(app, "g_message_aggregation_delay", 1.0)
+    app.g_adaptive_aggregation_settings["enabled"] = False
+    app.g_speculative_generation_settings.update({"enabled": True, "quiet_fraction": 0.2, "min_quiet_seconds": 0.1, "min_lead_seconds": 0.1})
+    cached_generation_seconds = []
+    monkeypatch.setattr(app, "store_reply_in_cache", lambda cache_lookup, prompt_text, reply_text, generation_seconds:
+                        cached_generation_seconds.append(generation_seconds))
+
+    async def scenario():
+        monkeypatch.setattr(app, "MAIN_EVENT_LOOP", asyncio.get_running_loop())
+        async with StubOllama(reply_delay_seconds=0.3):
+            app.g_llm_scheduler.start(app.g_llm_scheduler_settings)
+            await app.on_new_message_received({"from": "111@c.us", "body": "كم سعر الشعار؟", "type": "chat", "isGroupMsg": False, "fromMe": False})
+            while "111@c.us" in app.USER_MESSAGE_TIMERS: # Speculates after ~0.2s, finishes ~0.3s later, window closes at 1s
+                await asyncio.sleep(0.01)
+            await app.g_llm_scheduler.stop()
+
+    asyncio.run(scenario())
+    assert app.g_speculative_generation.outcome_counts == {"adopted_finished": 1}
+    assert len(cached_generation_seconds) == 1 and 0.25 <= cached_generation_seconds[0] < 0.7
+    assert "جواب: كم سعر الشعار؟" in [text for chat_id, text in app.wpp_client.sent if chat_id == "111@c.us"][-1]
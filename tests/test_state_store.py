@@ -0,0 +1,50 @@
+import asyncio
+from collections import deque
+
+
+def test_snapshot_captures_only_entries_changed_since_the_last_commit(app, monkeypatch):
+    store = app.g_conversation_state_store
+    for chat_number in range(50):
+        chat_id = f"2010000{chat_number:04d}@c.us"
+        app.CHAT_HISTORIES[chat_id] = deque([{"role": "user", "content": f"مرحبا {chat_number}"}])
+        store.mark_dirty("history", chat_id)
+    app.CHAT_SUMMARIES["reactive:20100000000@c.us"] = "ملخص"
+    store.mark_dirty("summary", "reactive:20100000000@c.us")
+    captured = []
+    original_capture = app.capture_state_entity
+
+    def counting_capture(kind, key):
+        captured.append((kind, key))
+        return original_capture(kind, key)
+
+    async def scenario():
+        await store._commit()
+        monkeypatch.setattr(app, "capture_state_entity", counting_capture)
+        app.CHAT_HISTORIES["20100000001@c.us"].append({"role": "assistant", "content": "أهلا"})
+        store.mark_dirty("history", "20100000001@c.us")
+        del app.CHAT_HISTORIES["20100000002@c.us"]
+        store.mark_dirty("history", "20100000002@c.us")
+        await store.snapshot()
+
+    asyncio.run(scenario())
+    assert sorted(captured) == [("history", "20100000001@c.us"), ("history", "20100000002@c.us")]
+    recovered_state = app.ConversationStateStore().load_state()
+    assert len(recovered_state["history"]) == 49 and "20100000002@c.us" not in recovered_state["history"]
+    assert [turn["content"] for turn in recovered_state["history"]["20100000001@c.us"]] == ["مرحبا 1", "أهلا"]
+    assert recovered_state["summary"] == {"reactive:20100000000@c.us": "ملخص"}
+    assert recovered_state["meta"]["next_prepared_id"] == app.g_next_prepared_id_counter
+
+
+def test_snapshot_after_restore_keeps_state_that_was_not_changed(app):
+    app.CHAT_HISTORIES["111@c.us"] = deque([{"role": "user", "content": "قديم"}])
+    app.g_conversation_state_store.mark_dirty("history", "111@c.us")
+    asyncio.run(app.g_conversation_state_store.snapshot())
+    app.CHAT_HISTORIES.clear()
+
+    restarted_store = app.ConversationStateStore()
+    assert restarted_store.restore() == 1
+    app.CHAT_HISTORIES["222@c.us"] = deque([{"role": "user", "content": "جديد"}])
+    restarted_store.mark_dirty("history", "222@c.us")
+    asyncio.run(restarted_store.snapshot())
+
+    assert sorted(app.ConversationStateStore().load_state()["history"]) == ["111@c.us", "222@c.us"]